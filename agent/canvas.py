@@ -13,14 +13,79 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import hashlib
 import logging
 import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from copy import deepcopy
 from functools import partial
-import pandas as pd
+from timeit import default_timer as timer
+from typing import Union
 
 from agent.component import component_class
 from agent.component.base import ComponentBase
+from agent.records import Records
+
+CANVAS_MAX_WORKERS = int(os.environ.get("CANVAS_MAX_WORKERS", 8))
+# Components that route the flow, change the canvas state others read, or read outputs of components they don't
+# declare as dependencies (Invoke's variables, Code's arguments), always run on their own.
+SEQUENTIAL_COMPONENTS = {"switch", "categorize", "relevant", "iteration", "iterationitem", "rewritequestion",
+                         "invoke", "code"}
+_component_executor = None
+CANVAS_CACHE_SIZE = int(os.environ.get("CANVAS_CACHE_SIZE", 128))
+# Parameters a run changes. They belong to the session, everything else comes from the compiled template.
+STATE_PARAMS = ("output", "inputs", "query", "infor")
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def _component_pool():
+    global _component_executor
+    if _component_executor is None:
+        _component_executor = ThreadPoolExecutor(max_workers=CANVAS_MAX_WORKERS, thread_name_prefix="canvas")
+    return _component_executor
+
+
+def _template_key(components):
+    tpl = {}
+    for k, cpn in components.items():
+        tpl[k] = [cpn["obj"]["component_name"], {p: v for p, v in cpn["obj"]["params"].items() if p not in STATE_PARAMS}]
+    return hashlib.md5(json.dumps(tpl, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _compile(components):
+    """
+    Parses and checks the parameters of every component once per canvas version.
+    Returns {component_id: param}, the params carry no session state and must be copied before use.
+    """
+    key = _template_key(components)
+    with _compiled_lock:
+        params = _compiled.get(key)
+        if params is not None:
+            _compiled.move_to_end(key)
+            return params
+
+    params = {}
+    for k, cpn in components.items():
+        param = component_class(cpn["obj"]["component_name"] + "Param")()
+        param.update(deepcopy({p: v for p, v in cpn["obj"]["params"].items() if p not in STATE_PARAMS}))
+        param.check()
+        params[k] = param
+
+    with _compiled_lock:
+        _compiled[key] = params
+        while len(_compiled) > CANVAS_CACHE_SIZE:
+            _compiled.popitem(last=False)
+    return params
+
+
+def _timed_run(cpn, history, **kwargs):
+    st = timer()
+    cpn.run(history, **kwargs)
+    return timer() - st
 
 
 class Canvas:
@@ -68,13 +133,15 @@ class Canvas:
     }
     """
 
-    def __init__(self, dsl: str, tenant_id=None):
+    def __init__(self, dsl: Union[str, dict], tenant_id=None):
         self.path = []
         self.history = []
         self.messages = []
         self.answer = []
         self.components = {}
-        self.dsl = json.loads(dsl) if dsl else {
+        if isinstance(dsl, str):
+            dsl = json.loads(dsl) if dsl else None
+        self.dsl = dsl if dsl else {
             "components": {
                 "begin": {
                     "obj": {
@@ -99,24 +166,28 @@ class Canvas:
         self.load()
 
     def load(self):
-        self.components = self.dsl["components"]
         cpn_nms = set([])
-        for k, cpn in self.components.items():
+        for k, cpn in self.dsl["components"].items():
             cpn_nms.add(cpn["obj"]["component_name"])
 
         assert "Begin" in cpn_nms, "There have to be an 'Begin' component."
         assert "Answer" in cpn_nms, "There have to be an 'Answer' component."
 
-        for k, cpn in self.components.items():
-            cpn_nms.add(cpn["obj"]["component_name"])
-            param = component_class(cpn["obj"]["component_name"] + "Param")()
-            param.update(cpn["obj"]["params"])
-            param.check()
-            cpn["obj"] = component_class(cpn["obj"]["component_name"])(self, k, param)
-            if cpn["obj"].component_name == "Categorize":
+        # The dsl given is left as it is, components get their own copy holding the instances.
+        compiled = _compile(self.dsl["components"])
+        self.components = {}
+        for k, cpn in self.dsl["components"].items():
+            param = deepcopy(compiled[k])
+            for p in STATE_PARAMS:
+                if p in cpn["obj"]["params"]:
+                    setattr(param, p, cpn["obj"]["params"][p])
+            self.components[k] = {**cpn, "obj": component_class(cpn["obj"]["component_name"])(self, k, param)}
+            if "downstream" in cpn:
+                self.components[k]["downstream"] = list(cpn["downstream"])
+            if self.components[k]["obj"].component_name == "Categorize":
                 for _, desc in param.category_description.items():
-                    if desc["to"] not in cpn["downstream"]:
-                        cpn["downstream"].append(desc["to"])
+                    if desc["to"] not in self.components[k]["downstream"]:
+                        self.components[k]["downstream"].append(desc["to"])
 
         self.path = self.dsl["path"]
         self.history = self.dsl["history"]
@@ -150,6 +221,35 @@ class Canvas:
                 dsl["components"][k][c] = deepcopy(cpn[c])
         return json.dumps(dsl, ensure_ascii=False)
 
+    def state(self):
+        """
+        What a session changes on the canvas: the conversation, the path and the components' outputs.
+        """
+        return {
+            "path": self.path,
+            "history": self.history,
+            "messages": self.messages,
+            "answer": self.answer,
+            "reference": self.reference,
+            "embed_id": self._embed_id,
+            "components": {k: cpn["obj"].state() for k, cpn in self.components.items()}
+        }
+
+    def dump(self, dsl: dict):
+        """
+        Writes the session state into `dsl`, the stored dsl this canvas was loaded from, in place.
+        Unlike `str(canvas)`, the components' templates are neither copied nor serialized again,
+        but the whole dsl, history included, is still what gets stored: the web UI and the session APIs read it.
+        """
+        state = self.state()
+        for k, params in state.pop("components").items():
+            obj = dsl["components"][k]["obj"]
+            obj["params"].update(params)
+            for p in ("output", "inputs"):
+                obj[p] = params.get(p)
+        dsl.update(state)
+        return dsl
+
     def reset(self):
         self.path = []
         self.history = []
@@ -195,16 +295,54 @@ class Canvas:
         waiting = []
         without_dependent_checking = []
 
+        def run_batch(batch):
+            # The components of a batch do not depend on each other: they run concurrently and are added
+            # to the path in the order they were scheduled once all of them are done.
+            nonlocal ran
+            if len(batch) == 1:
+                futures = {}
+                c, cpn = batch[0]
+                try:
+                    yield "*'{}'* finished in {:.2f}s".format(self.get_component_name(c), _timed_run(cpn, self.history, **kwargs))
+                except Exception as e:
+                    logging.exception(f"Canvas.run got exception: {e}")
+                    self.path[-1].append(c)
+                    ran += 1
+                    raise e
+            else:
+                futures = {_component_pool().submit(_timed_run, cpn, self.history, **kwargs): c for c, cpn in batch}
+            error = None
+            for f in as_completed(futures):
+                c = futures[f]
+                try:
+                    yield "*'{}'* finished in {:.2f}s".format(self.get_component_name(c), f.result())
+                except Exception as e:
+                    logging.exception(f"Canvas.run got exception: {e}")
+                    error = error or e
+            for c, _ in batch:
+                self.path[-1].append(c)
+            batch.clear()
+            if error:
+                ran += 1
+                raise error
+
         def prepare2run(cpns):
-            nonlocal ran, ans
+            nonlocal ran
+            batch = []
             for c in cpns:
                 if self.path[-1] and c == self.path[-1][-1]:
                     continue
+                if any([c == b for b, _ in batch]):
+                    continue
                 cpn = self.components[c]["obj"]
                 if cpn.component_name == "Answer":
                     self.answer.append(c)
                 else:
                     logging.debug(f"Canvas.prepare2run: {c}")
+                    depends = set(cpn.get_dependent_components()) | set(self.components[c]["upstream"])
+                    sequential = cpn.component_name.lower() in SEQUENTIAL_COMPONENTS
+                    if batch and (sequential or any([b in depends for b, _ in batch])):
+                        yield from run_batch(batch)
                     if c not in without_dependent_checking:
                         cpids = cpn.get_dependent_components()
                         if any([cc not in self.path[-1] for cc in cpids]):
@@ -220,14 +358,11 @@ class Canvas:
                             cpn = st_cpn["obj"]
                             c = cpn._id
 
-                    try:
-                        ans = cpn.run(self.history, **kwargs)
-                    except Exception as e:
-                        logging.exception(f"Canvas.run got exception: {e}")
-                        self.path[-1].append(c)
-                        ran += 1
-                        raise e
-                    self.path[-1].append(c)
+                    batch.append((c, cpn))
+                    if sequential:
+                        yield from run_batch(batch)
+            if batch:
+                yield from run_batch(batch)
 
             ran += 1
 
@@ -235,9 +370,9 @@ class Canvas:
         if not downstream and self.components[self.path[-2][-1]].get("parent_id"):
             cid = self.path[-2][-1]
             pid = self.components[cid]["parent_id"]
-            o, _ = self.components[cid]["obj"].output(allow_partial=False)
-            oo, _ = self.components[pid]["obj"].output(allow_partial=False)
-            self.components[pid]["obj"].set_output(pd.concat([oo, o], ignore_index=True).dropna())
+            _, o = self.components[cid]["obj"].output(allow_partial=False)
+            _, oo = self.components[pid]["obj"].output(allow_partial=False)
+            self.components[pid]["obj"].set_output(Records.concat([oo, o]).dropna())
             downstream = [pid]
 
         for m in prepare2run(downstream):
@@ -267,7 +402,7 @@ class Canvas:
                 pid = cpn["parent_id"]
                 _, o = cpn["obj"].output(allow_partial=False)
                 _, oo = self.components[pid]["obj"].output(allow_partial=False)
-                self.components[pid]["obj"].set_output(pd.concat([oo.dropna(axis=1), o.dropna(axis=1)], ignore_index=True).dropna())
+                self.components[pid]["obj"].set_output(Records.concat([oo.dropna(axis=1), o.dropna(axis=1)]).dropna())
                 downstream = [pid]
 
             for m in prepare2run(downstream):
@@ -18,7 +18,7 @@ from abc import ABC
 from functools import partial
 from typing import Tuple, Union
 
-import pandas as pd
+from agent.records import Records
 
 from agent.component.base import ComponentBase, ComponentParamBase
 
@@ -45,7 +45,7 @@ class Answer(ComponentBase, ABC):
 
         ans = self.get_input()
         if self._param.post_answers:
-            ans = pd.concat([ans, pd.DataFrame([{"content": random.choice(self._param.post_answers)}])], ignore_index=False)
+            ans = Records.concat([ans, Records([{"content": random.choice(self._param.post_answers)}])])
         return ans
 
     def stream_output(self):
@@ -58,7 +58,7 @@ class Answer(ComponentBase, ABC):
             return
 
         stream = self.get_stream_input()
-        if isinstance(stream, pd.DataFrame):
+        if isinstance(stream, Records):
             res = stream
             answer = ""
             for ii, row in stream.iterrows():
@@ -77,13 +77,13 @@ class Answer(ComponentBase, ABC):
     def set_exception(self, e):
         self.exception = e
 
-    def output(self, allow_partial=True) -> Tuple[str, Union[pd.DataFrame, partial]]:
+    def output(self, allow_partial=True) -> Tuple[str, Union[Records, partial]]:
         if allow_partial:
             return super.output()
 
         for r, c in self._canvas.history[::-1]:
             if r == "user":
-                return self._param.output_var_name, pd.DataFrame([{"content": c}])
+                return self._param.output_var_name, Records([{"content": c}])
 
-        self._param.output_var_name, pd.DataFrame([])
+        self._param.output_var_name, Records()
 
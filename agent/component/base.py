@@ -24,6 +24,7 @@ from typing import Any, Tuple, Union
 import pandas as pd
 
 from agent import settings
+from agent.records import Records
 
 _FEEDED_DEPRECATED_PARAMS = "_feeded_deprecated_params"
 _DEPRECATED_PARAMS = "_deprecated_params"
@@ -94,7 +95,7 @@ class ComponentParamBase(ABC):
                     continue
                 # get attr
                 attr = getattr(obj, attr_name)
-                if isinstance(attr, pd.DataFrame):
+                if isinstance(attr, (pd.DataFrame, Records)):
                     ret_dict[attr_name] = attr.to_dict()
                     continue
                 if attr and type(attr).__name__ not in dir(builtins):
@@ -386,7 +387,7 @@ class ComponentBase(ABC):
         }
         """
         out = getattr(self._param, self._param.output_var_name)
-        if isinstance(out, pd.DataFrame) and "chunks" in out:
+        if isinstance(out, (pd.DataFrame, Records)) and "chunks" in out:
             del out["chunks"]
             setattr(self._param, self._param.output_var_name, out)
 
@@ -424,7 +425,7 @@ class ComponentBase(ABC):
             res = self._run(history, **kwargs)
             self.set_output(res)
         except Exception as e:
-            self.set_output(pd.DataFrame([{"content": str(e)}]))
+            self.set_output(Records([{"content": str(e)}]))
             raise e
 
         return res
@@ -432,41 +433,58 @@ class ComponentBase(ABC):
     def _run(self, history, **kwargs):
         raise NotImplementedError()
 
-    def output(self, allow_partial=True) -> Tuple[str, Union[pd.DataFrame, partial]]:
+    def output(self, allow_partial=True) -> Tuple[str, Union[Records, partial]]:
         o = getattr(self._param, self._param.output_var_name)
         if not isinstance(o, partial):
-            if not isinstance(o, pd.DataFrame):
-                if isinstance(o, list):
-                    return self._param.output_var_name, pd.DataFrame(o).dropna()
-                if o is None:
-                    return self._param.output_var_name, pd.DataFrame()
-                return self._param.output_var_name, pd.DataFrame([{"content": str(o)}])
-            return self._param.output_var_name, o
-
-        if allow_partial or not isinstance(o, partial):
-            if not isinstance(o, partial) and not isinstance(o, pd.DataFrame):
-                return pd.DataFrame(o if isinstance(o, list) else [o]).dropna()
+            if isinstance(o, Records):
+                return self._param.output_var_name, o
+            if isinstance(o, pd.DataFrame):
+                return self._param.output_var_name, Records.of(o)
+            if isinstance(o, list):
+                return self._param.output_var_name, Records.of(o).dropna()
+            if o is None:
+                return self._param.output_var_name, Records()
+            return self._param.output_var_name, Records([{"content": str(o)}])
+
+        if allow_partial:
             return self._param.output_var_name, o
 
         outs = None
         for oo in o():
-            if not isinstance(oo, pd.DataFrame):
-                outs = pd.DataFrame(oo if isinstance(oo, list) else [oo]).dropna()
-            else:
-                outs = oo.dropna()
+            outs = Records.of(oo if isinstance(oo, (list, Records, pd.DataFrame)) else [oo]).dropna()
         return self._param.output_var_name, outs
 
     def reset(self):
         setattr(self._param, self._param.output_var_name, None)
         self._param.inputs = []
 
+    def state(self):
+        """
+        The params a run changes, serialized like `__str__` does but without the rest of the params.
+        """
+        out = getattr(self._param, self._param.output_var_name)
+        if isinstance(out, (pd.DataFrame, Records)):
+            if "chunks" in out:
+                del out["chunks"]
+            out = out.to_dict()
+        elif isinstance(out, partial):
+            out = None
+        state = {self._param.output_var_name: out, "inputs": self._param.inputs, "query": self._param.query}
+        # the prompt trace of LLM components, shown by the web UI
+        if hasattr(self._param, self._param.infor_var_name):
+            state[self._param.infor_var_name] = getattr(self._param, self._param.infor_var_name)
+        return state
+
     def set_output(self, v):
+        # Tables returned by components are turned into records once, here.
+        if isinstance(v, pd.DataFrame):
+            v = Records.of(v)
         setattr(self._param, self._param.output_var_name, v)
 
     def set_infor(self, v):
         setattr(self._param, self._param.infor_var_name, v)
         
-    def _fetch_outputs_from(self, sources: list[dict[str, Any]]) -> list[pd.DataFrame]:
+    def _fetch_outputs_from(self, sources: list[dict[str, Any]]) -> list[Records]:
         outs = []
         for q in sources:
             if q.get("component_id"):
@@ -474,7 +492,7 @@ class ComponentBase(ABC):
                     cpn_id, key = q["component_id"].split("@")
                     for p in self._canvas.get_component(cpn_id)["obj"]._param.query:
                         if p["key"] == key:
-                            outs.append(pd.DataFrame([{"content": p.get("value", "")}]))
+                            outs.append(Records([{"content": p.get("value", "")}]))
                             break
                     else:
                         assert False, f"Can't find parameter '{key}' for {cpn_id}"
@@ -485,16 +503,16 @@ class ComponentBase(ABC):
                     for r, c in self._canvas.history[::-1][:self._param.message_history_window_size][::-1]:
                         txt.append(f"{r.upper()}:{c}")
                     txt = "\n".join(txt)
-                    outs.append(pd.DataFrame([{"content": txt}]))
+                    outs.append(Records([{"content": txt}]))
                     continue
 
                 outs.append(self._canvas.get_component(q["component_id"])["obj"].output(allow_partial=False)[1])
             elif q.get("value"):
-                outs.append(pd.DataFrame([{"content": q["value"]}]))
+                outs.append(Records([{"content": q["value"]}]))
         return outs
     def get_input(self):
         if self._param.debug_inputs:
-            return pd.DataFrame([{"content": v["value"]} for v in self._param.debug_inputs if v.get("value")])
+            return Records([{"content": v["value"]} for v in self._param.debug_inputs if v.get("value")])
 
         reversed_cpnts = []
         if len(self._canvas.path) > 1:
@@ -524,9 +542,9 @@ class ComponentBase(ABC):
                 })
 
             if outs:
-                df = pd.concat(outs, ignore_index=True)
+                df = Records.concat(outs)
                 if "content" in df:
-                    df = df.drop_duplicates(subset=['content']).reset_index(drop=True)
+                    df = df.drop_duplicates(subset=['content'])
                 return df
 
         upstream_outs = []
@@ -537,6 +555,8 @@ class ComponentBase(ABC):
             if self.component_name.lower() == "generate" and self.get_component_name(u) == "retrieval":
                 o = self._canvas.get_component(u)["obj"].output(allow_partial=False)[1]
                 if o is not None:
+                    # a copy: the output is shared with the other components reading it, maybe concurrently
+                    o = Records(o.rows)
                     o["component_id"] = u
                     upstream_outs.append(o)
                     continue
@@ -547,26 +567,27 @@ class ComponentBase(ABC):
             if u.lower().find("answer") >= 0:
                 for r, c in self._canvas.history[::-1]:
                     if r == "user":
-                        upstream_outs.append(pd.DataFrame([{"content": c, "component_id": u}]))
+                        upstream_outs.append(Records([{"content": c, "component_id": u}]))
                         break
                 break
             if self.component_name.lower().find("answer") >= 0 and self.get_component_name(u) in ["relevant"]:
                 continue
             o = self._canvas.get_component(u)["obj"].output(allow_partial=False)[1]
             if o is not None:
+                o = Records(o.rows)
                 o["component_id"] = u
                 upstream_outs.append(o)
             break
 
         assert upstream_outs, "Can't inference the where the component input is. Please identify whose output is this component's input."
 
-        df = pd.concat(upstream_outs, ignore_index=True)
+        df = Records.concat(upstream_outs)
         if "content" in df:
-            df = df.drop_duplicates(subset=['content']).reset_index(drop=True)
+            df = df.drop_duplicates(subset=['content'])
 
         self._param.inputs = []
-        for _, r in df.iterrows():
-            self._param.inputs.append({"component_id": r["component_id"], "content": r["content"]})
+        for r in df.rows:
+            self._param.inputs.append({"component_id": r.get("component_id"), "content": r.get("content")})
 
         return df
 
@@ -601,7 +622,7 @@ class ComponentBase(ABC):
 
     @staticmethod
     def be_output(v):
-        return pd.DataFrame([{"content": v}])
+        return Records([{"content": v}])
 
     def get_component_name(self, cpn_id):
         return self._canvas.get_component(cpn_id)["obj"].component_name.lower()
@@ -14,7 +14,6 @@
 #  limitations under the License.
 #
 from functools import partial
-import pandas as pd
 from agent.component.base import ComponentBase, ComponentParamBase
 
 
@@ -38,7 +37,7 @@ class Begin(ComponentBase):
     def _run(self, history, **kwargs):
         if kwargs.get("stream"):
             return partial(self.stream_output)
-        return pd.DataFrame([{"content": self._param.prologue}])
+        return Begin.be_output(self._param.prologue)
 
     def stream_output(self):
         res = {"content": self._param.prologue}
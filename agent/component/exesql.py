@@ -14,8 +14,16 @@
 #  limitations under the License.
 #
 from abc import ABC
+import os
 import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from copy import deepcopy
+from functools import partial
+from timeit import default_timer as timer
+from uuid import uuid4
 
 import pandas as pd
 import pymysql
@@ -24,6 +32,119 @@ from agent.component import GenerateParam, Generate
 import pyodbc
 import logging
 
+EXESQL_POOL_SIZE = int(os.environ.get("EXESQL_POOL_SIZE", 4))
+EXESQL_POOL_IDLE_TIMEOUT = int(os.environ.get("EXESQL_POOL_IDLE_TIMEOUT", 300))
+EXESQL_POOL_PING_INTERVAL = int(os.environ.get("EXESQL_POOL_PING_INTERVAL", 30))
+
+
+class ConnectionPool:
+    """
+    Database connections of ExeSQL, kept per tenant and database so that a conversation doesn't
+    connect again on every question. At most EXESQL_POOL_SIZE idle connections are kept per key,
+    they're closed once idle for EXESQL_POOL_IDLE_TIMEOUT seconds and checked with `SELECT 1`
+    before being reused after EXESQL_POOL_PING_INTERVAL seconds.
+    `connect` may be any DB-API connection factory, e.g. `partial(sqlite3.connect, path)`.
+    """
+
+    def __init__(self, size=EXESQL_POOL_SIZE, idle_timeout=EXESQL_POOL_IDLE_TIMEOUT,
+                 ping_interval=EXESQL_POOL_PING_INTERVAL):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.ping_interval = ping_interval
+        self.stats = Counter()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self, key, connect):
+        """Yields (connection, whether it was reused), the connection goes back to the pool afterwards."""
+        conn, reused = self._acquire(key, connect)
+        try:
+            yield conn, reused
+        finally:
+            self._release(key, conn)
+
+    def record(self, elapsed):
+        with self._lock:
+            self.stats["queries"] += 1
+            self.stats["query_seconds"] += elapsed
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["idle"] = sum(len(conns) for conns in self._idle.values())
+        stats["avg_query_ms"] = round(1000 * stats.pop("query_seconds", 0) / stats["queries"], 2) if stats.get("queries") else 0
+        return stats
+
+    def _acquire(self, key, connect):
+        while True:
+            with self._lock:
+                expired = self._evict(time.time())
+                conns = self._idle.get(key)
+                last_used, conn = conns.pop() if conns else (None, None)
+            for c in expired:
+                self._close(c)
+            if conn is None:
+                break
+            if time.time() - last_used < self.ping_interval or self._alive(conn):
+                with self._lock:
+                    self.stats["reused"] += 1
+                return conn, True
+            self._close(conn)
+            with self._lock:
+                self.stats["broken"] += 1
+
+        conn = connect()
+        with self._lock:
+            self.stats["created"] += 1
+        return conn, False
+
+    def _release(self, key, conn):
+        try:
+            # Nothing ExeSQL runs is committed, as it was when every run had its own connection.
+            conn.rollback()
+        except Exception:
+            self._close(conn)
+            return
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.size:
+                conns.append((time.time(), conn))
+                return
+        self._close(conn)
+
+    def _evict(self, now):
+        expired = []
+        for key in list(self._idle.keys()):
+            conns = self._idle[key]
+            expired.extend(c for t, c in conns if now - t >= self.idle_timeout)
+            conns[:] = [(t, c) for t, c in conns if now - t < self.idle_timeout]
+            if not conns:
+                del self._idle[key]
+        self.stats["evicted"] += len(expired)
+        return expired
+
+    @staticmethod
+    def _alive(conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+SQL_POOL = ConnectionPool()
+
 
 class ExeSQLParam(GenerateParam):
     """
@@ -75,16 +196,13 @@ class ExeSQL(Generate, ABC):
             raise Exception("SQL statement not found!")
         return ans
 
-    def _run(self, history, **kwargs):
-        ans = self.get_input()
-        ans = "".join([str(a) for a in ans["content"]]) if "content" in ans else ""
-        ans = self._refactor(ans)
+    def _connect(self):
         if self._param.db_type in ["mysql", "mariadb"]:
-            db = pymysql.connect(db=self._param.database, user=self._param.username, host=self._param.host,
-                                 port=self._param.port, password=self._param.password)
+            return partial(pymysql.connect, db=self._param.database, user=self._param.username, host=self._param.host,
+                           port=self._param.port, password=self._param.password)
         elif self._param.db_type == 'postgresql':
-            db = psycopg2.connect(dbname=self._param.database, user=self._param.username, host=self._param.host,
-                                  port=self._param.port, password=self._param.password)
+            return partial(psycopg2.connect, dbname=self._param.database, user=self._param.username, host=self._param.host,
+                           port=self._param.port, password=self._param.password)
         elif self._param.db_type == 'mssql':
             conn_str = (
                     r'DRIVER={ODBC Driver 17 for SQL Server};'
@@ -93,11 +211,36 @@ class ExeSQL(Generate, ABC):
                     r'UID=' + self._param.username + ';'
                     r'PWD=' + self._param.password
             )
-            db = pyodbc.connect(conn_str)
-        try:
-            cursor = db.cursor()
-        except Exception as e:
-            raise Exception("Database Connection Failed! \n" + str(e))
+            return partial(pyodbc.connect, conn_str)
+
+    def _cursor(self, db, sql):
+        # Server side cursors, so that only the top n rows are held in memory. It bounds memory, not traffic:
+        # closing a pymysql SSCursor still reads the rest of the result off the wire.
+        if self._param.db_type in ["mysql", "mariadb"]:
+            return db.cursor(pymysql.cursors.SSCursor)
+        if self._param.db_type == 'postgresql' and re.match(r"\s*(select|with|values|table)\b", sql, flags=re.IGNORECASE):
+            cursor = db.cursor(name="exesql_" + uuid4().hex)
+            cursor.itersize = self._param.top_n
+            return cursor
+        return db.cursor()
+
+    def _run(self, history, **kwargs):
+        ans = self.get_input()
+        ans = "".join([str(a) for a in ans["content"]]) if "content" in ans else ""
+        ans = self._refactor(ans)
+        key = (self._canvas.get_tenant_id(), self._param.db_type, self._param.host, self._param.port,
+               self._param.database, self._param.username, self._param.password)
+        st = timer()
+        with SQL_POOL.connection(key, self._connect()) as (db, reused):
+            sql_res = self._execute(db, ans, **kwargs)
+        logging.info("ExeSQL {}@{}:{}/{}: {:.3f}s, connection {}.".format(
+            self._param.db_type, self._param.host, self._param.port, self._param.database, timer() - st,
+            "reused" if reused else "opened"))
+        if not sql_res:
+            return ExeSQL.be_output("")
+        return pd.DataFrame(sql_res)
+
+    def _execute(self, db, ans, **kwargs):
         if not hasattr(self, "_loop"):
             setattr(self, "_loop", 0)
             self._loop += 1
@@ -111,27 +254,31 @@ class ExeSQL(Generate, ABC):
                 if not single_sql:
                     break
                 try:
-                    cursor.execute(single_sql)
-                    if cursor.rowcount == 0:
+                    st = timer()
+                    cursor = self._cursor(db, single_sql)
+                    try:
+                        cursor.execute(single_sql)
+                        rows = cursor.fetchmany(self._param.top_n) if cursor.description or getattr(cursor, "name", None) else []
+                        columns = [desc[0] for desc in cursor.description] if rows else []
+                    finally:
+                        cursor.close()
+                    SQL_POOL.record(timer() - st)
+                    if not rows:
                         sql_res.append({"content": "No record in the database!"})
                         break
-                    if self._param.db_type == 'mssql':
-                        single_res = pd.DataFrame.from_records(cursor.fetchmany(self._param.top_n),
-                                                               columns=[desc[0] for desc in cursor.description])
-                    else:
-                        single_res = pd.DataFrame([i for i in cursor.fetchmany(self._param.top_n)])
-                        single_res.columns = [i[0] for i in cursor.description]
+                    single_res = pd.DataFrame.from_records([tuple(r) for r in rows], columns=columns)
                     sql_res.append({"content": single_res.to_markdown(index=False, floatfmt=".6f")})
                     break
                 except Exception as e:
+                    try:
+                        db.rollback()
+                    except Exception:
+                        pass
                     single_sql = self._regenerate_sql(single_sql, str(e), **kwargs)
                     single_sql = self._refactor(single_sql)
                     if self._loop > self._param.loop:
                         sql_res.append({"content": "Can't query the correct data via SQL statement."})
-        db.close()
-        if not sql_res:
-            return ExeSQL.be_output("")
-        return pd.DataFrame(sql_res)
+        return sql_res
 
     def _regenerate_sql(self, failed_sql, error_message, **kwargs):
         prompt = f'''
@@ -145,7 +292,7 @@ class ExeSQL(Generate, ABC):
         kwargs_["stream"] = False
         response = Generate._run(self, [], **kwargs_)
         try:
-            regenerated_sql = response.loc[0, "content"]
+            regenerated_sql = response["content"][0]
             return regenerated_sql
         except Exception as e:
             logging.error(f"Failed to regenerate SQL: {e}")
@@ -18,6 +18,7 @@ import re
 from functools import partial
 from typing import Any
 import pandas as pd
+from agent.records import Records
 from api.db import LLMType
 from api.db.services.conversation_service import structure_answer
 from api.db.services.llm_service import LLMBundle
@@ -90,8 +91,6 @@ class Generate(ComponentBase):
         return list(cpnts)
 
     def set_cite(self, retrieval_res, answer):
-        if "empty_response" in retrieval_res.columns:
-            retrieval_res["empty_response"].fillna("", inplace=True)
         chunks = json.loads(retrieval_res["chunks"][0])
         answer, idx = settings.retrievaler.insert_citations(answer,
                                                             [ck["content_ltks"] for ck in chunks],
@@ -194,9 +193,9 @@ class Generate(ComponentBase):
             self._param.inputs.append({"component_id": para["key"], "content": kwargs[para["key"]]})
 
         if retrieval_res:
-            retrieval_res = pd.concat(retrieval_res, ignore_index=True)
+            retrieval_res = Records.concat(retrieval_res)
         else:
-            retrieval_res = pd.DataFrame([])
+            retrieval_res = Records()
 
         for n, v in kwargs.items():
             prompt = re.sub(r"\{%s\}" % re.escape(n), str(v).replace("\\", " "), prompt)
@@ -213,9 +212,9 @@ class Generate(ComponentBase):
             return partial(self.stream_output, chat_mdl, prompt, retrieval_res)
 
         if "empty_response" in retrieval_res.columns and not "".join(retrieval_res["content"]):
-            empty_res = "\n- ".join([str(t) for t in retrieval_res["empty_response"] if str(t)])
+            empty_res = "\n- ".join([str(t) for t in retrieval_res["empty_response"].dropna() if str(t)])
             res = {"content": empty_res if empty_res else "Nothing found in knowledgebase!", "reference": []}
-            return pd.DataFrame([res])
+            return Records([res])
 
         msg = self._canvas.get_history(self._param.message_history_window_size)
         if len(msg) < 1:
@@ -228,14 +227,14 @@ class Generate(ComponentBase):
         self._canvas.set_component_infor(self._id, {"prompt":msg[0]["content"],"messages":  msg[1:],"conf":  self._param.gen_conf()})
         if self._param.cite and "chunks" in retrieval_res.columns:
             res = self.set_cite(retrieval_res, ans)
-            return pd.DataFrame([res])
+            return Records([res])
 
         return Generate.be_output(ans)
 
     def stream_output(self, chat_mdl, prompt, retrieval_res):
         res = None
         if "empty_response" in retrieval_res.columns and not "".join(retrieval_res["content"]):
-            empty_res = "\n- ".join([str(t) for t in retrieval_res["empty_response"] if str(t)])
+            empty_res = "\n- ".join([str(t) for t in retrieval_res["empty_response"].dropna() if str(t)])
             res = {"content": empty_res if empty_res else "Nothing found in knowledgebase!", "reference": []}
             yield res
             self.set_output(res)
@@ -14,7 +14,7 @@
 #  limitations under the License.
 #
 from abc import ABC
-import pandas as pd
+from agent.records import Records
 from agent.component.base import ComponentBase, ComponentParamBase
 
 
@@ -40,9 +40,9 @@ class IterationItem(ComponentBase, ABC):
         ans = [a.strip() for a in ans.split(parent._param.delimiter)]
         if not ans:
             self._idx = -1
-            return pd.DataFrame()
+            return Records()
 
-        df = pd.DataFrame([{"content": ans[self._idx]}])
+        df = IterationItem.be_output(ans[self._idx])
         self._idx += 1
         if self._idx >= len(ans):
             self._idx = -1
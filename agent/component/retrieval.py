@@ -18,7 +18,7 @@ import logging
 import re
 from abc import ABC
 
-import pandas as pd
+from agent.records import Records
 
 from api.db import LLMType
 from api.db.services.knowledgebase_service import KnowledgebaseService
@@ -129,6 +129,7 @@ class Retrieval(ComponentBase, ABC):
                 df["empty_response"] = self._param.empty_response
             return df
 
-        df = pd.DataFrame({"content": kb_prompt(kbinfos, 200000), "chunks": json.dumps(kbinfos["chunks"])})
+        chunks = json.dumps(kbinfos["chunks"])
+        df = Records([{"content": c, "chunks": chunks} for c in kb_prompt(kbinfos, 200000)])
         logging.debug("{} {}".format(query, df))
         return df.dropna()
@@ -0,0 +1,173 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pandas as pd
+
+
+def isna(v):
+    return v is None or (isinstance(v, float) and v != v)
+
+
+class Column(list):
+    """Values of a column, in row order."""
+
+    def dropna(self):
+        return Column([v for v in self if not isna(v)])
+
+    def tolist(self):
+        return list(self)
+
+
+class _Row(dict):
+    def to_dict(self):
+        return dict(self)
+
+
+class _ILoc:
+    __slots__ = ("records",)
+
+    def __init__(self, records):
+        self.records = records
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple):
+            i, j = idx
+            return self.records.rows[i].get(self.records.columns[j])
+        return _Row(self.records.rows[idx])
+
+
+class Records:
+    """
+    What components pass to each other: a list of rows, each a dict like {"content": ...}.
+    It supports the part of the pandas.DataFrame interface the components use on their inputs and outputs
+    (column access, `in`, iloc, to_dict, iterrows, dropna, drop_duplicates...) without building frames.
+    Components that work on tables may still return a DataFrame, it's converted once with `Records.of`,
+    and `to_df` gives a DataFrame back.
+    """
+    __slots__ = ("rows",)
+
+    def __init__(self, rows=None):
+        self.rows = [dict(r) for r in rows] if rows else []
+
+    @classmethod
+    def of(cls, data):
+        if isinstance(data, Records):
+            return data
+        if isinstance(data, pd.DataFrame):
+            return cls(data.to_dict("records"))
+        if data is None:
+            return cls()
+        if isinstance(data, list):
+            return cls([d if isinstance(d, dict) else {0: d} for d in data])
+        if isinstance(data, dict):
+            return cls([data])
+        return cls([{"content": data}])
+
+    @classmethod
+    def concat(cls, items):
+        res = cls()
+        for it in items:
+            if it is not None:
+                res.rows.extend(dict(r) for r in cls.of(it).rows)
+        return res
+
+    def to_df(self):
+        return pd.DataFrame(self.rows)
+
+    @property
+    def columns(self):
+        cols = {}
+        for r in self.rows:
+            for k in r:
+                cols[k] = True
+        return list(cols)
+
+    @property
+    def empty(self):
+        return not self.rows or not self.columns
+
+    @property
+    def iloc(self):
+        return _ILoc(self)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, col):
+        return any(col in r for r in self.rows)
+
+    def __getitem__(self, col):
+        return Column([r.get(col) for r in self.rows])
+
+    def __setitem__(self, col, value):
+        if isinstance(value, (list, tuple)):
+            assert len(value) == len(self.rows), "Length of values does not match the number of rows."
+            for r, v in zip(self.rows, value):
+                r[col] = v
+            return
+        for r in self.rows:
+            r[col] = value
+
+    def __delitem__(self, col):
+        for r in self.rows:
+            r.pop(col, None)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __repr__(self):
+        return f"Records({self.rows!r})"
+
+    def get(self, col, default=None):
+        return self[col] if col in self else default
+
+    def iterrows(self):
+        for i, r in enumerate(self.rows):
+            yield i, _Row(r)
+
+    def to_dict(self, orient="dict"):
+        if orient == "records":
+            return [dict(r) for r in self.rows]
+        return {c: {i: r.get(c) for i, r in enumerate(self.rows)} for c in self.columns}
+
+    def dropna(self, axis=0):
+        cols = self.columns
+        if axis in (1, "columns"):
+            keep = [c for c in cols if all(not isna(r.get(c)) for r in self.rows)]
+            return Records([{c: r[c] for c in keep} for r in self.rows])
+        return Records([r for r in self.rows if all(not isna(r.get(c)) for c in cols)])
+
+    def drop_duplicates(self, subset=None):
+        subset = subset or self.columns
+        seen = set()
+        rows = []
+        for r in self.rows:
+            key = []
+            for c in subset:
+                v = r.get(c)
+                try:
+                    hash(v)
+                except TypeError:
+                    v = repr(v)
+                key.append(v)
+            key = tuple(key)
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append(r)
+        return Records(rows)
+
+    def reset_index(self, drop=True):
+        return self
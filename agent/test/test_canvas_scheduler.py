@@ -0,0 +1,134 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+import time
+
+import pytest
+
+import agent.canvas as canvas_module
+from agent.canvas import Canvas
+from agent.component.answer import Answer
+from agent.records import Records
+
+RUN_SECONDS = 0.1
+
+
+def obj(component_name, **params):
+    # stored dsls always carry the output
+    return {"component_name": component_name, "params": {"output": None, **params}}
+
+
+def message(upstream=None):
+    return {"obj": obj("Message", messages=["hi"]), "downstream": [], "upstream": upstream or ["begin"]}
+
+
+SEQUENTIAL = {
+    "switch_0": {"obj": obj("Switch", conditions=[{"logical_operator": "and", "items": [], "to": "answer_0"}]),
+                 "downstream": [], "upstream": ["begin"]},
+    "categorize_0": {"obj": obj("Categorize", llm_id="llm", category_description={"other": {"to": "answer_0"}}),
+                     "downstream": [], "upstream": ["begin"]},
+    "iteration_0": {"obj": obj("Iteration"), "downstream": [], "upstream": ["begin"]},
+}
+
+
+def build(components, order):
+    dsl = {
+        "components": {
+            "begin": {"obj": obj("Begin"), "downstream": order + ["answer_0"], "upstream": []},
+            "answer_0": {"obj": obj("Answer"), "downstream": [], "upstream": ["begin"]},
+            **components,
+        },
+        "graph": {"nodes": []},
+        "history": [],
+        "messages": [],
+        "reference": [],
+        "path": [],
+        "answer": [],
+    }
+    return Canvas(dsl)
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """(component id, start, end) of every component run by the scheduler."""
+    runs = []
+    lock = threading.Lock()
+
+    def timed_run(cpn, history, **kwargs):
+        st = time.perf_counter()
+        time.sleep(RUN_SECONDS)
+        cpn.set_output(Records([{"content": cpn._id}]))
+        with lock:
+            runs.append((cpn._id, st, time.perf_counter()))
+        return RUN_SECONDS
+
+    monkeypatch.setattr(canvas_module, "_timed_run", timed_run)
+    monkeypatch.setattr(Answer, "run", lambda self, history, **kwargs: Records([{"content": "done"}]))
+    return runs
+
+
+def spans(runs):
+    return {cid: (st, end) for cid, st, end in runs}
+
+
+def overlap(a, b):
+    return a[0] < b[1] and b[0] < a[1]
+
+
+def test_independent_components_run_together(runs):
+    cvs = build({"message_0": message(), "message_1": message(), "message_2": message()},
+                ["message_0", "message_1", "message_2"])
+    list(cvs.run())
+    s = spans(runs)
+    assert overlap(s["message_0"], s["message_1"])
+    assert overlap(s["message_1"], s["message_2"])
+    assert cvs.path[-1][:3] == ["message_0", "message_1", "message_2"]
+
+
+def test_dependency_runs_after_its_upstream(runs):
+    cvs = build({"message_0": message(), "message_1": message(), "message_2": message(["message_1"])},
+                ["message_0", "message_1", "message_2"])
+    list(cvs.run())
+    s = spans(runs)
+    assert overlap(s["message_0"], s["message_1"])
+    assert s["message_2"][0] >= s["message_1"][1]
+    assert cvs.path[-1][:3] == ["message_0", "message_1", "message_2"]
+
+
+def test_dependency_from_query_runs_after_it(runs):
+    dependent = message()
+    dependent["obj"]["params"]["query"] = [{"component_id": "message_0"}]
+    cvs = build({"message_0": message(), "message_1": dependent}, ["message_0", "message_1"])
+    list(cvs.run())
+    s = spans(runs)
+    assert s["message_1"][0] >= s["message_0"][1]
+
+
+@pytest.mark.parametrize("cid", sorted(SEQUENTIAL))
+def test_sequential_components_run_alone(runs, cid):
+    components = {"message_0": message(), cid: SEQUENTIAL[cid], "message_1": message()}
+    ran = cid
+    if cid == "iteration_0":
+        # the iteration runs its first item in its place
+        components["iterationitem_0"] = {"obj": obj("IterationItem"), "downstream": [], "upstream": [],
+                                         "parent_id": "iteration_0"}
+        ran = "iterationitem_0"
+    cvs = build(components, ["message_0", cid, "message_1"])
+    list(cvs.run())
+    s = spans(runs)
+    assert s[ran][0] >= s["message_0"][1]
+    assert s["message_1"][0] >= s[ran][1]
+    assert cvs.path[-1][:3] == ["message_0", ran, "message_1"]
@@ -0,0 +1,125 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import sqlite3
+from functools import partial
+
+import pytest
+
+from agent.component.exesql import ConnectionPool
+
+KEY = ("tenant", "sqlite")
+
+
+@pytest.fixture
+def connect(tmp_path):
+    path = str(tmp_path / "exesql.db")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE t (v INTEGER)")
+    db.execute("INSERT INTO t VALUES (1)")
+    db.commit()
+    db.close()
+    return partial(sqlite3.connect, path)
+
+
+def count_rows(connect):
+    db = connect()
+    try:
+        return db.execute("SELECT COUNT(*) FROM t").fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_reuse(connect):
+    pool = ConnectionPool(size=2, idle_timeout=300, ping_interval=300)
+    with pool.connection(KEY, connect) as (first, reused):
+        assert not reused
+    with pool.connection(KEY, connect) as (second, reused):
+        assert reused
+        assert second is first
+    with pool.connection(("tenant", "other"), connect) as (other, reused):
+        assert not reused
+        assert other is not first
+    metrics = pool.metrics()
+    assert metrics["created"] == 2
+    assert metrics["reused"] == 1
+    assert metrics["idle"] == 2
+
+
+def test_idle_connections_are_capped(connect):
+    pool = ConnectionPool(size=1, idle_timeout=300, ping_interval=300)
+    with pool.connection(KEY, connect) as (first, _):
+        with pool.connection(KEY, connect) as (second, reused):
+            assert not reused
+    assert pool.metrics()["idle"] == 1
+    # the second one went back first, the first one was closed as the pool was full
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+    with pool.connection(KEY, connect) as (conn, reused):
+        assert reused
+        assert conn is second
+
+
+def test_broken_connection_is_replaced(connect):
+    pool = ConnectionPool(size=2, idle_timeout=300, ping_interval=0)
+    with pool.connection(KEY, connect) as (first, _):
+        pass
+    first.close()
+    with pool.connection(KEY, connect) as (conn, reused):
+        assert not reused
+        assert conn is not first
+        assert conn.execute("SELECT 1").fetchone() == (1,)
+    metrics = pool.metrics()
+    assert metrics["broken"] == 1
+    assert metrics["created"] == 2
+
+
+def test_idle_connections_are_evicted(connect):
+    pool = ConnectionPool(size=2, idle_timeout=0, ping_interval=300)
+    with pool.connection(KEY, connect) as (first, _):
+        pass
+    with pool.connection(KEY, connect) as (conn, reused):
+        assert not reused
+        assert conn is not first
+    with pytest.raises(sqlite3.ProgrammingError):
+        first.execute("SELECT 1")
+    assert pool.metrics()["evicted"] == 1
+
+
+def test_released_connection_is_rolled_back(connect):
+    pool = ConnectionPool(size=2, idle_timeout=300, ping_interval=300)
+    with pool.connection(KEY, connect) as (conn, _):
+        conn.execute("INSERT INTO t VALUES (2)")
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 2
+    assert count_rows(connect) == 1
+    with pool.connection(KEY, connect) as (conn, reused):
+        assert reused
+        assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 1
+
+
+def test_connection_failing_rollback_is_dropped(connect):
+    pool = ConnectionPool(size=2, idle_timeout=300, ping_interval=300)
+    with pool.connection(KEY, connect) as (conn, _):
+        conn.close()
+    assert pool.metrics()["idle"] == 0
+
+
+def test_query_metrics():
+    pool = ConnectionPool()
+    pool.record(0.01)
+    pool.record(0.03)
+    metrics = pool.metrics()
+    assert metrics["queries"] == 2
+    assert metrics["avg_query_ms"] == 20.0
@@ -0,0 +1,99 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pandas as pd
+import pytest
+
+from agent.records import Records
+
+# rows don't all have the same keys, as the outputs concatenated by the canvas
+SPARSE = [
+    {"id": 0, "content": "a", "score": 1.0},
+    {"id": 1, "content": "b"},
+    {"id": 2, "content": None, "score": 2.0},
+    {"id": 3, "score": 3.0, "extra": "x"},
+    {"id": 4, "content": "e", "score": 4.0, "extra": "y"},
+]
+DENSE = [
+    {"content": "a", "score": 1},
+    {"content": "b", "score": 2},
+    {"content": "c", "score": 3},
+]
+
+
+def test_columns():
+    assert Records(SPARSE).columns == list(pd.DataFrame(SPARSE).columns)
+
+
+def test_dropna_over_union_of_columns():
+    df = pd.DataFrame(SPARSE)
+    assert Records(SPARSE).dropna().rows == [SPARSE[i] for i in df.dropna().index]
+    assert Records(SPARSE).dropna(axis=1).rows == df.dropna(axis=1).to_dict("records")
+
+
+def test_drop_duplicates():
+    rows = DENSE + [dict(DENSE[1]), {"content": "a", "score": 4}]
+    df = pd.DataFrame(rows)
+    assert Records(rows).drop_duplicates().rows == df.drop_duplicates().to_dict("records")
+    assert Records(rows).drop_duplicates(subset=["content"]).rows == df.drop_duplicates(subset=["content"]).to_dict("records")
+
+
+def test_drop_duplicates_with_unhashable_values():
+    rows = [
+        {"content": "a", "tags": ["x"]},
+        {"content": "a", "tags": ["x"]},
+        {"content": "a", "tags": ["y"]},
+        {"content": "b", "tags": ["x"]},
+    ]
+    df = pd.DataFrame(rows)
+    with pytest.raises(TypeError):
+        df.drop_duplicates()
+    # pandas can only compare them as strings
+    assert Records(rows).drop_duplicates().rows == df[~df.astype(str).duplicated()].to_dict("records")
+
+
+@pytest.mark.parametrize("idx", [(0, 0), (1, 1), (-1, 0), (2, -1)])
+def test_iloc_cell(idx):
+    assert Records(DENSE).iloc[idx] == pd.DataFrame(DENSE).iloc[idx]
+
+
+def test_iloc_row():
+    df = pd.DataFrame(DENSE)
+    for i in range(len(DENSE)):
+        assert Records(DENSE).iloc[i].to_dict() == df.iloc[i].to_dict()
+
+
+@pytest.mark.parametrize("orient", ["dict", "records"])
+def test_to_dict(orient):
+    assert Records(DENSE).to_dict(orient) == pd.DataFrame(DENSE).to_dict(orient)
+
+
+def test_to_dict_default():
+    assert Records(DENSE).to_dict() == pd.DataFrame(DENSE).to_dict()
+
+
+@pytest.mark.parametrize("col", ["content", "score", "extra", "missing"])
+def test_contains(col):
+    assert (col in Records(SPARSE)) == (col in pd.DataFrame(SPARSE))
+
+
+def test_iterrows():
+    rows = [(i, r.to_dict()) for i, r in Records(DENSE).iterrows()]
+    assert rows == [(i, r.to_dict()) for i, r in pd.DataFrame(DENSE).iterrows()]
+
+
+def test_of_dataframe():
+    assert Records.of(pd.DataFrame(DENSE)).rows == DENSE
+    assert Records(DENSE).to_df().equals(pd.DataFrame(DENSE))
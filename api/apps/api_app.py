@@ -149,8 +149,6 @@ def set_conversation():
             e, cvs = UserCanvasService.get_by_id(objs[0].dialog_id)
             if not e:
                 return server_error_response("canvas not found.")
-            if not isinstance(cvs.dsl, str):
-                cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
             canvas = Canvas(cvs.dsl, objs[0].tenant_id)
             conv = {
                 "id": get_uuid(),
@@ -231,9 +229,6 @@ def completion():
             del req["conversation_id"]
             del req["messages"]
 
-            if not isinstance(cvs.dsl, str):
-                cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
-
             if not conv.reference:
                 conv.reference = []
             conv.message.append({"role": "assistant", "content": "", "id": message_id})
@@ -267,7 +262,7 @@ def completion():
                         canvas.history.append(("assistant", final_ans["content"]))
                         if final_ans.get("reference"):
                             canvas.reference.append(final_ans["reference"])
-                        cvs.dsl = json.loads(str(canvas))
+                        canvas.dump(cvs.dsl)
                         API4ConversationService.append_message(conv.id, conv.to_dict())
                     except Exception as e:
                         yield "data:" + json.dumps({"code": 500, "message": str(e),
@@ -286,7 +281,7 @@ def completion():
             canvas.messages.append({"role": "assistant", "content": final_ans["content"], "id": message_id})
             if final_ans.get("reference"):
                 canvas.reference.append(final_ans["reference"])
-            cvs.dsl = json.loads(str(canvas))
+            canvas.dump(cvs.dsl)
 
             result = {"answer": final_ans["content"], "reference": final_ans.get("reference", [])}
             fillin_conv(result)
@@ -745,9 +740,6 @@ def completion_faq():
             if not e:
                 return server_error_response("canvas not found.")
 
-            if not isinstance(cvs.dsl, str):
-                cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
-
             if not conv.reference:
                 conv.reference = []
             conv.message.append({"role": "assistant", "content": "", "id": message_id})
@@ -776,7 +768,7 @@ def completion_faq():
             canvas.messages.append({"role": "assistant", "content": final_ans["content"], "id": message_id})
             if final_ans.get("reference"):
                 canvas.reference.append(final_ans["reference"])
-            cvs.dsl = json.loads(str(canvas))
+            canvas.dump(cvs.dsl)
 
             ans = {"answer": final_ans["content"], "reference": final_ans.get("reference", [])}
             data[0]["content"] += re.sub(r'##\d\$\$', '', ans["answer"])
@@ -122,8 +122,8 @@ def run():
             data=False, message='Only owner of canvas authorized for this operation.',
             code=RetCode.OPERATING_ERROR)
 
-    if not isinstance(cvs.dsl, str):
-        cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
+    if isinstance(cvs.dsl, str):
+        cvs.dsl = json.loads(cvs.dsl)
 
     final_ans = {"reference": [], "content": ""}
     message_id = req.get("message_id", get_uuid())
@@ -157,13 +157,11 @@ def run():
                     canvas.path.pop(-1)
                 if final_ans.get("reference"):
                     canvas.reference.append(final_ans["reference"])
-                cvs.dsl = json.loads(str(canvas))
-                UserCanvasService.update_by_id(req["id"], cvs.to_dict())
+                UserCanvasService.update_by_id(req["id"], {"dsl": canvas.dump(cvs.dsl)})
             except Exception as e:
-                cvs.dsl = json.loads(str(canvas))
                 if not canvas.path[-1]:
                     canvas.path.pop(-1)
-                UserCanvasService.update_by_id(req["id"], cvs.to_dict())
+                UserCanvasService.update_by_id(req["id"], {"dsl": canvas.dump(cvs.dsl)})
                 traceback.print_exc()
                 yield "data:" + json.dumps({"code": 500, "message": str(e),
                                             "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
@@ -184,8 +182,7 @@ def run():
         canvas.messages.append({"role": "assistant", "content": final_ans["content"], "id": message_id})
         if final_ans.get("reference"):
             canvas.reference.append(final_ans["reference"])
-        cvs.dsl = json.loads(str(canvas))
-        UserCanvasService.update_by_id(req["id"], cvs.to_dict())
+        UserCanvasService.update_by_id(req["id"], {"dsl": canvas.dump(cvs.dsl)})
         return get_json_result(data={"answer": final_ans["content"], "reference": final_ans.get("reference", [])})
 
 
@@ -203,9 +200,9 @@ def reset():
                 data=False, message='Only owner of canvas authorized for this operation.',
                 code=RetCode.OPERATING_ERROR)
 
-        canvas = Canvas(json.dumps(user_canvas.dsl), current_user.id)
+        canvas = Canvas(user_canvas.dsl, current_user.id)
         canvas.reset()
-        req["dsl"] = json.loads(str(canvas))
+        req["dsl"] = canvas.dump(user_canvas.dsl)
         UserCanvasService.update_by_id(req["id"], {"dsl": req["dsl"]})
         return get_json_result(data=req["dsl"])
     except Exception as e:
@@ -226,7 +223,7 @@ def input_elements():
                 data=False, message='Only owner of canvas authorized for this operation.',
                 code=RetCode.OPERATING_ERROR)
 
-        canvas = Canvas(json.dumps(user_canvas.dsl), current_user.id)
+        canvas = Canvas(user_canvas.dsl, current_user.id)
         return get_json_result(data=canvas.get_component_input_elements(cpn_id))
     except Exception as e:
         return server_error_response(e)
@@ -248,7 +245,7 @@ def debug():
                 data=False, message='Only owner of canvas authorized for this operation.',
                 code=RetCode.OPERATING_ERROR)
 
-        canvas = Canvas(json.dumps(user_canvas.dsl), current_user.id)
+        canvas = Canvas(user_canvas.dsl, current_user.id)
         canvas.get_component(req["component_id"])["obj"]._param.debug_inputs = req["params"]
         df = canvas.get_component(req["component_id"])["obj"].debug()
         return get_json_result(data=df.to_dict(orient="records"))
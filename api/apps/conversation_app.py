@@ -25,7 +25,7 @@ from flask_login import current_user, login_required
 from api import settings
 from api.db import LLMType
 from api.db.db_models import APIToken
-from api.db.services.conversation_service import ConversationService, structure_answer
+from api.db.services.conversation_service import CONVERSATION_HISTORY_WINDOW, ConversationService, delta_answers, empty_reference, structure_answer
 from api.db.services.dialog_service import DialogService, ask, chat
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.llm_service import LLMBundle, TenantService
@@ -49,6 +49,9 @@ def set_conversation():
     del req["is_new"]
     if not is_new:
         del req["conversation_id"]
+        # Messages are only written by completions.
+        req.pop("message", None)
+        req.pop("reference", None)
         try:
             if not ConversationService.update_by_id(conv_id, req):
                 return get_data_error_result(message="Conversation not found!")
@@ -166,6 +169,7 @@ def list_convsersation():
         if not DialogService.query(tenant_id=current_user.id, id=dialog_id):
             return get_json_result(data=False, message="Only owner of dialog authorized for this operation.", code=settings.RetCode.OPERATING_ERROR)
         convs = ConversationService.query(dialog_id=dialog_id, order_by=ConversationService.model.create_time, reverse=True)
+        ConversationService.load_messages(convs)
 
         convs = [d.to_dict() for d in convs]
         return get_json_result(data=convs)
@@ -179,7 +183,10 @@ def list_convsersation():
 def completion():
     req = request.json
     msg = []
-    for m in req["messages"]:
+    messages = req["messages"]
+    if CONVERSATION_HISTORY_WINDOW > 0:
+        messages = messages[-CONVERSATION_HISTORY_WINDOW:]
+    for m in messages:
         if m["role"] == "system":
             continue
         if m["role"] == "assistant" and not msg:
@@ -187,51 +194,34 @@ def completion():
         msg.append(m)
     message_id = msg[-1].get("id")
     try:
-        e, conv = ConversationService.get_by_id(req["conversation_id"])
+        e, conv = ConversationService.get_by_id(req["conversation_id"], load_messages=False)
         if not e:
             return get_data_error_result(message="Conversation not found!")
-        conv.message = deepcopy(req["messages"])
+        # Only this turn is kept on the conversation and appended to its messages once answered.
+        conv.message = [deepcopy(msg[-1])]
+        conv.reference = [empty_reference()]
         e, dia = DialogService.get_by_id(conv.dialog_id)
         if not e:
             return get_data_error_result(message="Dialog not found!")
         del req["conversation_id"]
         del req["messages"]
 
-        if not conv.reference:
-            conv.reference = []
-        else:
+        def save_turn():
+            # Asking a question again replaces its former answer and whatever followed.
+            ConversationService.truncate_messages(conv.id, message_id)
+            ConversationService.append_messages(conv.id, conv.message, conv.reference[-1])
 
-            def get_value(d, k1, k2):
-                return d.get(k1, d.get(k2))
-
-            for ref in conv.reference:
-                if isinstance(ref, list):
-                    continue
-                ref["chunks"] = [
-                    {
-                        "id": get_value(ck, "chunk_id", "id"),
-                        "content": get_value(ck, "content", "content_with_weight"),
-                        "document_id": get_value(ck, "doc_id", "document_id"),
-                        "document_name": get_value(ck, "docnm_kwd", "document_name"),
-                        "dataset_id": get_value(ck, "kb_id", "dataset_id"),
-                        "image_id": get_value(ck, "image_id", "img_id"),
-                        "positions": get_value(ck, "positions", "position_int"),
-                        "doc_type": get_value(ck, "doc_type_kwd", "doc_type_kwd"),
-                    }
-                    for ck in ref.get("chunks", [])
-                ]
-
-        if not conv.reference:
-            conv.reference = []
-        conv.reference.append({"chunks": [], "doc_aggs": []})
+        delta = req.pop("delta", False)
 
         def stream():
             nonlocal dia, msg, req, conv
             try:
-                for ans in chat(dia, msg, True, **req):
-                    ans = structure_answer(conv, ans, message_id, conv.id)
+                answers = (structure_answer(conv, ans, message_id, conv.id) for ans in chat(dia, msg, True, **req))
+                if delta:
+                    answers = delta_answers(answers)
+                for ans in answers:
                     yield "data:" + json.dumps({"code": 0, "message": "", "data": ans}, ensure_ascii=False) + "\n\n"
-                ConversationService.update_by_id(conv.id, conv.to_dict())
+                save_turn()
             except Exception as e:
                 traceback.print_exc()
                 yield "data:" + json.dumps({"code": 500, "message": str(e), "data": {"answer": "**ERROR**: " + str(e), "reference": []}}, ensure_ascii=False) + "\n\n"
@@ -248,8 +238,8 @@ def completion():
         else:
             answer = None
             for ans in chat(dia, msg, **req):
-                answer = structure_answer(conv, ans, message_id, req["conversation_id"])
-                ConversationService.update_by_id(conv.id, conv.to_dict())
+                answer = structure_answer(conv, ans, message_id, conv.id)
+                save_turn()
                 break
             return get_json_result(data=answer)
     except Exception as e:
@@ -293,22 +283,13 @@ def tts():
 @validate_request("conversation_id", "message_id")
 def delete_msg():
     req = request.json
-    e, conv = ConversationService.get_by_id(req["conversation_id"])
+    e, conv = ConversationService.get_by_id(req["conversation_id"], load_messages=False)
     if not e:
         return get_data_error_result(message="Conversation not found!")
 
-    conv = conv.to_dict()
-    for i, msg in enumerate(conv["message"]):
-        if req["message_id"] != msg.get("id", ""):
-            continue
-        assert conv["message"][i + 1]["id"] == req["message_id"]
-        conv["message"].pop(i)
-        conv["message"].pop(i)
-        conv["reference"].pop(max(0, i // 2 - 1))
-        break
-
-    ConversationService.update_by_id(conv["id"], conv)
-    return get_json_result(data=conv)
+    ConversationService.delete_message(conv.id, req["message_id"])
+    e, conv = ConversationService.get_by_id(conv.id)
+    return get_json_result(data=conv.to_dict())
 
 
 @manager.route("/thumbup", methods=["POST"])  # noqa: F821
@@ -316,26 +297,25 @@ def delete_msg():
 @validate_request("conversation_id", "message_id")
 def thumbup():
     req = request.json
-    e, conv = ConversationService.get_by_id(req["conversation_id"])
+    e, conv = ConversationService.get_by_id(req["conversation_id"], load_messages=False)
     if not e:
         return get_data_error_result(message="Conversation not found!")
     up_down = req.get("thumbup")
     feedback = req.get("feedback", "")
-    conv = conv.to_dict()
-    for i, msg in enumerate(conv["message"]):
-        if req["message_id"] == msg.get("id", "") and msg.get("role", "") == "assistant":
-            if up_down:
-                msg["thumbup"] = True
-                if "feedback" in msg:
-                    del msg["feedback"]
-            else:
-                msg["thumbup"] = False
-                if feedback:
-                    msg["feedback"] = feedback
-            break
 
-    ConversationService.update_by_id(conv["id"], conv)
-    return get_json_result(data=conv)
+    def update(msg):
+        if up_down:
+            msg["thumbup"] = True
+            if "feedback" in msg:
+                del msg["feedback"]
+        else:
+            msg["thumbup"] = False
+            if feedback:
+                msg["feedback"] = feedback
+
+    ConversationService.update_message(conv.id, req["message_id"], "assistant", update)
+    e, conv = ConversationService.get_by_id(conv.id)
+    return get_json_result(data=conv.to_dict())
 
 
 @manager.route("/ask", methods=["POST"])  # noqa: F821
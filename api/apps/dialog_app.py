@@ -16,6 +16,7 @@
 
 from flask import request
 from flask_login import login_required, current_user
+from api.db.services.conversation_service import ConversationService
 from api.db.services.dialog_service import DialogService
 from api.db import StatusEnum
 from api.db.services.llm_service import TenantLLMService
@@ -187,6 +188,7 @@ def rm():
                     code=settings.RetCode.OPERATING_ERROR)
             dialog_list.append({"id": id,"status":StatusEnum.INVALID.value})
         DialogService.update_many_by_id(dialog_list)
+        ConversationService.delete_messages_by_dialog_ids(req["dialog_ids"])
         return get_json_result(data=True)
     except Exception as e:
         return server_error_response(e)
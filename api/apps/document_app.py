@@ -18,7 +18,6 @@ import os.path
 import pathlib
 import re
 
-import flask
 from flask import request
 from flask_login import current_user, login_required
 
@@ -37,6 +36,7 @@ from api.utils import get_uuid
 from api.utils.api_utils import (
     get_data_error_result,
     get_json_result,
+    send_storage_object,
     server_error_response,
     validate_request,
 )
@@ -427,14 +427,16 @@ def get(doc_id):
             return get_data_error_result(message="Document not found!")
 
         b, n = File2DocumentService.get_storage_address(doc_id=doc_id)
-        response = flask.make_response(STORAGE_IMPL.get(b, n))
-
+        mimetype = "application/octet-stream"
         ext = re.search(r"\.([^.]+)$", doc.name)
         if ext:
             if doc.type == FileType.VISUAL.value:
-                response.headers.set("Content-Type", "image/%s" % ext.group(1))
+                mimetype = "image/%s" % ext.group(1)
             else:
-                response.headers.set("Content-Type", "application/%s" % ext.group(1))
+                mimetype = "application/%s" % ext.group(1)
+        response = send_storage_object(b, n, mimetype)
+        if response is None:
+            return get_data_error_result(message="This file is empty.")
         return response
     except Exception as e:
         return server_error_response(e)
@@ -490,8 +492,9 @@ def get_image(image_id):
         if len(arr) != 2:
             return get_data_error_result(message="Image not found.")
         bkt, nm = image_id.split("-")
-        response = flask.make_response(STORAGE_IMPL.get(bkt, nm))
-        response.headers.set("Content-Type", "image/JPEG")
+        response = send_storage_object(bkt, nm, "image/JPEG")
+        if response is None:
+            return get_data_error_result(message="Image not found.")
         return response
     except Exception as e:
         return server_error_response(e)
@@ -17,13 +17,12 @@ import os
 import pathlib
 import re
 
-import flask
 from flask import request
 from flask_login import login_required, current_user
 
 from api.db.services.document_service import DocumentService
 from api.db.services.file2document_service import File2DocumentService
-from api.utils.api_utils import server_error_response, get_data_error_result, validate_request
+from api.utils.api_utils import server_error_response, get_data_error_result, validate_request, send_storage_object
 from api.utils import get_uuid
 from api.db import FileType, FileSource
 from api.db.services import duplicate_name
@@ -328,21 +327,20 @@ def get(file_id):
         if not e:
             return get_data_error_result(message="Document not found!")
 
-        blob = STORAGE_IMPL.get(file.parent_id, file.location)
-        if not blob:
-            b, n = File2DocumentService.get_storage_address(file_id=file_id)
-            blob = STORAGE_IMPL.get(b, n)
-
-        response = flask.make_response(blob)
+        mimetype = "application/octet-stream"
         ext = re.search(r"\.([^.]+)$", file.name)
         if ext:
             if file.type == FileType.VISUAL.value:
-                response.headers.set('Content-Type', 'image/%s' % ext.group(1))
+                mimetype = 'image/%s' % ext.group(1)
             else:
-                response.headers.set(
-                    'Content-Type',
-                    'application/%s' %
-                    ext.group(1))
+                mimetype = 'application/%s' % ext.group(1)
+
+        response = send_storage_object(file.parent_id, file.location, mimetype)
+        if response is None:
+            b, n = File2DocumentService.get_storage_address(file_id=file_id)
+            response = send_storage_object(b, n, mimetype)
+        if response is None:
+            return get_data_error_result(message="This file is empty.")
         return response
     except Exception as e:
         return server_error_response(e)
@@ -19,6 +19,7 @@ from flask import request
 
 from api import settings
 from api.db import StatusEnum
+from api.db.services.conversation_service import ConversationService
 from api.db.services.dialog_service import DialogService
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.llm_service import TenantLLMService
@@ -249,6 +250,7 @@ def delete(tenant_id):
             continue
         temp_dict = {"status": StatusEnum.INVALID.value}
         DialogService.update_by_id(id, temp_dict)
+        ConversationService.delete_messages_by_dialog_ids([id])
         success_count += 1
 
     if errors:
@@ -28,15 +28,14 @@ from api.db.db_models import Task
 from api.db.services.task_service import TaskService, queue_tasks
 from api.utils.api_utils import server_error_response
 from api.utils.api_utils import get_result, get_error_data_result
-from io import BytesIO
-from flask import request, send_file
+from flask import request
 from api.db import FileSource, TaskStatus, FileType
 from api.db.db_models import File
 from api.db.services.document_service import DocumentService
 from api.db.services.file2document_service import File2DocumentService
 from api.db.services.file_service import FileService
 from api.db.services.knowledgebase_service import KnowledgebaseService
-from api.utils.api_utils import construct_json_result, get_parser_config, check_duplicate_ids
+from api.utils.api_utils import construct_json_result, get_parser_config, check_duplicate_ids, send_storage_object
 from rag.nlp import search
 from rag.prompts import keyword_extraction
 from rag.app.tag import label_question
@@ -411,19 +410,12 @@ def download(tenant_id, dataset_id, document_id):
     doc_id, doc_location = File2DocumentService.get_storage_address(
         doc_id=document_id
     )  # minio address
-    file_stream = STORAGE_IMPL.get(doc_id, doc_location)
-    if not file_stream:
+    response = send_storage_object(doc_id, doc_location, download_name=doc[0].name)
+    if response is None:
         return construct_json_result(
             message="This file is empty.", code=settings.RetCode.DATA_ERROR
         )
-    file = BytesIO(file_stream)
-    # Use send_file with a proper filename and MIME type
-    return send_file(
-        file,
-        as_attachment=True,
-        download_name=doc[0].name,
-        mimetype="application/octet-stream",  # Set a default MIME type
-    )
+    return response
 
 
 @manager.route("/datasets/<dataset_id>/documents", methods=["GET"])  # noqa: F821
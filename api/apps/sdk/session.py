@@ -77,8 +77,8 @@ def create_agent_session(tenant_id, agent_id):
         return get_error_data_result("Agent not found.")
     if not UserCanvasService.query(user_id=tenant_id, id=agent_id):
         return get_error_data_result("You cannot access the agent.")
-    if not isinstance(cvs.dsl, str):
-        cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
+    if isinstance(cvs.dsl, str):
+        cvs.dsl = json.loads(cvs.dsl)
 
     canvas = Canvas(cvs.dsl, tenant_id)
     canvas.reset()
@@ -117,7 +117,7 @@ def create_agent_session(tenant_id, agent_id):
     for ans in canvas.run(stream=False):
         pass
 
-    cvs.dsl = json.loads(str(canvas))
+    canvas.dump(cvs.dsl)
     conv = {"id": get_uuid(), "dialog_id": cvs.id, "user_id": user_id, "message": [{"role": "assistant", "content": canvas.get_prologue()}], "source": "agent", "dsl": cvs.dsl}
     API4ConversationService.save(**conv)
     conv["agent_id"] = conv.pop("dialog_id")
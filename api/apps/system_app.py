@@ -19,9 +19,11 @@ import json
 
 from flask_login import login_required, current_user
 
+from agent.component.exesql import SQL_POOL
 from api.db.db_models import APIToken
 from api.db.services.api_service import APITokenService
 from api.db.services.knowledgebase_service import KnowledgebaseService
+from api.db.services.llm_service import MODEL_POOL
 from api.db.services.user_service import UserTenantService
 from api import settings
 from api.utils import current_timestamp, datetime_format
@@ -165,6 +167,8 @@ def status():
     except Exception:
         logging.exception("get task executor heartbeats failed!")
     res["task_executor_heartbeats"] = task_executor_heartbeats
+    res["model_pool"] = MODEL_POOL.metrics()
+    res["sql_pool"] = SQL_POOL.metrics()
 
     return get_json_result(data=res)
 
@@ -727,6 +727,20 @@ class Conversation(DataBaseModel):
         db_table = "conversation"
 
 
+class ConversationMessage(DataBaseModel):
+    id = CharField(max_length=32, primary_key=True)
+    conversation_id = CharField(max_length=32, null=False, index=True)
+    message_id = CharField(max_length=64, null=True, help_text="id shared by a question and its answer", index=True)
+    seq = IntegerField(default=0, index=True)
+    role = CharField(max_length=16, null=False, help_text="user|assistant", index=True)
+    message = JSONField(null=False, default={})
+    reference = JSONField(null=True, help_text="reference of an answer")
+
+    class Meta:
+        db_table = "conversation_message"
+        indexes = ((("conversation_id", "seq"), True),)
+
+
 class APIToken(DataBaseModel):
     tenant_id = CharField(max_length=32, null=False, index=True)
     token = CharField(max_length=255, null=False, index=True)
@@ -125,12 +125,12 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
     e, cvs = UserCanvasService.get_by_id(agent_id)
     assert e, "Agent not found."
     assert cvs.user_id == tenant_id, "You do not own the agent."
-    if not isinstance(cvs.dsl,str):
-        cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
-    canvas = Canvas(cvs.dsl, tenant_id)
-    canvas.reset()
+    if isinstance(cvs.dsl, str):
+        cvs.dsl = json.loads(cvs.dsl)
     message_id = str(uuid4())
     if not session_id:
+        canvas = Canvas(cvs.dsl, tenant_id)
+        canvas.reset()
         query = canvas.get_preset_param()
         if query:
             for ele in query:
@@ -144,7 +144,7 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
                     else:
                         if "value" in ele:
                             ele.pop("value")
-        cvs.dsl = json.loads(str(canvas))
+        canvas.dump(cvs.dsl)
         session_id=get_uuid()
         conv = {
             "id": session_id,
@@ -159,7 +159,7 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
     else:
         e, conv = API4ConversationService.get_by_id(session_id)
         assert e, "Session not found!"
-        canvas = Canvas(json.dumps(conv.dsl), tenant_id)
+        canvas = Canvas(conv.dsl, tenant_id)
         canvas.messages.append({"role": "user", "content": question, "id": message_id})
         canvas.add_user_input(question)
         if not conv.message:
@@ -194,11 +194,11 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
             canvas.history.append(("assistant", final_ans["content"]))
             if final_ans.get("reference"):
                 canvas.reference.append(final_ans["reference"])
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
             API4ConversationService.append_message(conv.id, conv.to_dict())
         except Exception as e:
             traceback.print_exc()
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
             API4ConversationService.append_message(conv.id, conv.to_dict())
             yield "data:" + json.dumps({"code": 500, "message": str(e),
                                         "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
@@ -213,7 +213,7 @@ def completion(tenant_id, agent_id, question, session_id=None, stream=True, **kw
             canvas.messages.append({"role": "assistant", "content": final_ans["content"], "id": message_id})
             if final_ans.get("reference"):
                 canvas.reference.append(final_ans["reference"])
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
 
             result = {"answer": final_ans["content"], "reference": final_ans.get("reference", []) , "param": canvas.get_preset_param()}
             result = structure_answer(conv, result, message_id, session_id)
@@ -241,15 +241,14 @@ def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True
         )
         return
     
-    if not isinstance(cvs.dsl, str):
-        cvs.dsl = json.dumps(cvs.dsl, ensure_ascii=False)
-    
-    canvas = Canvas(cvs.dsl, tenant_id)
-    canvas.reset()
+    if isinstance(cvs.dsl, str):
+        cvs.dsl = json.loads(cvs.dsl)
     message_id = str(uuid4())
     
     # Handle new session creation
     if not session_id:
+        canvas = Canvas(cvs.dsl, tenant_id)
+        canvas.reset()
         query = canvas.get_preset_param()
         if query:
             for ele in query:
@@ -271,7 +270,7 @@ def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True
                         if "value" in ele:
                             ele.pop("value")
         
-        cvs.dsl = json.loads(str(canvas))
+        canvas.dump(cvs.dsl)
         session_id = get_uuid()
         conv = {
             "id": session_id,
@@ -295,7 +294,7 @@ def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True
             )
             return
         
-        canvas = Canvas(json.dumps(conv.dsl), tenant_id)
+        canvas = Canvas(conv.dsl, tenant_id)
         canvas.messages.append({"role": "user", "content": question, "id": message_id})
         canvas.add_user_input(question)
         
@@ -356,14 +355,14 @@ def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True
             canvas.history.append(("assistant", final_ans["content"]))
             if final_ans.get("reference"):
                 canvas.reference.append(final_ans["reference"])
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
             API4ConversationService.append_message(conv.id, conv.to_dict())
             
             yield "data: [DONE]\n\n"
             
         except Exception as e:
             traceback.print_exc()
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
             API4ConversationService.append_message(conv.id, conv.to_dict())
             yield "data: " + json.dumps(
                 get_data_openai(
@@ -396,7 +395,7 @@ def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True
             canvas.history.append(("assistant", final_ans["content"]))
             if final_ans.get("reference"):
                 canvas.reference.append(final_ans["reference"])
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
             API4ConversationService.append_message(conv.id, conv.to_dict())
             
             # Return the response in OpenAI format
@@ -412,7 +411,7 @@ def completionOpenAI(tenant_id, agent_id, question, session_id=None, stream=True
             
         except Exception as e:
             traceback.print_exc()
-            conv.dsl = json.loads(str(canvas))
+            canvas.dump(conv.dsl)
             API4ConversationService.append_message(conv.id, conv.to_dict())
             yield get_data_openai(
                 id=session_id,
@@ -13,22 +13,213 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import os
 import time
+from collections import defaultdict
+from datetime import datetime
 from uuid import uuid4
+
+from peewee import fn
+
 from api.db import StatusEnum
-from api.db.db_models import Conversation, DB
+from api.db.db_models import Conversation, ConversationMessage, DB
 from api.db.services.api_service import API4ConversationService
 from api.db.services.common_service import CommonService
 from api.db.services.dialog_service import DialogService, chat
-from api.utils import get_uuid
+from api.utils import current_timestamp, datetime_format, get_uuid
 import json
 
 from rag.prompts import chunks_format
 
+# How many of the latest messages are used as history when prompting the LLM, 0 for all of them.
+CONVERSATION_HISTORY_WINDOW = int(os.environ.get("CONVERSATION_HISTORY_WINDOW", 64))
+
+
+def empty_reference():
+    return {"chunks": [], "doc_aggs": []}
+
 
 class ConversationService(CommonService):
+    """
+    The messages of a conversation are split in two parts: the `message`/`reference` columns of the
+    conversation row, which only hold the prologue (and the whole history of sessions written before
+    the message log existed), followed by the `conversation_message` rows, one per message, that every
+    turn appends to. `get_by_id` and `get_list` return both parts merged so readers see one history.
+    """
     model = Conversation
 
+    @classmethod
+    def get_by_id(cls, pid, load_messages=True):
+        e, conv = super().get_by_id(pid)
+        if e and load_messages:
+            cls.load_messages([conv])
+        return e, conv
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_id(cls, pid):
+        with DB.atomic():
+            ConversationMessage.delete().where(ConversationMessage.conversation_id == pid).execute()
+            return super().delete_by_id(pid)
+
+    @classmethod
+    @DB.connection_context()
+    def delete_by_ids(cls, pids):
+        with DB.atomic():
+            ConversationMessage.delete().where(ConversationMessage.conversation_id.in_(pids)).execute()
+            return super().delete_by_ids(pids)
+
+    @classmethod
+    @DB.connection_context()
+    def filter_delete(cls, filters):
+        with DB.atomic():
+            ConversationMessage.delete().where(ConversationMessage.conversation_id.in_(cls.model.select(cls.model.id).where(*filters))).execute()
+            return super().filter_delete(filters)
+
+    @classmethod
+    @DB.connection_context()
+    def delete_messages_by_dialog_ids(cls, dialog_ids):
+        # Dialogs are only marked invalid, their conversations are kept but the message log goes with them.
+        convs = cls.model.select(cls.model.id).where(cls.model.dialog_id.in_(dialog_ids))
+        return ConversationMessage.delete().where(ConversationMessage.conversation_id.in_(convs)).execute()
+
+    @classmethod
+    @DB.connection_context()
+    def load_messages(cls, convs, with_reference=True):
+        # Appends the logged messages, and the references of the answers, to the ones kept in the row.
+        if not convs:
+            return convs
+        cols = [ConversationMessage.conversation_id, ConversationMessage.role, ConversationMessage.message]
+        if with_reference:
+            cols.append(ConversationMessage.reference)
+        rows = ConversationMessage.select(*cols).where(ConversationMessage.conversation_id.in_([c.id for c in convs])).order_by(ConversationMessage.seq)
+        logged = defaultdict(list)
+        for r in rows:
+            logged[r.conversation_id].append(r)
+        for conv in convs:
+            rows = logged.get(conv.id)
+            if not rows:
+                continue
+            conv.message = (conv.message or []) + [r.message for r in rows]
+            if with_reference:
+                conv.reference = (conv.reference or []) + [r.reference or empty_reference() for r in rows if r.role == "assistant"]
+        return convs
+
+    @classmethod
+    @DB.connection_context()
+    def get_messages(cls, conv, window=CONVERSATION_HISTORY_WINDOW):
+        # The latest `window` messages of a conversation row fetched without its log, references are not loaded.
+        rows = ConversationMessage.select(ConversationMessage.message).where(ConversationMessage.conversation_id == conv.id).order_by(ConversationMessage.seq.desc())
+        if window > 0:
+            rows = rows.limit(window)
+        messages = [r.message for r in rows][::-1]
+        if window <= 0:
+            return (conv.message or []) + messages
+        if len(messages) < window:
+            messages = (conv.message or [])[len(messages) - window:] + messages
+        return messages
+
+    @classmethod
+    @DB.connection_context()
+    def append_messages(cls, conv_id, messages, reference=None):
+        # Logs the messages of a turn; the reference goes with the answer, i.e. the last assistant message.
+        now = current_timestamp()
+        date = datetime_format(datetime.now())
+        with DB.atomic():
+            # Locks the conversation row so that concurrent turns can't take the same seq.
+            cls.model.select(cls.model.id).where(cls.model.id == conv_id).for_update().execute()
+            last = ConversationMessage.select(fn.MAX(ConversationMessage.seq)).where(ConversationMessage.conversation_id == conv_id).scalar()
+            seq = 0 if last is None else last + 1
+            rows = []
+            for i, m in enumerate(messages):
+                rows.append({
+                    "id": get_uuid(),
+                    "conversation_id": conv_id,
+                    "message_id": m.get("id"),
+                    "seq": seq + i,
+                    "role": m.get("role", ""),
+                    "message": m,
+                    "reference": None,
+                    "create_time": now,
+                    "create_date": date,
+                    "update_time": now,
+                    "update_date": date,
+                })
+            for r in reversed(rows):
+                if r["role"] == "assistant":
+                    r["reference"] = reference or empty_reference()
+                    break
+            if rows:
+                ConversationMessage.insert_many(rows).execute()
+            cls.model.update(update_time=now, update_date=date).where(cls.model.id == conv_id).execute()
+
+    @classmethod
+    @DB.connection_context()
+    def update_message(cls, conv_id, message_id, role, update):
+        # Applies `update` to the message `message_id` with the given role in place.
+        row = ConversationMessage.get_or_none((ConversationMessage.conversation_id == conv_id) & (ConversationMessage.message_id == message_id) & (ConversationMessage.role == role))
+        if row:
+            update(row.message)
+            ConversationMessage.update(message=row.message, update_time=current_timestamp(), update_date=datetime_format(datetime.now())).where(ConversationMessage.id == row.id).execute()
+            return True
+
+        e, conv = cls.get_by_id(conv_id, load_messages=False)
+        if not e:
+            return False
+        for m in conv.message or []:
+            if m.get("id", "") == message_id and m.get("role", "") == role:
+                update(m)
+                cls.update_by_id(conv_id, {"message": conv.message})
+                return True
+        return False
+
+    @classmethod
+    @DB.connection_context()
+    def delete_message(cls, conv_id, message_id):
+        # Deletes a question along with its answer and the answer's reference.
+        if ConversationMessage.delete().where((ConversationMessage.conversation_id == conv_id) & (ConversationMessage.message_id == message_id)).execute():
+            return True
+
+        e, conv = cls.get_by_id(conv_id, load_messages=False)
+        if not e:
+            return False
+        message, reference = conv.message or [], conv.reference or []
+        for i, msg in enumerate(message):
+            if message_id != msg.get("id", ""):
+                continue
+            assert message[i + 1]["id"] == message_id
+            message.pop(i)
+            message.pop(i)
+            if reference:
+                reference.pop(max(0, i // 2 - 1))
+            cls.update_by_id(conv_id, {"message": message, "reference": reference})
+            return True
+        return False
+
+    @classmethod
+    @DB.connection_context()
+    def truncate_messages(cls, conv_id, message_id):
+        # Drops the turn `message_id` and everything after it, so that the question can be asked again.
+        if not message_id:
+            return
+        first = ConversationMessage.select(fn.MIN(ConversationMessage.seq)).where((ConversationMessage.conversation_id == conv_id) & (ConversationMessage.message_id == message_id)).scalar()
+        if first is not None:
+            ConversationMessage.delete().where((ConversationMessage.conversation_id == conv_id) & (ConversationMessage.seq >= first)).execute()
+            return
+
+        e, conv = cls.get_by_id(conv_id, load_messages=False)
+        if not e:
+            return
+        message = conv.message or []
+        for i, m in enumerate(message):
+            if m.get("id") == message_id:
+                break
+        else:
+            return
+        turns = len([m for m in message[:i] if m.get("role") == "user"])
+        ConversationMessage.delete().where(ConversationMessage.conversation_id == conv_id).execute()
+        cls.update_by_id(conv_id, {"message": message[:i], "reference": (conv.reference or [])[:turns]})
+
     @classmethod
     @DB.connection_context()
     def get_list(cls, dialog_id, page_number, items_per_page, orderby, desc, id, name, user_id=None):
@@ -44,9 +235,10 @@ class ConversationService(CommonService):
         else:
             sessions = sessions.order_by(cls.model.getter_by(orderby).asc())
 
-        sessions = sessions.paginate(page_number, items_per_page)
+        sessions = list(sessions.paginate(page_number, items_per_page))
+        cls.load_messages(sessions)
 
-        return list(sessions.dicts())
+        return [s.to_dict() for s in sessions]
 
 
 def structure_answer(conv, ans, message_id, session_id):
@@ -75,7 +267,37 @@ def structure_answer(conv, ans, message_id, session_id):
     return ans
 
 
-def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, **kwargs):
+def delta_answers(answers):
+    """
+    Delta streaming: each answer from chat() holds the whole answer so far, the frames only carry
+    what was appended as "delta", or the whole "answer" if it was rewritten (e.g. citations inserted).
+    The reference is sent once, with the last frame. Clients rebuild the answer by appending deltas.
+    """
+    sent = ""
+    last = None
+    for ans in answers:
+        last = ans
+        answer = ans.get("answer", "")
+        frame = {"id": ans.get("id"), "session_id": ans.get("session_id")}
+        if answer.startswith(sent):
+            if len(answer) == len(sent) and not ans.get("audio_binary"):
+                continue
+            frame["delta"] = answer[len(sent):]
+        else:
+            frame["answer"] = answer
+        if ans.get("audio_binary"):
+            frame["audio_binary"] = ans["audio_binary"]
+        sent = answer
+        yield frame
+    if last is not None:
+        frame = {"id": last.get("id"), "session_id": last.get("session_id"), "delta": "", "reference": last.get("reference", {})}
+        for k in ["prompt", "created_at"]:
+            if k in last:
+                frame[k] = last[k]
+        yield frame
+
+
+def completion(tenant_id, chat_id, question, name="New session", session_id=None, stream=True, delta=False, **kwargs):
     assert name, "`name` can not be empty."
     dia = DialogService.query(id=chat_id, tenant_id=tenant_id, status=StatusEnum.VALID.value)
     assert dia, "You do not own the chat."
@@ -113,6 +335,7 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         "role": "user",
         "id": str(uuid4())
     }
+    conv.message = ConversationService.get_messages(conv)
     conv.message.append(question)
     for m in conv.message:
         if m["role"] == "system":
@@ -123,17 +346,18 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
     message_id = msg[-1].get("id")
     e, dia = DialogService.get_by_id(conv.dialog_id)
 
-    if not conv.reference:
-        conv.reference = []
+    # Former references are not needed to answer, only the one of this turn is kept.
+    conv.reference = [empty_reference()]
     conv.message.append({"role": "assistant", "content": "", "id": message_id})
-    conv.reference.append({"chunks": [], "doc_aggs": []})
 
     if stream:
         try:
-            for ans in chat(dia, msg, True, **kwargs):
-                ans = structure_answer(conv, ans, message_id, session_id)
+            answers = (structure_answer(conv, ans, message_id, session_id) for ans in chat(dia, msg, True, **kwargs))
+            if delta:
+                answers = delta_answers(answers)
+            for ans in answers:
                 yield "data:" + json.dumps({"code": 0, "data": ans}, ensure_ascii=False) + "\n\n"
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.append_messages(conv.id, conv.message[-2:], conv.reference[-1])
         except Exception as e:
             yield "data:" + json.dumps({"code": 500, "message": str(e),
                                         "data": {"answer": "**ERROR**: " + str(e), "reference": []}},
@@ -144,12 +368,12 @@ def completion(tenant_id, chat_id, question, name="New session", session_id=None
         answer = None
         for ans in chat(dia, msg, False, **kwargs):
             answer = structure_answer(conv, ans, message_id, session_id)
-            ConversationService.update_by_id(conv.id, conv.to_dict())
+            ConversationService.append_messages(conv.id, conv.message[-2:], conv.reference[-1])
             break
         yield answer
 
 
-def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwargs):
+def iframe_completion(dialog_id, question, session_id=None, stream=True, delta=False, **kwargs):
     e, dia = DialogService.get_by_id(dialog_id)
     assert e, "Dialog not found"
     if not session_id:
@@ -204,8 +428,10 @@ def iframe_completion(dialog_id, question, session_id=None, stream=True, **kwarg
 
     if stream:
         try:
-            for ans in chat(dia, msg, True, **kwargs):
-                ans = structure_answer(conv, ans, message_id, session_id)
+            answers = (structure_answer(conv, ans, message_id, session_id) for ans in chat(dia, msg, True, **kwargs))
+            if delta:
+                answers = delta_answers(answers)
+            for ans in answers:
                 yield "data:" + json.dumps({"code": 0, "message": "", "data": ans},
                                            ensure_ascii=False) + "\n\n"
             API4ConversationService.append_message(conv.id, conv.to_dict())
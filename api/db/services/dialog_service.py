@@ -15,8 +15,10 @@
 #
 import binascii
 import logging
+import os
 import re
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from copy import deepcopy
 from datetime import datetime
 from functools import partial
@@ -127,6 +129,55 @@ def chat_solo(dialog, messages, stream=True):
         yield {"answer": answer, "reference": {}, "audio_binary": tts(tts_mdl, answer), "prompt": "", "created_at": time.time()}
 
 
+# Seconds a retrieval source is waited for, from when it starts running, before it is given up on.
+RETRIEVAL_DEADLINES = {
+    "knowledge base": float(os.environ.get("RETRIEVAL_KB_TIMEOUT", 120)),
+    "web search": float(os.environ.get("RETRIEVAL_WEB_TIMEOUT", 15)),
+    "knowledge graph": float(os.environ.get("RETRIEVAL_KG_TIMEOUT", 60)),
+}
+
+
+def retrieve_concurrently(sources: dict):
+    """
+    Runs the retrieval sources, name -> callable, concurrently, on a pool of one thread per source.
+    A source still running past its deadline (see RETRIEVAL_DEADLINES) is given up on and left out,
+    an exception raised by a source is raised here.
+    Returns the results by name, in the order they arrived, and the elapsed ms of every source,
+    None for the ones given up on.
+    """
+    started = {}
+
+    def run(name, func):
+        started[name] = timer()
+        res = func()
+        return res, (timer() - started[name]) * 1000
+
+    executor = ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix="retrieval")
+    try:
+        futures = {executor.submit(run, name, func): name for name, func in sources.items()}
+        results, timings = {}, {}
+        pending = set(futures)
+        while pending:
+            now = timer()
+            # a source not started yet can't have timed out
+            deadlines = {f: started.get(futures[f], now) + RETRIEVAL_DEADLINES.get(futures[f], 60) for f in pending}
+            for f in [f for f in pending if deadlines[f] <= now]:
+                pending.discard(f)
+                f.cancel()
+                timings[futures[f]] = None
+                logging.warning(f"Retrieval from {futures[f]} timed out after {RETRIEVAL_DEADLINES.get(futures[f], 60)}s.")
+            if not pending:
+                break
+            done, _ = wait(pending, timeout=min(deadlines[f] for f in pending) - now, return_when=FIRST_COMPLETED)
+            for f in done:
+                pending.discard(f)
+                results[futures[f]], timings[futures[f]] = f.result()
+        return results, timings
+    finally:
+        # sources given up on finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def chat(dialog, messages, stream=True, **kwargs):
     assert messages[-1]["role"] == "user", "The last content of this conversation is not from user."
     if not dialog.kb_ids:
@@ -137,9 +188,9 @@ def chat(dialog, messages, stream=True, **kwargs):
     chat_start_ts = timer()
 
     if llm_id2llm_type(dialog.llm_id) == "image2text":
-        llm_model_config = TenantLLMService.get_model_config(dialog.tenant_id, LLMType.IMAGE2TEXT, dialog.llm_id)
+        _, llm_model_config = TenantLLMService.pooled_model(dialog.tenant_id, LLMType.IMAGE2TEXT, dialog.llm_id)
     else:
-        llm_model_config = TenantLLMService.get_model_config(dialog.tenant_id, LLMType.CHAT, dialog.llm_id)
+        _, llm_model_config = TenantLLMService.pooled_model(dialog.tenant_id, LLMType.CHAT, dialog.llm_id)
 
     max_tokens = llm_model_config.get("max_tokens", 8192)
 
@@ -225,6 +276,7 @@ def chat(dialog, messages, stream=True, **kwargs):
 
     bind_reranker_ts = timer()
     generate_keyword_ts = bind_reranker_ts
+    retrieval_timings = {}
     thought = ""
     kbinfos = {"total": 0, "chunks": [], "doc_aggs": []}
 
@@ -252,30 +304,41 @@ def chat(dialog, messages, stream=True, **kwargs):
                 elif stream:
                     yield think
         else:
-            kbinfos = retriever.retrieval(
-                " ".join(questions),
-                embd_mdl,
-                tenant_ids,
-                dialog.kb_ids,
-                1,
-                dialog.top_n,
-                dialog.similarity_threshold,
-                dialog.vector_similarity_weight,
-                doc_ids=attachments,
-                top=dialog.top_k,
-                aggs=False,
-                rerank_mdl=rerank_mdl,
-                rank_feature=label_question(" ".join(questions), kbs),
-            )
+            question = " ".join(questions)
+            sources = {
+                "knowledge base": lambda: retriever.retrieval(
+                    question,
+                    embd_mdl,
+                    tenant_ids,
+                    dialog.kb_ids,
+                    1,
+                    dialog.top_n,
+                    dialog.similarity_threshold,
+                    dialog.vector_similarity_weight,
+                    doc_ids=attachments,
+                    top=dialog.top_k,
+                    aggs=False,
+                    rerank_mdl=rerank_mdl,
+                    rank_feature=label_question(question, kbs),
+                )
+            }
             if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
-                kbinfos["chunks"].extend(tav_res["chunks"])
-                kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
+                sources["web search"] = lambda: Tavily(prompt_config["tavily_api_key"]).retrieve_chunks(question)
             if prompt_config.get("use_kg"):
-                ck = settings.kg_retrievaler.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
+                sources["knowledge graph"] = lambda: settings.kg_retrievaler.retrieval(question, tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
+            results, retrieval_timings = retrieve_concurrently(sources)
+            if retrieval_timings["knowledge base"] is None:
+                # answering without the knowledge base would look grounded while it is not
+                raise TimeoutError(f"Retrieval from the knowledge base timed out after {RETRIEVAL_DEADLINES['knowledge base']}s, please retry later.")
+
+            # Merged in a fixed order whatever the arrival order, so that chunk indexes cited by the answer are stable.
+            kbinfos = results.get("knowledge base", kbinfos)
+            if "web search" in results:
+                kbinfos["chunks"].extend(results["web search"]["chunks"])
+                kbinfos["doc_aggs"].extend(results["web search"]["doc_aggs"])
+            ck = results.get("knowledge graph")
+            if ck and ck["content_with_weight"]:
+                kbinfos["chunks"].insert(0, ck)
 
             knowledges = kb_prompt(kbinfos, max_tokens)
 
@@ -407,7 +470,8 @@ def chat(dialog, messages, stream=True, **kwargs):
             f"  - Bind reranker: {bind_reranker_time_cost:.1f}ms\n"
             f"  - Generate keyword: {generate_keyword_time_cost:.1f}ms\n"
             f"  - Retrieval: {retrieval_time_cost:.1f}ms\n"
-            f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
+            + "".join(f"    - {name}: " + ("timed out\n" if ms is None else f"{ms:.1f}ms\n") for name, ms in retrieval_timings.items())
+            + f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
             "## Token usage:\n"
             f"  - Generated tokens(approximately): {tk_num}\n"
             f"  - Token speed: {int(tk_num / (generate_result_time_cost / 1000.0))}/s"
@@ -15,6 +15,7 @@
 #
 import json
 import logging
+import os
 import random
 import re
 from concurrent.futures import ThreadPoolExecutor
@@ -42,6 +43,7 @@ from rag.utils.doc_store_conn import OrderByExpr
 
 class DocumentService(CommonService):
     model = Document
+    _last_reconcile = 0
 
     @classmethod
     @DB.connection_context()
@@ -440,64 +442,130 @@ class DocumentService(CommonService):
     def update_meta_fields(cls, doc_id, meta_fields):
         return cls.update_by_id(doc_id, {"meta_fields": meta_fields})
 
+    @classmethod
+    @DB.connection_context()
+    def get_unfinished_docs_by_ids(cls, doc_ids):
+        fields = [cls.model.id, cls.model.process_begin_at, cls.model.parser_config, cls.model.progress_msg,
+                  cls.model.run, cls.model.parser_id]
+        docs = cls.model.select(*fields) \
+            .where(
+            cls.model.id.in_(doc_ids),
+            cls.model.status == StatusEnum.VALID.value,
+            ~(cls.model.type == FileType.VIRTUAL.value),
+            cls.model.progress < 1,
+            cls.model.progress > 0)
+        return list(docs.dicts())
+
     @classmethod
     @DB.connection_context()
     def update_progress(cls):
-        docs = cls.get_unfinished_docs()
+        """
+        Aggregate task progress into documents.
+        Task state changes are recorded in Redis by record_task_progress(), so only the documents
+        touched since the last call are aggregated, without reading their tasks from the DB.
+        All unfinished documents are reconciled every DOC_PROGRESS_RECONCILE_INTERVAL seconds,
+        which also covers documents without recorded state, e.g. queued before Redis was flushed.
+        """
+        now = datetime.now().timestamp()
+        if now - cls._last_reconcile >= DOC_PROGRESS_RECONCILE_INTERVAL:
+            cls._last_reconcile = now
+            REDIS_CONN.delete(DOC_PROGRESS_DIRTY)
+            cls.aggregate_progress(cls.get_unfinished_docs())
+            return
+
+        while True:
+            doc_ids = REDIS_CONN.spop(DOC_PROGRESS_DIRTY, DOC_PROGRESS_FLUSH_BATCH)
+            if not doc_ids:
+                return
+            cls.aggregate_progress(cls.get_unfinished_docs_by_ids(doc_ids))
+            if len(doc_ids) < DOC_PROGRESS_FLUSH_BATCH:
+                return
+
+    @classmethod
+    @DB.connection_context()
+    def aggregate_progress(cls, docs):
+        if not docs:
+            return
+        states = REDIS_CONN.hgetall([doc_progress_key(d["id"]) for d in docs])
+        doc_tsks = {}
+        missing = []
+        for d, state in zip(docs, states):
+            tsks = parse_task_progress(state)
+            if tsks is None:
+                missing.append(d["id"])
+            else:
+                doc_tsks[d["id"]] = tsks
+        # no recorded state, read the tasks of all such documents at once and record them
+        for i in range(0, len(missing), 1000):
+            tsks = Task.select(Task.id, Task.doc_id, Task.progress, Task.progress_msg, Task.task_type, Task.priority) \
+                .where(Task.doc_id.in_(missing[i:i + 1000])).dicts()
+            for t in tsks:
+                doc_tsks.setdefault(t["doc_id"], []).append(t)
+            for doc_id in missing[i:i + 1000]:
+                if doc_id in doc_tsks:
+                    record_task_progress(doc_id, doc_tsks[doc_id], reset=True, notify=False)
+
+        updates = []
         for d in docs:
             try:
-                tsks = Task.query(doc_id=d["id"], order_by=Task.create_time)
+                tsks = doc_tsks.get(d["id"])
                 if not tsks:
                     continue
-                msg = []
-                prg = 0
-                finished = True
-                bad = 0
-                has_raptor = False
-                has_graphrag = False
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
-                priority = 0
-                for t in tsks:
-                    if 0 <= t.progress < 1:
-                        finished = False
-                    if t.progress == -1:
-                        bad += 1
-                    prg += t.progress if t.progress >= 0 else 0
-                    msg.append(t.progress_msg)
-                    if t.task_type == "raptor":
-                        has_raptor = True
-                    elif t.task_type == "graphrag":
-                        has_graphrag = True
-                    priority = max(priority, t.priority)
-                prg /= len(tsks)
-                if finished and bad:
-                    prg = -1
-                    status = TaskStatus.FAIL.value
-                elif finished:
-                    if d["parser_config"].get("raptor", {}).get("use_raptor") and not has_raptor:
-                        queue_raptor_o_graphrag_tasks(d, "raptor", priority)
-                        prg = 0.98 * len(tsks) / (len(tsks) + 1)
-                    elif d["parser_config"].get("graphrag", {}).get("use_graphrag") and not has_graphrag:
-                        queue_raptor_o_graphrag_tasks(d, "graphrag", priority)
-                        prg = 0.98 * len(tsks) / (len(tsks) + 1)
-                    else:
-                        status = TaskStatus.DONE.value
-
-                msg = "\n".join(sorted(msg))
-                info = {
-                    "process_duation": datetime.timestamp(
-                        datetime.now()) -
-                    d["process_begin_at"].timestamp(),
-                    "run": status}
-                if prg != 0:
-                    info["progress"] = prg
-                if msg:
-                    info["progress_msg"] = msg
-                cls.update_by_id(d["id"], info)
+                updates.append((d["id"], cls._aggregate_doc_progress(d, tsks)))
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
+        with DB.atomic():
+            for doc_id, info in updates:
+                cls.update_by_id(doc_id, info)
+
+    @classmethod
+    def _aggregate_doc_progress(cls, d, tsks):
+        msg = []
+        prg = 0
+        finished = True
+        bad = 0
+        has_raptor = False
+        has_graphrag = False
+        status = d["run"]  # TaskStatus.RUNNING.value
+        priority = 0
+        for t in tsks:
+            if 0 <= t["progress"] < 1:
+                finished = False
+            if t["progress"] == -1:
+                bad += 1
+            prg += t["progress"] if t["progress"] >= 0 else 0
+            msg.append(t["progress_msg"])
+            if t["task_type"] == "raptor":
+                has_raptor = True
+            elif t["task_type"] == "graphrag":
+                has_graphrag = True
+            priority = max(priority, t["priority"])
+        prg /= len(tsks)
+        if finished and bad:
+            prg = -1
+            status = TaskStatus.FAIL.value
+        elif finished:
+            if d["parser_config"].get("raptor", {}).get("use_raptor") and not has_raptor:
+                queue_raptor_o_graphrag_tasks(d, "raptor", priority)
+                prg = 0.98 * len(tsks) / (len(tsks) + 1)
+            elif d["parser_config"].get("graphrag", {}).get("use_graphrag") and not has_graphrag:
+                queue_raptor_o_graphrag_tasks(d, "graphrag", priority)
+                prg = 0.98 * len(tsks) / (len(tsks) + 1)
+            else:
+                status = TaskStatus.DONE.value
+
+        msg = "\n".join(sorted(msg))
+        info = {
+            "process_duation": datetime.timestamp(
+                datetime.now()) -
+            d["process_begin_at"].timestamp(),
+            "run": status}
+        if prg != 0:
+            info["progress"] = prg
+        if msg:
+            info["progress_msg"] = msg
+        return info
 
     @classmethod
     @DB.connection_context()
@@ -516,6 +584,56 @@ class DocumentService(CommonService):
         return False
 
 
+DOC_PROGRESS_DIRTY = "doc_progress_dirty"
+DOC_PROGRESS_EXPIRE = 7 * 24 * 3600
+DOC_PROGRESS_FLUSH_BATCH = int(os.environ.get("DOC_PROGRESS_FLUSH_BATCH", "256"))
+DOC_PROGRESS_RECONCILE_INTERVAL = int(os.environ.get("DOC_PROGRESS_RECONCILE_INTERVAL", "120"))
+# hash field suffix of each recorded task attribute
+TASK_PROGRESS_FIELDS = {"progress": "p", "progress_msg": "m", "task_type": "t", "priority": "r"}
+
+
+def doc_progress_key(doc_id):
+    return f"doc_progress:{doc_id}"
+
+
+def record_task_progress(doc_id, tasks, reset=False, notify=True):
+    """
+    Record task state changes of a document in Redis, and mark the document for the next
+    DocumentService.update_progress(). Tasks are dicts with "id" and any of the attributes
+    in TASK_PROGRESS_FIELDS. reset=True replaces the state with the given, complete task list.
+    """
+    mapping = {}
+    for t in tasks:
+        for k, f in TASK_PROGRESS_FIELDS.items():
+            if k in t:
+                mapping[f"{t['id']}:{f}"] = json.dumps(t[k] or ("" if k in ["progress_msg", "task_type"] else 0))
+    if reset:
+        # only a complete task list can be aggregated
+        mapping["_"] = "1"
+    if not mapping:
+        return
+    REDIS_CONN.hset(doc_progress_key(doc_id), mapping, DOC_PROGRESS_EXPIRE, reset)
+    if notify:
+        REDIS_CONN.sadd(DOC_PROGRESS_DIRTY, doc_id)
+
+
+def parse_task_progress(state):
+    """Tasks recorded by record_task_progress(), None if the state is incomplete."""
+    if not state or "_" not in state:
+        return None
+    tsks = {}
+    names = {f: k for k, f in TASK_PROGRESS_FIELDS.items()}
+    for field, v in state.items():
+        if field == "_":
+            continue
+        tid, f = field.rsplit(":", 1)
+        tsks.setdefault(tid, {"id": tid})[names[f]] = json.loads(v)
+    for t in tsks.values():
+        if len(t) != len(TASK_PROGRESS_FIELDS) + 1:
+            return None
+    return list(tsks.values())
+
+
 def queue_raptor_o_graphrag_tasks(doc, ty, priority):
     chunking_config = DocumentService.get_chunking_config(doc["id"])
     hasher = xxhash.xxh64()
@@ -539,6 +657,7 @@ def queue_raptor_o_graphrag_tasks(doc, ty, priority):
     hasher.update(ty.encode("utf-8"))
     task["digest"] = hasher.hexdigest()
     bulk_insert_into_db(Task, [task], True)
+    record_task_progress(doc["id"], [{**task, "progress": 0, "priority": 0}], notify=False)
     assert REDIS_CONN.queue_product(get_svr_queue_name(priority), message=task), "Can't access Redis. Please check the Redis' status."
 
 
@@ -14,9 +14,12 @@
 #  limitations under the License.
 #
 import logging
+import operator
 import os
 import re
+import threading
 from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
 
 from flask_login import current_user
 from peewee import fn
@@ -28,9 +31,100 @@ from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.db.services.file2document_service import File2DocumentService
 from api.utils import get_uuid
-from api.utils.file_utils import filename_type, read_potential_broken_pdf, thumbnail_img
+from api.utils.file_utils import THUMBNAIL_EXTENSIONS, filename_type, has_thumbnail, read_potential_broken_pdf, thumbnail_img
+from rag.utils.redis_conn import REDIS_CONN
 from rag.utils.storage_factory import STORAGE_IMPL
 
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+# Thumbnails waiting to be rendered, more are left for a later upload to the knowledge base to queue again
+THUMBNAIL_QUEUE_SIZE = int(os.environ.get("THUMBNAIL_QUEUE_SIZE", 256))
+# Seconds a document whose thumbnail can't be rendered isn't tried again
+THUMBNAIL_RETRY_AFTER = int(os.environ.get("THUMBNAIL_RETRY_AFTER", 7 * 24 * 3600))
+# Documents without thumbnail looked at per backfill
+THUMBNAIL_BACKFILL_SCAN = 1000
+_upload_executor = None
+_thumbnail_executor = None
+_thumbnail_pending = set()
+_thumbnail_lock = threading.Lock()
+
+
+def _store_upload(bucket, location, file, filetype):
+    blob = file.read()
+    if filetype == FileType.PDF.value:
+        blob = read_potential_broken_pdf(blob)
+    STORAGE_IMPL.put(bucket, location, blob)
+    return blob
+
+
+def _thumbnail_failed_key(doc_id):
+    return f"thumbnail_failed:{doc_id}"
+
+
+def _store_thumbnail(kb_id, doc_id, filename, bucket, location):
+    img = None
+    try:
+        if bucket is None:
+            bucket, location = File2DocumentService.get_storage_address(doc_id=doc_id)
+        blob = STORAGE_IMPL.get(bucket, location)
+        img = thumbnail_img(filename, blob) if blob else None
+        if img is not None:
+            thumbnail_location = f"thumbnail_{doc_id}.png"
+            STORAGE_IMPL.put(kb_id, thumbnail_location, img)
+            DocumentService.update_by_id(doc_id, {"thumbnail": thumbnail_location})
+    except Exception:
+        img = None
+        logging.exception(f"Fail to make the thumbnail of {filename} ({doc_id})")
+    finally:
+        if img is None:
+            REDIS_CONN.set(_thumbnail_failed_key(doc_id), "1", THUMBNAIL_RETRY_AFTER)
+        with _thumbnail_lock:
+            _thumbnail_pending.discard(doc_id)
+
+
+def store_thumbnail(kb_id, doc_id, filename, bucket=None, location=None):
+    """
+    Queues the rendering of the thumbnail of a document, read back from the storage (at the document's storage
+    address if no location is given), it's set on the document once stored.
+    Returns whether it's queued: not for files without thumbnails, nor if it already is or the queue is full.
+    """
+    if not has_thumbnail(filename):
+        return False
+    global _thumbnail_executor
+    with _thumbnail_lock:
+        if doc_id in _thumbnail_pending or len(_thumbnail_pending) >= THUMBNAIL_QUEUE_SIZE:
+            return False
+        _thumbnail_pending.add(doc_id)
+        if _thumbnail_executor is None:
+            _thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+    _thumbnail_executor.submit(_store_thumbnail, kb_id, doc_id, filename, bucket, location)
+    return True
+
+
+@DB.connection_context()
+def backfill_thumbnails(kb_id):
+    """
+    Queues, in the room left in the queue, the documents of a knowledge base left without a thumbnail:
+    dropped as the queue was full, or lost when the server restarted before rendering them.
+    The ones which failed within THUMBNAIL_RETRY_AFTER are skipped. Returns how many were queued.
+    """
+    with _thumbnail_lock:
+        room = THUMBNAIL_QUEUE_SIZE - len(_thumbnail_pending)
+    if room <= 0:
+        return 0
+    renderable = reduce(operator.or_, [fn.LOWER(Document.name).endswith("." + ext) for ext in THUMBNAIL_EXTENSIONS])
+    docs = list(Document.select(Document.id, Document.name)
+                .where((Document.kb_id == kb_id) & ((Document.thumbnail == "") | Document.thumbnail.is_null()) & renderable)
+                .order_by(Document.create_time.desc()).limit(THUMBNAIL_BACKFILL_SCAN).dicts())
+    failed = REDIS_CONN.mget([_thumbnail_failed_key(d["id"]) for d in docs])
+    queued = 0
+    for d, f in zip(docs, failed):
+        if queued >= room:
+            break
+        if not f and store_thumbnail(kb_id, d["id"], d["name"]):
+            queued += 1
+    return queued
+
 
 class FileService(CommonService):
     # Service class for managing file operations and storage
@@ -406,39 +500,44 @@ class FileService(CommonService):
         kb_root_folder = self.get_kb_folder(user_id)
         kb_folder = self.new_a_file_from_kb(kb.tenant_id, kb.name, kb_root_folder["id"])
 
-        err, files = [], []
+        # Names are picked in order so that files of the same batch don't take the same one,
+        # the bodies are stored concurrently and the documents inserted once their body is stored.
+        global _upload_executor
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+
+        def taken(**kwargs):
+            return kwargs["name"] in names or DocumentService.query(**kwargs)
+
+        MAX_FILE_NUM_PER_USER = int(os.environ.get("MAX_FILE_NUM_PER_USER", 0))
+        err, files, pending, names, locations = [], [], [], set(), set()
         for file in file_objs:
             try:
-                MAX_FILE_NUM_PER_USER = int(os.environ.get("MAX_FILE_NUM_PER_USER", 0))
-                if MAX_FILE_NUM_PER_USER > 0 and DocumentService.get_doc_count(kb.tenant_id) >= MAX_FILE_NUM_PER_USER:
+                if MAX_FILE_NUM_PER_USER > 0 and DocumentService.get_doc_count(kb.tenant_id) + len(pending) >= MAX_FILE_NUM_PER_USER:
                     raise RuntimeError("Exceed the maximum file number of a free user!")
                 if len(file.filename.encode("utf-8")) >= 128:
                     raise RuntimeError("Exceed the maximum length of file name!")
 
-                filename = duplicate_name(DocumentService.query, name=file.filename, kb_id=kb.id)
+                filename = duplicate_name(taken, name=file.filename, kb_id=kb.id)
                 filetype = filename_type(filename)
                 if filetype == FileType.OTHER.value:
                     raise RuntimeError("This type of file has not been supported yet!")
 
                 location = filename
-                while STORAGE_IMPL.obj_exist(kb.id, location):
+                while location in locations or STORAGE_IMPL.obj_exist(kb.id, location):
                     location += "_"
 
-                blob = file.read()
-                if filetype == FileType.PDF.value:
-                    blob = read_potential_broken_pdf(blob)
-                STORAGE_IMPL.put(kb.id, location, blob)
-
-                doc_id = get_uuid()
-
-                img = thumbnail_img(filename, blob)
-                thumbnail_location = ""
-                if img is not None:
-                    thumbnail_location = f"thumbnail_{doc_id}.png"
-                    STORAGE_IMPL.put(kb.id, thumbnail_location, img)
+                names.add(filename)
+                locations.add(location)
+                pending.append((file, filename, filetype, location, _upload_executor.submit(_store_upload, kb.id, location, file, filetype)))
+            except Exception as e:
+                err.append(file.filename + ": " + str(e))
 
+        for file, filename, filetype, location, fut in pending:
+            try:
+                blob = fut.result()
                 doc = {
-                    "id": doc_id,
+                    "id": get_uuid(),
                     "kb_id": kb.id,
                     "parser_id": self.get_parser(filetype, filename, kb.parser_id),
                     "parser_config": kb.parser_config,
@@ -447,15 +546,17 @@ class FileService(CommonService):
                     "name": filename,
                     "location": location,
                     "size": len(blob),
-                    "thumbnail": thumbnail_location,
+                    "thumbnail": "",
                 }
                 DocumentService.insert(doc)
 
                 FileService.add_file_from_kb(doc, kb_folder["id"], kb.tenant_id)
                 files.append((doc, blob))
+                store_thumbnail(kb.id, doc["id"], filename, kb.id, location)
             except Exception as e:
                 err.append(file.filename + ": " + str(e))
 
+        backfill_thumbnails(kb.id)
         return err, files
 
     @staticmethod
@@ -13,7 +13,12 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import copy
 import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
 
 from langfuse import Langfuse
 
@@ -23,7 +28,69 @@ from api.db.db_models import DB, LLM, LLMFactories, TenantLLM
 from api.db.services.common_service import CommonService
 from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.user_service import TenantService
+from api.utils import get_uuid
 from rag.llm import ChatModel, CvModel, EmbeddingModel, RerankModel, Seq2txtModel, TTSModel
+from rag.utils.redis_conn import REDIS_CONN
+
+MODEL_POOL_TTL = int(os.environ.get("MODEL_POOL_TTL", 300))
+MODEL_POOL_SIZE = int(os.environ.get("MODEL_POOL_SIZE", 512))
+
+
+class ModelPool:
+    """
+    Configured model instances shared within a process, keyed by tenant. Reusing an instance reuses its
+    HTTP client and connections, and saves the DB queries (and the Langfuse auth check) of configuring it.
+    Entries expire after MODEL_POOL_TTL seconds, and are dropped in every process once `invalidate` is
+    called for their tenant: a per tenant version kept in Redis is compared on each lookup.
+    """
+
+    def __init__(self, ttl=MODEL_POOL_TTL, size=MODEL_POOL_SIZE):
+        self.ttl = ttl
+        self.size = size
+        self.stats = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version_key(tenant_id):
+        return f"model_pool_version:{tenant_id}"
+
+    def get(self, tenant_id, key, create):
+        key = (tenant_id, *key)
+        version = REDIS_CONN.get(self._version_key(tenant_id))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                if entry[0] > now and entry[1] == version:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return entry[2]
+                del self._entries[key]
+                self.stats["expirations"] += 1
+
+        value = create()
+        with self._lock:
+            self.stats["creations"] += 1
+            self._entries[key] = (now + self.ttl, version, value)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+        return value
+
+    def invalidate(self, tenant_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == tenant_id]:
+                del self._entries[key]
+                self.stats["invalidations"] += 1
+        REDIS_CONN.set(self._version_key(tenant_id), get_uuid(), 2 * self.ttl)
+
+    def metrics(self):
+        with self._lock:
+            return {"size": len(self._entries), **self.stats}
+
+
+MODEL_POOL = ModelPool()
 
 
 class LLMFactoriesService(CommonService):
@@ -126,7 +193,20 @@ class TenantLLMService(CommonService):
     @classmethod
     @DB.connection_context()
     def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese"):
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+        return cls.pooled_model(tenant_id, llm_type, llm_name, lang)[0]
+
+    @classmethod
+    def pooled_model(cls, tenant_id, llm_type, llm_name=None, lang="Chinese"):
+        # (model instance, model config), shared by the process until the tenant's settings change.
+        def create():
+            model_config = cls.get_model_config(tenant_id, llm_type, llm_name)
+            return cls._model_instance(model_config, llm_type, lang), model_config
+
+        mdl, model_config = MODEL_POOL.get(tenant_id, ("model", llm_type, llm_name, lang), create)
+        return mdl, model_config
+
+    @classmethod
+    def _model_instance(cls, model_config, llm_type, lang="Chinese"):
         if llm_type == LLMType.EMBEDDING.value:
             if model_config["llm_factory"] not in EmbeddingModel:
                 return
@@ -208,26 +288,31 @@ class LLMBundle:
         self.tenant_id = tenant_id
         self.llm_type = llm_type
         self.llm_name = llm_name
-        self.mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang)
+        self.mdl, model_config = TenantLLMService.pooled_model(tenant_id, llm_type, llm_name, lang=lang)
         assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         self.max_length = model_config.get("max_tokens", 8192)
 
         self.is_tools = model_config.get("is_tools", False)
 
+        self.langfuse = MODEL_POOL.get(tenant_id, ("langfuse",), lambda: self._langfuse(tenant_id))
+        if self.langfuse:
+            self.trace = self.langfuse.trace(name=f"{self.llm_type}-{self.llm_name}")
+
+    @staticmethod
+    def _langfuse(tenant_id):
         langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
-        if langfuse_keys:
-            langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
-            if langfuse.auth_check():
-                self.langfuse = langfuse
-                self.trace = self.langfuse.trace(name=f"{self.llm_type}-{self.llm_name}")
-        else:
-            self.langfuse = None
+        if not langfuse_keys:
+            return
+        langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
+        if langfuse.auth_check():
+            return langfuse
 
     def bind_tools(self, toolcall_session, tools):
         if not self.is_tools:
             logging.warning(f"Model {self.llm_name} does not support tool call, but you have assigned one or more tools to it!")
             return
+        # The pooled instance is shared, tools are bound to a copy that keeps its HTTP client.
+        self.mdl = copy.copy(self.mdl)
         self.mdl.bind_tools(toolcall_session, tools)
 
     def encode(self, texts: list):
@@ -13,6 +13,8 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
+import logging
 import os
 import random
 import xxhash
@@ -25,12 +27,13 @@ from api.db.db_models import DB, File2Document, File
 from api.db import StatusEnum, FileType, TaskStatus
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
 from api.db.services.common_service import CommonService
-from api.db.services.document_service import DocumentService
+from api.db.services.document_service import DocumentService, record_task_progress
 from api.utils import current_timestamp, get_uuid
 from deepdoc.parser.excel_parser import RAGFlowExcelParser
 from rag.settings import get_svr_queue_name
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.storage_io import StorageObjectReader
 from api import settings
 from rag.nlp import search
 
@@ -128,6 +131,7 @@ class TaskService(CommonService):
             progress=prog,
             retry_count=docs[0]["retry_count"] + 1,
         ).where(cls.model.id == docs[0]["id"]).execute()
+        record_task_progress(docs[0]["doc_id"], [{"id": docs[0]["id"], "progress": prog}])
 
         if docs[0]["retry_count"] >= 3:
             return None
@@ -179,6 +183,27 @@ class TaskService(CommonService):
         """
         cls.model.update(chunk_ids=chunk_ids).where(cls.model.id == id).execute()
 
+    @classmethod
+    @DB.connection_context()
+    def append_chunk_ids(cls, id: str, chunk_ids: list[str]) -> bool:
+        """Append a group of newly indexed chunk IDs to a task.
+
+        Unlike `update_chunk_ids`, only the new IDs travel to the database, so
+        committing a task's chunks batch by batch costs a constant payload per
+        batch instead of re-sending every ID indexed so far.
+
+        Args:
+            id (str): The unique identifier of the task.
+            chunk_ids (list[str]): Chunk identifiers to append.
+
+        Returns:
+            bool: False if the task no longer exists, True otherwise.
+        """
+        if not chunk_ids:
+            return True
+        return cls.model.update(chunk_ids=cls.model.chunk_ids + (" " + " ".join(chunk_ids))).where(
+            cls.model.id == id).execute() > 0
+
     @classmethod
     @DB.connection_context()
     def get_ongoing_doc_name(cls):
@@ -268,25 +293,78 @@ class TaskService(CommonService):
                         - progress (float, optional): Progress percentage (0.0 to 1.0)
         """
         if os.environ.get("MACOS"):
-            if info["progress_msg"]:
-                task = cls.model.get_by_id(id)
-                progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                cls.model.update(progress=info["progress"]).where(
-                    cls.model.id == id
-                ).execute()
+            cls._update_progress(id, info)
             return
 
         with DB.lock("update_progress", -1):
-            if info["progress_msg"]:
-                task = cls.model.get_by_id(id)
-                progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
-                cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
-            if "progress" in info:
-                cls.model.update(progress=info["progress"]).where(
-                    cls.model.id == id
-                ).execute()
+            cls._update_progress(id, info)
+
+    @classmethod
+    def _update_progress(cls, id, info):
+        task = cls.model.get_by_id(id)
+        progress_msg = task.progress_msg
+        if info["progress_msg"]:
+            progress_msg = trim_header_by_lines(task.progress_msg + "\n" + info["progress_msg"], 3000)
+            cls.model.update(progress_msg=progress_msg).where(cls.model.id == id).execute()
+        if "progress" in info:
+            cls.model.update(progress=info["progress"]).where(
+                cls.model.id == id
+            ).execute()
+        # the document progress is aggregated from these events instead of polling its tasks
+        record_task_progress(task.doc_id, [{
+            "id": id,
+            "progress": info.get("progress", task.progress),
+            "progress_msg": progress_msg,
+            "task_type": task.task_type,
+            "priority": task.priority}])
+
+
+FILE_META_EXPIRE = 7 * 24 * 3600
+
+
+def get_file_meta(doc: dict, bucket: str, name: str, field: str) -> int:
+    """Get the page count ("pages") or row count ("rows") of a stored document.
+
+    Counts are cached in Redis per stored object. On a miss, the object is read with
+    ranged requests through StorageObjectReader, so only the parts of the file holding
+    the page tree or the sheets are fetched; a full download is the fallback for
+    formats that cannot be counted that way.
+
+    Args:
+        doc (dict): Document dictionary, with at least name and size.
+        bucket (str): Storage bucket name where the document is stored.
+        name (str): File name of the document in storage.
+        field (str): "pages" for PDF page count, "rows" for table row count.
+
+    Returns:
+        int: The requested count.
+    """
+    key = f"file_counts:{bucket}/{name}:{doc.get('size', 0)}"
+    meta = REDIS_CONN.get(key)
+    meta = json.loads(meta) if meta else {}
+    if field in meta:
+        return meta[field]
+
+    cnt = None
+    try:
+        with StorageObjectReader(STORAGE_IMPL, bucket, name, doc.get("size")) as reader:
+            if field == "pages":
+                cnt = PdfParser.total_page_number_from_stream(reader)
+            else:
+                cnt = RAGFlowExcelParser.row_number_from_stream(doc["name"], reader)
+            logging.info(f"get_file_meta {bucket}/{name} {field}={cnt}, fetched {reader.bytes_fetched} of {reader.size} bytes")
+    except Exception:
+        logging.exception(f"get_file_meta {bucket}/{name} can't count {field} with ranged reads")
+    if cnt is None:
+        file_bin = STORAGE_IMPL.get(bucket, name)
+        if field == "pages":
+            cnt = PdfParser.total_page_number(doc["name"], file_bin)
+        else:
+            cnt = RAGFlowExcelParser.row_number(doc["name"], file_bin)
+
+    meta[field] = cnt
+    REDIS_CONN.set(key, json.dumps(meta), FILE_META_EXPIRE)
+    return cnt
 
 
 def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
@@ -315,9 +393,8 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
     parse_task_array = []
 
     if doc["type"] == FileType.PDF.value:
-        file_bin = STORAGE_IMPL.get(bucket, name)
         do_layout = doc["parser_config"].get("layout_recognize", "DeepDOC")
-        pages = PdfParser.total_page_number(doc["name"], file_bin)
+        pages = get_file_meta(doc, bucket, name, "pages")
         page_size = doc["parser_config"].get("task_page_size", 12)
         if doc["parser_id"] == "paper":
             page_size = doc["parser_config"].get("task_page_size", 22)
@@ -335,8 +412,7 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
                 parse_task_array.append(task)
 
     elif doc["parser_id"] == "table":
-        file_bin = STORAGE_IMPL.get(bucket, name)
-        rn = RAGFlowExcelParser.row_number(doc["name"], file_bin)
+        rn = get_file_meta(doc, bucket, name, "rows")
         for i in range(0, rn, 3000):
             task = new_task()
             task["from_page"] = i
@@ -378,6 +454,12 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
 
     bulk_insert_into_db(Task, parse_task_array, True)
     DocumentService.begin2parse(doc["id"])
+    record_task_progress(doc["id"], [{
+        "id": task["id"],
+        "progress": task["progress"],
+        "progress_msg": task.get("progress_msg", ""),
+        "task_type": task.get("task_type", ""),
+        "priority": task.get("priority", 0)} for task in parse_task_array], reset=True)
 
     unfinished_task_array = [task for task in parse_task_array if task["progress"] < 1.0]
     for unfinished_task in unfinished_task_array:
@@ -18,6 +18,7 @@ import json
 import logging
 import random
 import time
+import unicodedata
 from base64 import b64encode
 from copy import deepcopy
 from functools import wraps
@@ -32,12 +33,14 @@ from flask import (
     jsonify,
     make_response,
     send_file,
+    stream_with_context,
 )
 from flask import (
     request as flask_request,
 )
 from itsdangerous import URLSafeTimedSerializer
 from peewee import OperationalError
+from werkzeug.datastructures import ContentRange
 from werkzeug.http import HTTP_STATUS_CODES
 
 from api import settings
@@ -45,6 +48,7 @@ from api.constants import REQUEST_MAX_WAIT_SEC, REQUEST_WAIT_SEC
 from api.db.db_models import APIToken
 from api.db.services.llm_service import LLMService, TenantLLMService
 from api.utils import CustomJSONEncoder, get_uuid, json_dumps
+from rag.utils.storage_factory import STORAGE_IMPL
 
 requests.models.complexjson.dumps = functools.partial(json.dumps, cls=CustomJSONEncoder)
 
@@ -207,6 +211,48 @@ def send_file_in_mem(data, filename):
     return send_file(f, as_attachment=True, attachment_filename=filename)
 
 
+def send_storage_object(bucket, name, mimetype="application/octet-stream", download_name=None):
+    """
+    Streams an object of the storage, honouring a single byte range of the request (206 Partial Content),
+    so that large files are served in constant memory and can be seeked by the browser.
+    None if the object is missing, an empty object is sent as an empty 200 whatever the range.
+    """
+    size = STORAGE_IMPL.get_size(bucket, name)
+    if size is None:
+        return None
+
+    status, offset, length = 200, 0, size
+    rng = flask_request.range
+    # No validator to compare an If-Range to, the whole object is sent then, as for several ranges.
+    if size and rng is not None and len(rng.ranges) == 1 and "If-Range" not in flask_request.headers:
+        span = rng.range_for_length(size)
+        if span is None:
+            response = Response(status=416)
+            response.headers["Content-Range"] = ContentRange("bytes", None, None, size).to_header()
+            return response
+        status, offset, length = 206, span[0], span[1] - span[0]
+
+    body = STORAGE_IMPL.get_stream(bucket, name, offset, length) if size else iter(())
+    if body is None:
+        return None
+    response = Response(stream_with_context(body), status=status, mimetype=mimetype, direct_passthrough=True)
+    response.headers["Content-Length"] = str(length)
+    response.headers["Accept-Ranges"] = "bytes"
+    if status == 206:
+        response.headers["Content-Range"] = ContentRange("bytes", offset, offset + length, size).to_header()
+    if download_name:
+        try:
+            download_name.encode("ascii")
+            names = {"filename": download_name}
+        except UnicodeEncodeError:
+            names = {
+                "filename": unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii"),
+                "filename*": "UTF-8''" + quote(download_name, safe="!#$&+^`|~"),
+            }
+        response.headers.set("Content-Disposition", "attachment", **names)
+    return response
+
+
 def get_json_result(code=settings.RetCode.SUCCESS, message="success", data=None):
     response = {"code": code, "message": message, "data": data}
     return jsonify(response)
@@ -167,6 +167,14 @@ def filename_type(filename):
     return FileType.OTHER.value
 
 
+THUMBNAIL_EXTENSIONS = ("pdf", "jpg", "jpeg", "png", "tif", "gif", "icon", "ico", "webp", "ppt", "pptx")
+
+
+def has_thumbnail(filename):
+    """Whether thumbnail_img renders files of this name."""
+    return filename.lower().rsplit(".", 1)[-1] in THUMBNAIL_EXTENSIONS if "." in filename else False
+
+
 def thumbnail_img(filename, blob):
     """
     MySQL LongText max length is 65535
@@ -24,7 +24,8 @@ from rag.nlp import find_codec
 class RAGFlowExcelParser:
 
     @staticmethod
-    def _load_excel_to_workbook(file_like_object):
+    def _load_excel_to_workbook(file_like_object, read_only=False):
+        # With `read_only`, xlsx sheets are parsed while their rows are iterated instead of all at once.
         if isinstance(file_like_object, bytes):
             file_like_object = BytesIO(file_like_object)
 
@@ -45,7 +46,7 @@ class RAGFlowExcelParser:
                 raise Exception(f"****wxy: Failed to parse CSV and convert to Excel Workbook: {e_csv}")
 
         try:
-            return load_workbook(file_like_object,data_only= True)
+            return load_workbook(file_like_object, data_only=True, read_only=read_only)
         except Exception as e:
             logging.info(f"****wxy: openpyxl load error: {e}, try pandas instead")
             try:
@@ -70,73 +71,103 @@ class RAGFlowExcelParser:
 
         return wb
 
+    @staticmethod
+    def sheet_rows(ws):
+        """
+        Number of rows of a worksheet, the number of its last row.
+        A read-only sheet takes it from the <dimension> tag of the file, which some writers leave out, stale or
+        wrong ("A1"): the tag is dropped and the rows counted by reading the sheet instead.
+        """
+        if not hasattr(ws, "reset_dimensions"):
+            return ws.max_row or 0
+        ws.reset_dimensions()
+        return sum(1 for _ in ws.iter_rows(values_only=True))
+
+    @staticmethod
+    def sheet_index(wb):
+        """
+        [(sheet name, number of rows, whether it has a header)] for the worksheets of `wb`.
+        In read-only mode, the sheets are read once to count their rows, without keeping them.
+        """
+        index = []
+        for ws in wb.worksheets:
+            nrows = RAGFlowExcelParser.sheet_rows(ws)
+            header = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+            index.append((ws.title, nrows, any(h is not None for h in header)))
+        return index
+
     def html(self, fnm, chunk_rows=256):
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
+        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object, read_only=True)
         tb_chunks = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
                 continue
 
             tb_rows_0 = "<tr>"
-            for t in list(rows[0]):
-                tb_rows_0 += f"<th>{t.value}</th>"
+            for t in header:
+                tb_rows_0 += f"<th>{t}</th>"
             tb_rows_0 += "</tr>"
 
-            for chunk_i in range((len(rows) - 1) // chunk_rows + 1):
+            def table(chunk):
                 tb = ""
-                tb += f"<table><caption>{sheetname}</caption>"
+                tb += f"<table><caption>{ws.title}</caption>"
                 tb += tb_rows_0
-                for r in list(
-                    rows[1 + chunk_i * chunk_rows: 1 + (chunk_i + 1) * chunk_rows]
-                ):
+                for r in chunk:
                     tb += "<tr>"
-                    for i, c in enumerate(r):
-                        if c.value is None:
+                    for v in r:
+                        if v is None:
                             tb += "<td></td>"
                         else:
-                            tb += f"<td>{c.value}</td>"
+                            tb += f"<td>{v}</td>"
                     tb += "</tr>"
                 tb += "</table>\n"
-                tb_chunks.append(tb)
+                return tb
+
+            chunk = []
+            for r in rows:
+                chunk.append(r)
+                if len(chunk) == chunk_rows:
+                    tb_chunks.append(table(chunk))
+                    chunk = []
+            tb_chunks.append(table(chunk))
+        wb.close()
 
         return tb_chunks
 
     def __call__(self, fnm):
         file_like_object = BytesIO(fnm) if not isinstance(fnm, str) else fnm
-        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object)
+        wb = RAGFlowExcelParser._load_excel_to_workbook(file_like_object, read_only=True)
 
         res = []
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            ti = next(rows, None)
+            if ti is None:
                 continue
-            ti = list(rows[0])
-            for r in list(rows[1:]):
+            for r in rows:
                 fields = []
-                for i, c in enumerate(r):
-                    if not c.value:
+                for i, v in enumerate(r):
+                    if not v:
                         continue
-                    t = str(ti[i].value) if i < len(ti) else ""
-                    t += ("：" if t else "") + str(c.value)
+                    t = str(ti[i]) if i < len(ti) else ""
+                    t += ("：" if t else "") + str(v)
                     fields.append(t)
                 line = "; ".join(fields)
-                if sheetname.lower().find("sheet") < 0:
-                    line += " ——" + sheetname
+                if ws.title.lower().find("sheet") < 0:
+                    line += " ——" + ws.title
                 res.append(line)
+        wb.close()
         return res
 
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
-            total = 0
-            for sheetname in wb.sheetnames:
-                ws = wb[sheetname]
-                total += len(list(ws.rows))
+            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary), read_only=True)
+            total = sum(rows for _, rows, _ in RAGFlowExcelParser.sheet_index(wb))
+            wb.close()
             return total
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
@@ -144,6 +175,24 @@ class RAGFlowExcelParser:
             txt = binary.decode(encoding, errors="ignore")
             return len(txt.split("\n"))
 
+    @staticmethod
+    def row_number_from_stream(fnm, stream):
+        """
+        Counts rows of an xlsx from a seekable stream in read-only mode, which reads the
+        sheets row by row instead of loading every cell. Returns None for other formats.
+        """
+        if fnm.split(".")[-1].lower().find("xls") < 0:
+            return None
+        stream.seek(0)
+        if not stream.read(4).startswith(b'PK\x03\x04'):
+            return None
+        stream.seek(0)
+        wb = load_workbook(stream, read_only=True, data_only=True)
+        try:
+            return sum(RAGFlowExcelParser.sheet_rows(ws) for ws in wb.worksheets)
+        finally:
+            wb.close()
+
 
 if __name__ == "__main__":
     psr = RAGFlowExcelParser()
@@ -20,6 +20,8 @@ import random
 import re
 import sys
 import threading
+from collections import OrderedDict
+from collections.abc import Sequence
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
@@ -38,13 +40,52 @@ from deepdoc.vision import OCR, LayoutRecognizer, Recognizer, TableStructureReco
 from rag.app.picture import vision_llm_chunk as picture_vision_llm_chunk
 from rag.nlp import rag_tokenizer
 from rag.prompts import vision_llm_describe_prompt
-from rag.settings import PARALLEL_DEVICES
+from rag.settings import PARALLEL_DEVICES, PDF_STREAMING_PAGES, PDF_PAGE_QUEUE_SIZE
 
 LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
 
+class PageImageStore(Sequence):
+    """
+    Page images kept PNG-compressed in memory and decoded on access with a tiny LRU,
+    so a task's pages cost a fraction of their bitmaps. PNG is lossless: layout, table
+    and crop results are identical to those obtained from a plain list of images.
+    """
+
+    def __init__(self, cache_size=2):
+        self._pages = []
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def append(self, img):
+        buf = BytesIO()
+        img.save(buf, format="PNG", compress_level=1)
+        with self._lock:
+            self._pages.append(buf.getvalue())
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        with self._lock:
+            if i in self._cache:
+                self._cache.move_to_end(i)
+                return self._cache[i]
+            img = Image.open(BytesIO(self._pages[i]))
+            img.load()
+            self._cache[i] = img
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+            return img
+
+
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
         """
@@ -122,13 +163,19 @@ class RAGFlowPdfParser:
         ]
         return any([re.match(p, b["text"]) for p in proj_patt])
 
-    def _updown_concat_features(self, up, down):
+    def _updown_concat_features(self, up, down, tks=None):
+        # `tks` keeps the tokens of the boxes' ends when the features of many pairs are computed.
+        tks = {} if tks is None else tks
         w = max(self.__char_width(up), self.__char_width(down))
         h = max(self.__height(up), self.__height(down))
         y_dis = self._y_dis(up, down)
         LEN = 6
-        tks_down = rag_tokenizer.tokenize(down["text"][:LEN]).split()
-        tks_up = rag_tokenizer.tokenize(up["text"][-LEN:]).split()
+        if (id(down), "head") not in tks:
+            tks[(id(down), "head")] = rag_tokenizer.tokenize(down["text"][:LEN]).split()
+        if (id(up), "tail") not in tks:
+            tks[(id(up), "tail")] = rag_tokenizer.tokenize(up["text"][-LEN:]).split()
+        tks_down = tks[(id(down), "head")]
+        tks_up = tks[(id(up), "tail")]
         tks_all = up["text"][-LEN:].strip() \
             + (" " if re.match(r"[a-zA-Z0-9]+",
                                up["text"][-1] + down["text"][0]) else "") \
@@ -313,8 +360,9 @@ class RAGFlowPdfParser:
         )
 
         # merge chars in the same rect
+        columns = Recognizer.box_columns(bxs)
         for c in chars:
-            ii = Recognizer.find_overlapped(c, bxs)
+            ii = Recognizer.find_overlapped(c, bxs, columns=columns)
             if ii is None:
                 self.lefted_chars.append(c)
                 continue
@@ -373,74 +421,40 @@ class RAGFlowPdfParser:
 
     def _text_merge(self):
         # merge adjusted boxes
-        bxs = self.boxes
-
-        def end_with(b, txt):
-            txt = txt.strip()
-            tt = b.get("text", "").strip()
-            return tt and tt.find(txt) == len(tt) - len(txt)
-
-        def start_with(b, txts):
-            tt = b.get("text", "").strip()
-            return tt and any([tt.find(t.strip()) == 0 for t in txts])
+        bxs = self.boxes[:1]
 
         # horizontally merge adjacent box with the same layout
-        i = 0
-        while i < len(bxs) - 1:
-            b = bxs[i]
-            b_ = bxs[i + 1]
+        for b_ in self.boxes[1:]:
+            b = bxs[-1]
             if b.get("layoutno", "0") != b_.get("layoutno", "1") or b.get("layout_type", "") in ["table", "figure",
                                                                                                  "equation"]:
-                i += 1
+                bxs.append(b_)
                 continue
             if abs(self._y_dis(b, b_)
-                   ) < self.mean_height[bxs[i]["page_number"] - 1] / 3:
+                   ) < self.mean_height[b["page_number"] - 1] / 3:
                 # merge
-                bxs[i]["x1"] = b_["x1"]
-                bxs[i]["top"] = (b["top"] + b_["top"]) / 2
-                bxs[i]["bottom"] = (b["bottom"] + b_["bottom"]) / 2
-                bxs[i]["text"] += b_["text"]
-                bxs.pop(i + 1)
+                b["x1"] = b_["x1"]
+                b["top"] = (b["top"] + b_["top"]) / 2
+                b["bottom"] = (b["bottom"] + b_["bottom"]) / 2
+                b["text"] += b_["text"]
                 continue
-            i += 1
-            continue
-
-            dis_thr = 1
-            dis = b["x1"] - b_["x0"]
-            if b.get("layout_type", "") != "text" or b_.get(
-                    "layout_type", "") != "text":
-                if end_with(b, "，") or start_with(b_, "（，"):
-                    dis_thr = -8
-                else:
-                    i += 1
-                    continue
-
-            if abs(self._y_dis(b, b_)) < self.mean_height[bxs[i]["page_number"] - 1] / 5 \
-                    and dis >= dis_thr and b["x1"] < b_["x1"]:
-                # merge
-                bxs[i]["x1"] = b_["x1"]
-                bxs[i]["top"] = (b["top"] + b_["top"]) / 2
-                bxs[i]["bottom"] = (b["bottom"] + b_["bottom"]) / 2
-                bxs[i]["text"] += b_["text"]
-                bxs.pop(i + 1)
-                continue
-            i += 1
+            bxs.append(b_)
         self.boxes = bxs
 
     def _naive_vertical_merge(self):
-        bxs = Recognizer.sort_Y_firstly(
+        boxes = Recognizer.sort_Y_firstly(
             self.boxes, np.median(
                 self.mean_height) / 3)
-        i = 0
-        while i + 1 < len(bxs):
-            b = bxs[i]
-            b_ = bxs[i + 1]
+        # `b` is kept, dropped or gets the next boxes merged in, until one is not
+        bxs = []
+        b = boxes[0] if boxes else None
+        for b_ in boxes[1:]:
             if b["page_number"] < b_["page_number"] and re.match(
                     r"[0-9  •一—-]+$", b["text"]):
-                bxs.pop(i)
+                b = b_
                 continue
             if not b["text"].strip():
-                bxs.pop(i)
+                b = b_
                 continue
             concatting_feats = [
                 b["text"].strip()[-1] in ",;:'\"，、‘“；：-",
@@ -468,16 +482,86 @@ class RAGFlowPdfParser:
                     any(feats),
                     any(concatting_feats),
                 ))
-                i += 1
+                bxs.append(b)
+                b = b_
                 continue
             # merge up and down
             b["bottom"] = b_["bottom"]
             b["text"] += b_["text"]
             b["x0"] = min(b["x0"], b_["x0"])
             b["x1"] = max(b["x1"], b_["x1"])
-            bxs.pop(i + 1)
+        if b is not None:
+            bxs.append(b)
         self.boxes = bxs
 
+    def _updown_candidate(self, up, down, concat_between_pages):
+        """
+        Whether `down` may be concatenated under `up`: None if no box further down can be either,
+        False to skip it, True if it's up to the layout or to the up/down model.
+        """
+        ydis = self._y_dis(up, down)
+        smpg = up["page_number"] == down["page_number"]
+        mh = self.mean_height[up["page_number"] - 1]
+        mw = self.mean_width[up["page_number"] - 1]
+        if smpg and ydis > mh * 4:
+            return None
+        if not smpg and ydis > mh * 16:
+            return None
+        if not concat_between_pages and down["page_number"] > up["page_number"]:
+            return None
+
+        if up.get("R", "") != down.get(
+                "R", "") and up["text"][-1] != "，":
+            return False
+
+        if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) \
+                or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) \
+                or not down["text"].strip():
+            return False
+
+        if not down["text"].strip() or not up["text"].strip():
+            return False
+
+        if up["x1"] < down["x0"] - 10 * \
+                mw or up["x0"] > down["x1"] + 10 * mw:
+            return False
+        return True
+
+    def _updown_concat_scores(self, boxes, concat_between_pages):
+        """
+        Scores, with one call of the up/down model, every pair of `boxes` the model is asked about by
+        `_concat_downward` as long as no box has been concatenated: the window of 12 boxes below each box.
+        Returns {(id(up), id(down)): score}.
+        """
+        # Anything failing here is left to `_concat_downward`, which only fails if it does get there.
+        tks = {}
+        pairs, feas = [], []
+        for dp, up in enumerate(boxes, start=1):
+            for i in range(dp, min(dp + 12, len(boxes))):
+                down = boxes[i]
+                try:
+                    candidate = self._updown_candidate(up, down, concat_between_pages)
+                except Exception:
+                    break
+                if candidate is None:
+                    break
+                if not candidate:
+                    continue
+                if i - dp < 5 and up.get("layout_type") == "text":
+                    if up.get("layoutno", "1") == down.get("layoutno", "2"):
+                        break
+                    continue
+                try:
+                    feas.append(self._updown_concat_features(up, down, tks))
+                except Exception:
+                    continue
+                pairs.append((up, down))
+        if not pairs:
+            return {}
+
+        scores = self.updown_cnt_mdl.predict(xgb.DMatrix(feas))
+        return {(id(up), id(down)): s for (up, down), s in zip(pairs, scores)}
+
     def _concat_downward(self, concat_between_pages=True):
         # count boxes in the same row as a feature
         for i in range(len(self.boxes)):
@@ -497,6 +581,16 @@ class RAGFlowPdfParser:
 
         # concat between rows
         boxes = deepcopy(self.boxes)
+        scores = self._updown_concat_scores(boxes, concat_between_pages)
+        tks = {}
+
+        def score(up, down):
+            # Pairs only met once boxes in between have been concatenated weren't scored ahead.
+            if (id(up), id(down)) not in scores:
+                fea = self._updown_concat_features(up, down, tks)
+                scores[(id(up), id(down))] = self.updown_cnt_mdl.predict(xgb.DMatrix([fea]))[0]
+            return scores[(id(up), id(down))]
+
         blocks = []
         while boxes:
             chunks = []
@@ -505,35 +599,11 @@ class RAGFlowPdfParser:
                 chunks.append(up)
                 i = dp
                 while i < min(dp + 12, len(boxes)):
-                    ydis = self._y_dis(up, boxes[i])
-                    smpg = up["page_number"] == boxes[i]["page_number"]
-                    mh = self.mean_height[up["page_number"] - 1]
-                    mw = self.mean_width[up["page_number"] - 1]
-                    if smpg and ydis > mh * 4:
-                        break
-                    if not smpg and ydis > mh * 16:
-                        break
                     down = boxes[i]
-                    if not concat_between_pages and down["page_number"] > up["page_number"]:
+                    candidate = self._updown_candidate(up, down, concat_between_pages)
+                    if candidate is None:
                         break
-
-                    if up.get("R", "") != down.get(
-                            "R", "") and up["text"][-1] != "，":
-                        i += 1
-                        continue
-
-                    if re.match(r"[0-9]{2,3}/[0-9]{3}$", up["text"]) \
-                            or re.match(r"[0-9]{2,3}/[0-9]{3}$", down["text"]) \
-                            or not down["text"].strip():
-                        i += 1
-                        continue
-
-                    if not down["text"].strip() or not up["text"].strip():
-                        i += 1
-                        continue
-
-                    if up["x1"] < down["x0"] - 10 * \
-                            mw or up["x0"] > down["x1"] + 10 * mw:
+                    if not candidate:
                         i += 1
                         continue
 
@@ -546,9 +616,7 @@ class RAGFlowPdfParser:
                         i += 1
                         continue
 
-                    fea = self._updown_concat_features(up, down)
-                    if self.updown_cnt_mdl.predict(
-                            xgb.DMatrix([fea]))[0] <= 0.5:
+                    if score(up, down) <= 0.5:
                         i += 1
                         continue
                     dfs(down, i + 1)
@@ -1000,6 +1068,11 @@ class RAGFlowPdfParser:
         except Exception:
             logging.exception("total_page_number")
 
+    @staticmethod
+    def total_page_number_from_stream(stream):
+        # pypdf only follows the xref to the page tree, so a ranged stream is read sparsely
+        return len(pdf2_read(stream).pages)
+
     def __images__(self, fnm, zoomin=3, page_from=0,
                    page_to=299, callback=None):
         self.lefted_chars = []
@@ -1011,23 +1084,30 @@ class RAGFlowPdfParser:
         self.page_layout = []
         self.page_from = page_from
         start = timer()
+        plumber = None
         try:
             with sys.modules[LOCK_KEY_pdfplumber]:
-                with (pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))) as pdf:
-                    self.pdf = pdf
+                plumber = pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))
+                self.pdf = plumber
+                if PDF_STREAMING_PAGES:
+                    # rendered page by page while OCR is running, see __img_streaming_launcher
+                    self.page_images = PageImageStore()
+                else:
                     self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in
                                         enumerate(self.pdf.pages[page_from:page_to])]
 
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
-
-                    self.total_page = len(self.pdf.pages)
+                try:
+                    self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
+                except Exception as e:
+                    logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                    self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
 
+                self.total_page = len(self.pdf.pages)
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
+        if plumber is not None and not PDF_STREAMING_PAGES:
+            plumber.close()
+            plumber = None
         logging.info(f"__images__ dedupe_chars cost {timer() - start}s")
 
         self.outlines = []
@@ -1057,7 +1137,7 @@ class RAGFlowPdfParser:
             random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i]))))) for i in
             range(len(self.page_chars))]
         if sum([1 if e else 0 for e in self.is_english]) > len(
-                self.page_images) / 2:
+                self.page_chars) / 2:
             self.is_english = True
         else:
             self.is_english = False
@@ -1079,36 +1159,91 @@ class RAGFlowPdfParser:
                 self.__ocr(i + 1, img, chars, zoomin, id)
 
             if callback and i % 6 == 5:
-                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+                callback(prog=(i + 1) * 0.6 / len(self.page_chars), msg="")
 
-        async def __img_ocr_launcher():
-            def __ocr_preprocess():
-                chars = self.page_chars[i] if not self.is_english else []
-                self.mean_height.append(
-                    np.median(sorted([c["height"] for c in chars])) if chars else 0
-                )
-                self.mean_width.append(
-                    np.median(sorted([c["width"] for c in chars])) if chars else 8
-                )
-                self.page_cum_height.append(img.size[1] / zoomin)
-                return chars
+        def __ocr_preprocess(i, img):
+            chars = self.page_chars[i] if not self.is_english else []
+            self.mean_height.append(
+                np.median(sorted([c["height"] for c in chars])) if chars else 0
+            )
+            self.mean_width.append(
+                np.median(sorted([c["width"] for c in chars])) if chars else 8
+            )
+            self.page_cum_height.append(img.size[1] / zoomin)
+            return chars
 
+        async def __img_ocr_launcher():
             if self.parallel_limiter:
                 async with trio.open_nursery() as nursery:
                     for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
+                        chars = __ocr_preprocess(i, img)
 
                         nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars,
                                            self.parallel_limiter[i % PARALLEL_DEVICES])
                         await trio.sleep(0.1)
             else:
                 for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
+                    chars = __ocr_preprocess(i, img)
                     await __img_ocr(i, 0, img, chars, None)
 
+        def __render(page):
+            with sys.modules[LOCK_KEY_pdfplumber]:
+                return page.to_image(resolution=72 * zoomin, antialias=True).annotated
+
+        async def __img_streaming_launcher():
+            # At most PDF_PAGE_QUEUE_SIZE rendered pages wait for OCR, one page per device is OCRed
+            # at a time, and pages are compressed into self.page_images in order once recognized.
+            send_channel, receive_channel = trio.open_memory_channel(max(1, PDF_PAGE_QUEUE_SIZE))
+            limiter = trio.CapacityLimiter(1)
+            in_flight = trio.Semaphore(len(self.parallel_limiter) if self.parallel_limiter else 1)
+
+            async def __producer():
+                async with send_channel:
+                    for page in plumber.pages[page_from:page_to]:
+                        img = await trio.to_thread.run_sync(__render, page)
+                        await send_channel.send(img)
+
+            async def __page(i, img, chars, previous, done):
+                try:
+                    id = i % PARALLEL_DEVICES if self.parallel_limiter else 0
+                    await __img_ocr(i, id, img, chars, self.parallel_limiter[id] if self.parallel_limiter else limiter)
+                    await previous.wait()
+                    await trio.to_thread.run_sync(self.page_images.append, img)
+                finally:
+                    done.set()
+                    in_flight.release()
+
+            async def __consumer():
+                async with receive_channel, trio.open_nursery() as nursery:
+                    i = 0
+                    previous = trio.Event()
+                    previous.set()
+                    while True:
+                        await in_flight.acquire()
+                        try:
+                            img = await receive_channel.receive()
+                        except trio.EndOfChannel:
+                            break
+                        chars = __ocr_preprocess(i, img)
+                        done = trio.Event()
+                        nursery.start_soon(__page, i, img, chars, previous, done)
+                        previous = done
+                        i += 1
+
+            async with trio.open_nursery() as nursery:
+                nursery.start_soon(__producer)
+                nursery.start_soon(__consumer)
+
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        if plumber is not None:
+            try:
+                trio.run(__img_streaming_launcher)
+            finally:
+                with sys.modules[LOCK_KEY_pdfplumber]:
+                    plumber.close()
+        else:
+            trio.run(__img_ocr_launcher)
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
@@ -16,13 +16,16 @@
 
 import logging
 import copy
+import queue
+import threading
 import time
 import os
 
 from huggingface_hub import snapshot_download
 
 from api.utils.file_utils import get_project_base_directory
-from rag.settings import PARALLEL_DEVICES
+from rag.settings import PARALLEL_DEVICES, OCR_SESSIONS, OCR_INTRA_OP_THREADS, OCR_BATCHING, OCR_REC_BATCH_NUM, \
+    OCR_REC_MAX_BATCH, OCR_REC_MAX_WAIT
 from .operators import *  # noqa: F403
 from . import operators
 import math
@@ -67,9 +70,11 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
-def load_model(model_dir, nm, device_id: int | None = None):
+def load_model(model_dir, nm, device_id: int | None = None, session_id: int = 0):
     model_file_path = os.path.join(model_dir, nm + ".onnx")
     model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
+    if session_id:
+        model_cached_tag += f"#{session_id}"
 
     global loaded_models
     loaded_model = loaded_models.get(model_cached_tag)
@@ -93,7 +98,7 @@ def load_model(model_dir, nm, device_id: int | None = None):
     options = ort.SessionOptions()
     options.enable_cpu_mem_arena = False
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
+    options.intra_op_num_threads = OCR_INTRA_OP_THREADS
     options.inter_op_num_threads = 2
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
@@ -126,16 +131,16 @@ def load_model(model_dir, nm, device_id: int | None = None):
 
 
 class TextRecognizer:
-    def __init__(self, model_dir, device_id: int | None = None):
+    def __init__(self, model_dir, device_id: int | None = None, session_id: int = 0):
         self.rec_image_shape = [int(v) for v in "3, 48, 320".split(",")]
-        self.rec_batch_num = 16
+        self.rec_batch_num = OCR_REC_BATCH_NUM
         postprocess_params = {
             'name': 'CTCLabelDecode',
             "character_dict_path": os.path.join(model_dir, "ocr.res"),
             "use_space_char": True
         }
         self.postprocess_op = build_post_process(postprocess_params)
-        self.predictor, self.run_options = load_model(model_dir, 'rec', device_id)
+        self.predictor, self.run_options = load_model(model_dir, 'rec', device_id, session_id)
         self.input_tensor = self.predictor.get_inputs()[0]
 
     def resize_norm_img(self, img, max_wh_ratio):
@@ -397,7 +402,7 @@ class TextRecognizer:
 
 
 class TextDetector:
-    def __init__(self, model_dir, device_id: int | None = None):
+    def __init__(self, model_dir, device_id: int | None = None, session_id: int = 0):
         pre_process_list = [{
             'DetResizeForTest': {
                 'limit_side_len': 960,
@@ -421,7 +426,7 @@ class TextDetector:
                               "unclip_ratio": 1.5, "use_dilation": False, "score_mode": "fast", "box_type": "quad"}
 
         self.postprocess_op = build_post_process(postprocess_params)
-        self.predictor, self.run_options = load_model(model_dir, 'det', device_id)
+        self.predictor, self.run_options = load_model(model_dir, 'det', device_id, session_id)
         self.input_tensor = self.predictor.get_inputs()[0]
 
         img_h, img_w = self.input_tensor.shape[2:]
@@ -509,6 +514,102 @@ class TextDetector:
         return dt_boxes, time.time() - st
 
 
+class OCRInferenceService:
+    """
+    Process-wide CPU OCR inference shared by every OCR instance.
+
+    Detection requests check out one of OCR_SESSIONS detector sessions. Recognition
+    requests from all concurrently parsed pages and documents are queued, and each
+    recognizer session drains the queue into one batch of up to OCR_REC_MAX_BATCH crops
+    (waiting at most OCR_REC_MAX_WAIT seconds for more), which TextRecognizer sorts by
+    aspect ratio into shape buckets of OCR_REC_BATCH_NUM.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, model_dir, sessions=OCR_SESSIONS):
+        sessions = max(1, sessions)
+        self._detectors = queue.Queue()
+        for i in range(sessions):
+            self._detectors.put(TextDetector(model_dir, 0, i))
+        self._requests = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._boxes = 0
+        self._batches = 0
+        self._rec_seconds = 0.
+        self._started = time.time()
+        for i in range(sessions):
+            threading.Thread(name=f"OCRRecognizer-{i}", target=self._recognize_loop,
+                             args=(TextRecognizer(model_dir, 0, i),), daemon=True).start()
+        logging.info(f"OCRInferenceService started {sessions} sessions with {OCR_INTRA_OP_THREADS} threads each")
+
+    @classmethod
+    def get(cls, model_dir):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = OCRInferenceService(model_dir)
+            return cls._instance
+
+    def detect(self, img):
+        detector = self._detectors.get()
+        try:
+            return detector(img)
+        finally:
+            self._detectors.put(detector)
+
+    def recognize(self, img_list):
+        if not img_list:
+            return [], 0
+        st = time.time()
+        req = {"imgs": img_list, "done": threading.Event(), "res": None, "err": None}
+        self._requests.put(req)
+        req["done"].wait()
+        if req["err"] is not None:
+            raise req["err"]
+        return req["res"], time.time() - st
+
+    def _recognize_loop(self, recognizer):
+        while True:
+            reqs = [self._requests.get()]
+            cnt = len(reqs[0]["imgs"])
+            deadline = time.time() + OCR_REC_MAX_WAIT
+            while cnt < OCR_REC_MAX_BATCH:
+                try:
+                    req = self._requests.get(timeout=max(0., deadline - time.time()))
+                except queue.Empty:
+                    break
+                reqs.append(req)
+                cnt += len(req["imgs"])
+
+            try:
+                rec_res, elapse = recognizer([img for req in reqs for img in req["imgs"]])
+                i = 0
+                for req in reqs:
+                    req["res"] = rec_res[i: i + len(req["imgs"])]
+                    i += len(req["imgs"])
+                with self._stats_lock:
+                    self._boxes += cnt
+                    self._batches += 1
+                    self._rec_seconds += elapse
+                    if self._batches % 100 == 0:
+                        logging.info(f"OCRInferenceService {self.stats()}")
+            except Exception as e:
+                for req in reqs:
+                    req["err"] = e
+            finally:
+                for req in reqs:
+                    req["done"].set()
+
+    def stats(self):
+        return {
+            "boxes": self._boxes,
+            "batches": self._batches,
+            "boxes_per_batch": self._boxes / max(1, self._batches),
+            "boxes_per_sec": self._boxes / max(1e-6, self._rec_seconds),
+            "uptime": time.time() - self._started,
+        }
+
+
 class OCR:
     def __init__(self, model_dir=None):
         """
@@ -522,41 +623,43 @@ class OCR:
         ^_-
 
         """
+        self.drop_score = 0.5
+        self.crop_image_res_index = 0
+        self.service = None
         if not model_dir:
             try:
                 model_dir = os.path.join(
                         get_project_base_directory(),
                         "rag/res/deepdoc")
-                
-                # Append muti-gpus task to the list
-                if PARALLEL_DEVICES is not None and PARALLEL_DEVICES > 0:
-                    self.text_detector = []
-                    self.text_recognizer = []
-                    for device_id in range(PARALLEL_DEVICES):
-                        self.text_detector.append(TextDetector(model_dir, device_id))
-                        self.text_recognizer.append(TextRecognizer(model_dir, device_id))
-                else:
-                    self.text_detector = [TextDetector(model_dir, 0)]
-                    self.text_recognizer = [TextRecognizer(model_dir, 0)]
+                self._load_models(model_dir)
 
             except Exception:
                 model_dir = snapshot_download(repo_id="InfiniFlow/deepdoc",
                                               local_dir=os.path.join(get_project_base_directory(), "rag/res/deepdoc"),
                                               local_dir_use_symlinks=False)
-                
+
                 if PARALLEL_DEVICES is not None:
                     assert PARALLEL_DEVICES > 0, "Number of devices must be >= 1"
-                    self.text_detector = []
-                    self.text_recognizer = []
-                    for device_id in range(PARALLEL_DEVICES):
-                        self.text_detector.append(TextDetector(model_dir, device_id))
-                        self.text_recognizer.append(TextRecognizer(model_dir, device_id))
-                else:
-                    self.text_detector = [TextDetector(model_dir, 0)]
-                    self.text_recognizer = [TextRecognizer(model_dir, 0)]
-
-        self.drop_score = 0.5
-        self.crop_image_res_index = 0
+                self._load_models(model_dir)
+        else:
+            self._load_models(model_dir)
+
+    def _load_models(self, model_dir):
+        # the shared service holds the sessions, per-instance ones would only take memory
+        if OCR_BATCHING and not PARALLEL_DEVICES:
+            self.service = OCRInferenceService.get(model_dir)
+            return
+
+        # Append muti-gpus task to the list
+        if PARALLEL_DEVICES is not None and PARALLEL_DEVICES > 0:
+            self.text_detector = []
+            self.text_recognizer = []
+            for device_id in range(PARALLEL_DEVICES):
+                self.text_detector.append(TextDetector(model_dir, device_id))
+                self.text_recognizer.append(TextRecognizer(model_dir, device_id))
+        else:
+            self.text_detector = [TextDetector(model_dir, 0)]
+            self.text_recognizer = [TextRecognizer(model_dir, 0)]
 
     def get_rotate_crop_image(self, img, points):
         '''
@@ -625,7 +728,10 @@ class OCR:
             return None, None, time_dict
 
         start = time.time()
-        dt_boxes, elapse = self.text_detector[device_id](img)
+        if self.service:
+            dt_boxes, elapse = self.service.detect(img)
+        else:
+            dt_boxes, elapse = self.text_detector[device_id](img)
         time_dict['det'] = elapse
 
         if dt_boxes is None:
@@ -642,7 +748,10 @@ class OCR:
 
         img_crop = self.get_rotate_crop_image(ori_im, box)
 
-        rec_res, elapse = self.text_recognizer[device_id]([img_crop])
+        if self.service:
+            rec_res, elapse = self.service.recognize([img_crop])
+        else:
+            rec_res, elapse = self.text_recognizer[device_id]([img_crop])
         text, score = rec_res[0]
         if score < self.drop_score:
             return ""
@@ -651,7 +760,10 @@ class OCR:
     def recognize_batch(self, img_list, device_id: int | None = None):
         if device_id is None:
             device_id = 0
-        rec_res, elapse = self.text_recognizer[device_id](img_list)
+        if self.service:
+            rec_res, elapse = self.service.recognize(img_list)
+        else:
+            rec_res, elapse = self.text_recognizer[device_id](img_list)
         texts = []
         for i in range(len(rec_res)):
             text, score = rec_res[i]
@@ -670,7 +782,10 @@ class OCR:
 
         start = time.time()
         ori_im = img.copy()
-        dt_boxes, elapse = self.text_detector[device_id](img)
+        if self.service:
+            dt_boxes, elapse = self.service.detect(img)
+        else:
+            dt_boxes, elapse = self.text_detector[device_id](img)
         time_dict['det'] = elapse
 
         if dt_boxes is None:
@@ -687,7 +802,10 @@ class OCR:
             img_crop = self.get_rotate_crop_image(ori_im, tmp_box)
             img_crop_list.append(img_crop)
 
-        rec_res, elapse = self.text_recognizer[device_id](img_crop_list)
+        if self.service:
+            rec_res, elapse = self.service.recognize(img_crop_list)
+        else:
+            rec_res, elapse = self.text_recognizer[device_id](img_crop_list)
 
         time_dict['rec'] = elapse
 
@@ -71,44 +71,33 @@ class Recognizer:
         arr = sorted(arr, key=cmp_to_key(cmp))
         return arr
 
+    @staticmethod
+    def _sort_runs(arr, key, sort_key):
+        # Boxes without `key` stay where they are, the runs of boxes in between are sorted by `sort_key`.
+        res, run = [], []
+        for b in arr + [None]:
+            if b is not None and key in b:
+                run.append(b)
+                continue
+            res.extend(sorted(run, key=sort_key))
+            run = []
+            if b is not None:
+                res.append(b)
+        return res
+
     @staticmethod
     def sort_C_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["x0"], r["top"]))
         arr = Recognizer.sort_X_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                # restore the order using th
-                if "C" not in arr[j] or "C" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["C"] < arr[j]["C"] \
-                        or (
-                        arr[j + 1]["C"] == arr[j]["C"]
-                        and arr[j + 1]["top"] < arr[j]["top"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        return Recognizer._sort_runs(arr, "C", lambda b: (b["C"], b["top"]))
 
     @staticmethod
     def sort_R_firstly(arr, thr=0):
         # sort using y1 first and then x1
         # sorted(arr, key=lambda r: (r["top"], r["x0"]))
         arr = Recognizer.sort_Y_firstly(arr, thr)
-        for i in range(len(arr) - 1):
-            for j in range(i, -1, -1):
-                if "R" not in arr[j] or "R" not in arr[j + 1]:
-                    continue
-                if arr[j + 1]["R"] < arr[j]["R"] \
-                        or (
-                        arr[j + 1]["R"] == arr[j]["R"]
-                        and arr[j + 1]["x0"] < arr[j]["x0"]
-                ):
-                    tmp = arr[j]
-                    arr[j] = arr[j + 1]
-                    arr[j + 1] = tmp
-        return arr
+        return Recognizer._sort_runs(arr, "R", lambda b: (b["R"], b["x0"]))
 
     @staticmethod
     def overlapped_area(a, b, ratio=True):
@@ -131,6 +120,27 @@ class Recognizer:
             ov /= (x1 - x0) * (btm - tp)
         return ov
 
+    @staticmethod
+    def box_columns(boxes):
+        """The x0, x1, top and bottom of `boxes` as arrays, to query many boxes against them at once."""
+        return np.array([[b["x0"], b["x1"], b["top"], b["bottom"]] for b in boxes],
+                        dtype=np.float64).reshape(-1, 4).T
+
+    @staticmethod
+    def overlapped_areas(columns, b, ratio=True):
+        """`overlapped_area(a, b, ratio)` for every box `a` of `columns`, see `box_columns`."""
+        x0, x1, tp, btm = columns
+        x0_ = np.maximum(b["x0"], x0)
+        x1_ = np.minimum(b["x1"], x1)
+        tp_ = np.maximum(b["top"], tp)
+        btm_ = np.minimum(b["bottom"], btm)
+        area = (x1 - x0) * (btm - tp)
+        ov = np.where((x1 - x0 != 0) & (btm - tp != 0), (btm_ - tp_) * (x1_ - x0_), 0.)
+        if ratio:
+            ov = np.divide(ov, area, out=ov, where=ov > 0)
+        ov[(b["x0"] > x1) | (b["x1"] < x0) | (b["bottom"] < tp) | (b["top"] > btm)] = 0
+        return ov
+
     @staticmethod
     def layouts_cleanup(boxes, layouts, far=2, thr=0.7):
         def notOverlapped(a, b):
@@ -140,6 +150,7 @@ class Recognizer:
                         a["top"] > b["bottom"]])
 
         i = 0
+        columns = None
         while i + 1 < len(layouts):
             j = i + 1
             while j < min(i + far, len(layouts)) \
@@ -161,12 +172,11 @@ class Recognizer:
                     layouts.pop(i)
                 continue
 
-            area_i, area_i_1 = 0, 0
-            for b in boxes:
-                if not notOverlapped(b, layouts[i]):
-                    area_i += Recognizer.overlapped_area(b, layouts[i], False)
-                if not notOverlapped(b, layouts[j]):
-                    area_i_1 += Recognizer.overlapped_area(b, layouts[j], False)
+            if columns is None:
+                columns = Recognizer.box_columns(boxes)
+            # Summed in order, as box after box.
+            area_i = sum(Recognizer.overlapped_areas(columns, layouts[i], False).tolist())
+            area_i_1 = sum(Recognizer.overlapped_areas(columns, layouts[j], False).tolist())
 
             if area_i > area_i_1:
                 layouts.pop(j)
@@ -215,7 +225,8 @@ class Recognizer:
         return inputs
 
     @staticmethod
-    def find_overlapped(box, boxes_sorted_by_y, naive=False):
+    def find_overlapped(box, boxes_sorted_by_y, naive=False, columns=None):
+        # `columns`: `box_columns(boxes_sorted_by_y)`, worth giving when querying the same boxes many times.
         if not boxes_sorted_by_y:
             return
         bxs = boxes_sorted_by_y
@@ -239,6 +250,13 @@ class Recognizer:
                 e -= 1
             break
 
+        if e - s > 32:
+            # Many candidates left, e.g. when naive: compare them at once.
+            columns = Recognizer.box_columns(bxs[s:e]) if columns is None else columns[:, s:e]
+            ov = Recognizer.overlapped_areas(columns, box)
+            i = int(np.argmax(ov))
+            return s + i if ov[i] > 0 else None
+
         max_overlaped_i, max_overlaped = None, 0
         for i in range(s, e):
             ov = Recognizer.overlapped_area(bxs[i], box)
@@ -408,18 +426,12 @@ class Recognizer:
 
     def __call__(self, image_list, thr=0.7, batch_size=16):
         res = []
-        imgs = []
-        for i in range(len(image_list)):
-            if not isinstance(image_list[i], np.ndarray):
-                imgs.append(np.array(image_list[i]))
-            else:
-                imgs.append(image_list[i])
-
-        batch_loop_cnt = math.ceil(float(len(imgs)) / batch_size)
+        # convert images batch by batch so that only one batch of bitmaps is alive at a time
+        batch_loop_cnt = math.ceil(float(len(image_list)) / batch_size)
         for i in range(batch_loop_cnt):
             start_index = i * batch_size
-            end_index = min((i + 1) * batch_size, len(imgs))
-            batch_image_list = imgs[start_index:end_index]
+            end_index = min((i + 1) * batch_size, len(image_list))
+            batch_image_list = [img if isinstance(img, np.ndarray) else np.array(img) for img in image_list[start_index:end_index]]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
             for ins in inputs:
@@ -14,8 +14,9 @@
 #  limitations under the License.
 #
 import logging
-import itertools
+import os
 import re
+from collections import Counter, defaultdict
 from dataclasses import dataclass
 from typing import Any, Callable
 
@@ -32,6 +33,8 @@ from graphrag.utils import perform_variable_replacements, chat_limiter, GraphCha
 DEFAULT_RECORD_DELIMITER = "##"
 DEFAULT_ENTITY_INDEX_DELIMITER = "<|>"
 DEFAULT_RESOLUTION_RESULT_DELIMITER = "&&"
+# Blocking keys shared by more entities than this are too common to suggest a match
+ENTITY_RESOLUTION_MAX_BUCKET = int(os.environ.get("ENTITY_RESOLUTION_MAX_BUCKET", 1000))
 
 
 @dataclass
@@ -91,7 +94,7 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if (a in subgraph_nodes or b in subgraph_nodes) and self.is_similarity(a, b)]
+            candidate_resolution[k] = self._candidate_pairs(v, subgraph_nodes)
         num_candidates = sum([len(candidates) for _, candidates in candidate_resolution.items()])
         callback(msg=f"Identified {num_candidates} candidate pairs")
 
@@ -181,6 +184,47 @@ class EntityResolution(Extractor):
 
         return ans_list
 
+    def _blocking_keys(self, name):
+        # the characters of every name, is_similarity accepts any two names with 2 of them in common
+        keys = set(name)
+        if is_english(name):
+            # and the bigrams of English names, padded: an edit changes 2 of them at most,
+            # so names within the edit distance is_similarity accepts have one in common
+            name = f"\0{name}\0"
+            keys.update(name[i:i + 2] for i in range(len(name) - 1))
+        return keys
+
+    def _candidate_pairs(self, nodes: list[str], subgraph_nodes: set[str]) -> list[tuple[str, str]]:
+        """
+        Pairs of nodes, with at least one of them from the subgraph, that share a bigram or 2 characters and
+        pass is_similarity. Only nodes sharing blocking keys with a subgraph node are compared, instead of every
+        pair of nodes. Keys of more than ENTITY_RESOLUTION_MAX_BUCKET nodes, such as common letters, are skipped,
+        so pairs having only those in common aren't proposed even if is_similarity would accept them.
+        """
+        index = defaultdict(list)
+        node_keys = {}
+        for node in nodes:
+            node_keys[node] = self._blocking_keys(node)
+            for key in node_keys[node]:
+                index[key].append(node)
+
+        pairs = set()
+        for a in nodes:
+            if a not in subgraph_nodes:
+                continue
+            # a common character counts 1, a common bigram 2: either is enough to be compared
+            counts = Counter()
+            for key in node_keys[a]:
+                if len(index[key]) <= ENTITY_RESOLUTION_MAX_BUCKET:
+                    counts.update(dict.fromkeys(index[key], 2 if len(key) > 1 else 1))
+            for b, cnt in counts.items():
+                if b == a or cnt < 2:
+                    continue
+                pair = (a, b) if a < b else (b, a)
+                if pair not in pairs and self.is_similarity(*pair):
+                    pairs.add(pair)
+        return sorted(pairs)
+
     def is_similarity(self, a, b):
         if is_english(a) and is_english(b):
             if editdistance.eval(a, b) <= min(len(a), len(b)) // 2:
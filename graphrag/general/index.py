@@ -85,6 +85,8 @@ async def run_graphrag(
             subgraph,
             embedding_model,
             callback,
+            # entity resolution writes the whole graph right after
+            with_graph=not with_resolution,
         )
         assert new_graph is not None
 
@@ -94,16 +96,24 @@ async def run_graphrag(
         if with_resolution:
             await graphrag_task_lock.spin_acquire()
             callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
-            await resolve_entities(
-                new_graph,
-                subgraph_nodes,
-                tenant_id,
-                kb_id,
-                doc_id,
-                chat_model,
-                embedding_model,
-                callback,
-            )
+            # resolution merges nodes in place, keep the merged graph the index still matches if it fails
+            merged_graph = new_graph.copy()
+            try:
+                await resolve_entities(
+                    new_graph,
+                    subgraph_nodes,
+                    tenant_id,
+                    kb_id,
+                    doc_id,
+                    chat_model,
+                    embedding_model,
+                    callback,
+                )
+            except Exception:
+                logging.exception(f"run_graphrag {doc_id} entity resolution failed, saving the merged graph")
+                await set_graph(tenant_id, kb_id, embedding_model, merged_graph, GraphChange(), callback)
+                raise
+            del merged_graph
         if with_community:
             await graphrag_task_lock.spin_acquire()
             callback(msg=f"run_graphrag {doc_id} graphrag_task_lock acquired")
@@ -201,6 +211,7 @@ async def merge_subgraph(
     subgraph: nx.Graph,
     embedding_model,
     callback,
+    with_graph=True,
 ):
     start = trio.current_time()
     change = GraphChange()
@@ -213,11 +224,12 @@ async def merge_subgraph(
         new_graph = subgraph
         change.added_updated_nodes = set(new_graph.nodes())
         change.added_updated_edges = set(new_graph.edges())
+        change.updated_sources = set(new_graph.graph["source_id"])
     pr = nx.pagerank(new_graph)
     for node_name, pagerank in pr.items():
         new_graph.nodes[node_name]["pagerank"] = pagerank
 
-    await set_graph(tenant_id, kb_id, embedding_model, new_graph, change, callback)
+    await set_graph(tenant_id, kb_id, embedding_model, new_graph, change, callback, with_graph=with_graph)
     now = trio.current_time()
     callback(
         msg=f"merging subgraph for doc {doc_id} into the global graph done in {now - start:.2f} seconds."
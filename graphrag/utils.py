@@ -19,7 +19,6 @@ import trio
 from typing import Set, Tuple
 
 import networkx as nx
-import numpy as np
 import xxhash
 from networkx.readwrite import json_graph
 import dataclasses
@@ -29,6 +28,7 @@ from api.utils import get_uuid
 from rag.nlp import search, rag_tokenizer
 from rag.utils.doc_store_conn import OrderByExpr
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.tiered_cache import NAMESPACES
 
 GRAPH_FIELD_SEP = "<SEP>"
 
@@ -42,6 +42,8 @@ class GraphChange:
     added_updated_nodes: Set[str] = dataclasses.field(default_factory=set)
     removed_edges: Set[Tuple[str, str]] = dataclasses.field(default_factory=set)
     added_updated_edges: Set[Tuple[str, str]] = dataclasses.field(default_factory=set)
+    # documents whose subgraph has to be rewritten
+    updated_sources: Set[str] = dataclasses.field(default_factory=set)
 
 def perform_variable_replacements(
     input: str, history: list[dict] | None = None, variables: dict | None = None
@@ -92,51 +94,53 @@ def dict_has_keys_with_types(
     return True
 
 
-def get_llm_cache(llmnm, txt, history, genconf):
+def _llm_cache_key(llmnm, txt, history, genconf):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
     hasher.update(str(history).encode("utf-8"))
     hasher.update(str(genconf).encode("utf-8"))
-
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
-        return
-    return bin
+    return hasher.hexdigest()
 
 
-def set_llm_cache(llmnm, txt, v, history, genconf):
+def _embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
-    hasher.update(str(history).encode("utf-8"))
-    hasher.update(str(genconf).encode("utf-8"))
+    # vectors are stored as binary since the "ebd:" prefix, older JSON entries are ignored
+    return "ebd:" + hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    REDIS_CONN.set(k, v.encode("utf-8"), 24*3600)
 
+def get_llm_cache(llmnm, txt, history, genconf):
+    return get_llm_cache_batch(llmnm, [txt], history, genconf)[0]
 
-def get_embed_cache(llmnm, txt):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
-    if not bin:
-        return
-    return np.array(json.loads(bin))
+def set_llm_cache(llmnm, txt, v, history, genconf):
+    set_llm_cache_batch(llmnm, {txt: v}, history, genconf)
+
+
+def get_llm_cache_batch(llmnm, txts: list, history, genconf) -> list:
+    return NAMESPACES["llm"].mget([_llm_cache_key(llmnm, txt, history, genconf) for txt in txts])
+
+
+def set_llm_cache_batch(llmnm, txt2v: dict, history, genconf):
+    NAMESPACES["llm"].mset({_llm_cache_key(llmnm, txt, history, genconf): v for txt, v in txt2v.items()})
+
+
+def get_embed_cache(llmnm, txt):
+    return get_embed_cache_batch(llmnm, [txt])[0]
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    set_embed_cache_batch(llmnm, {txt: arr})
+
+
+def get_embed_cache_batch(llmnm, txts: list) -> list:
+    return NAMESPACES["embed"].mget([_embed_cache_key(llmnm, txt) for txt in txts])
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24*3600)
+
+def set_embed_cache_batch(llmnm, txt2arr: dict):
+    NAMESPACES["embed"].mset({_embed_cache_key(llmnm, txt): arr for txt, arr in txt2arr.items()})
 
 
 def get_tags_from_cache(kb_ids):
@@ -218,12 +222,14 @@ def graph_merge(g1: nx.Graph, g2: nx.Graph, change: GraphChange):
         # A edge's source_id indicates which chunks it came from.
         edge["source_id"] += attr["source_id"]
 
-    for node_degree in g1.degree:
-        g1.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
+    # Only the degree of nodes from g2 could change
+    for node_name, degree in g1.degree(g2.nodes):
+        g1.nodes[node_name]["rank"] = int(degree)
     # A graph's source_id indicates which documents it came from.
     if "source_id" not in g1.graph:
         g1.graph["source_id"] = []
     g1.graph["source_id"] += g2.graph.get("source_id", [])
+    change.updated_sources.update(g2.graph.get("source_id", []))
     return g1
 
 def compute_args_hash(*args):
@@ -429,10 +435,35 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     return result
 
 
-async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
+def source_subgraphs(graph: nx.Graph, sources) -> dict:
+    """Subgraph of each given source, as set_graph stores them."""
+    sources = set(sources)
+    source_nodes = {source: [] for source in sources}
+    for n, attrs in graph.nodes(data=True):
+        for source in sources.intersection(attrs["source_id"]):
+            source_nodes[source].append(n)
+    subgraphs = {}
+    for source, nodes in source_nodes.items():
+        subgraph = graph.subgraph(nodes).copy()
+        subgraph.graph["source_id"] = [source]
+        for n in subgraph.nodes:
+            subgraph.nodes[n]["source_id"] = [source]
+        subgraphs[source] = subgraph
+    return subgraphs
+
+
+async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback, with_graph=True):
+    """
+    Apply a graph change to the index: entities and relations are the source of truth and only the
+    changed ones are rewritten, as are the subgraphs of change.updated_sources.
+    The whole graph blob is only serialized if with_graph, callers chaining several changes write it once.
+    """
     start = trio.current_time()
 
-    await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph"]}, search.index_name(tenant_id), kb_id))
+    if with_graph:
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph"]}, search.index_name(tenant_id), kb_id))
+    if change.updated_sources:
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["subgraph"], "source_id": sorted(change.updated_sources)}, search.index_name(tenant_id), kb_id))
 
     if change.removed_nodes:
         await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id))
@@ -446,32 +477,33 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
     start = now
 
-    chunks = [{
-        "id": get_uuid(),
-        "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
-        "knowledge_graph_kwd": "graph",
-        "kb_id": kb_id,
-        "source_id": graph.graph.get("source_id", []),
-        "available_int": 0,
-        "removed_kwd": "N"
-    }]
-    
-    # generate updated subgraphs
-    for source in graph.graph["source_id"]:
-        subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
-        subgraph.graph["source_id"] = [source]
-        for n in subgraph.nodes:
-            subgraph.nodes[n]["source_id"] = [source]
-        chunks.append({
-            "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(subgraph, edges="edges"), ensure_ascii=False),
-            "knowledge_graph_kwd": "subgraph",
-            "kb_id": kb_id,
-            "source_id": [source],
-            "available_int": 0,
-            "removed_kwd": "N"
-        })
-    
+    def graph_chunks():
+        chunks = []
+        if with_graph:
+            chunks.append({
+                "id": get_uuid(),
+                "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
+                "knowledge_graph_kwd": "graph",
+                "kb_id": kb_id,
+                "source_id": graph.graph.get("source_id", []),
+                "available_int": 0,
+                "removed_kwd": "N"
+            })
+        # generate updated subgraphs
+        for source, subgraph in source_subgraphs(graph, change.updated_sources).items():
+            chunks.append({
+                "id": get_uuid(),
+                "content_with_weight": json.dumps(nx.node_link_data(subgraph, edges="edges"), ensure_ascii=False),
+                "knowledge_graph_kwd": "subgraph",
+                "kb_id": kb_id,
+                "source_id": [source],
+                "available_int": 0,
+                "removed_kwd": "N"
+            })
+        return chunks
+
+    chunks = await trio.to_thread.run_sync(graph_chunks)
+
     async with trio.open_nursery() as nursery:
         for node in change.added_updated_nodes:
             node_attrs = graph.nodes[node]
@@ -598,17 +630,19 @@ async def rebuild_graph(tenant_id, kb_id, exclude_rebuild=None):
                 continue
             
             next_graph = json_graph.node_link_graph(json.loads(d["content_with_weight"]), edges="edges")
-            merged_graph = nx.compose(graph, next_graph)
-            merged_source = {
-                n: graph.nodes[n]["source_id"] + next_graph.nodes[n]["source_id"]
-                for n in graph.nodes & next_graph.nodes
-            }
-            nx.set_node_attributes(merged_graph, merged_source, "source_id")
-            if "source_id" in graph.graph:
-                merged_graph.graph["source_id"] = graph.graph["source_id"] + next_graph.graph["source_id"]
-            else:
-                merged_graph.graph["source_id"] = next_graph.graph["source_id"]
-            graph = merged_graph
+            # Same result as nx.compose(graph, next_graph) with source_id concatenated, but in place
+            # instead of copying the growing graph for every subgraph.
+            for n, attrs in next_graph.nodes(data=True):
+                if graph.has_node(n):
+                    source_id = graph.nodes[n]["source_id"] + attrs["source_id"]
+                    graph.nodes[n].update(attrs)
+                    graph.nodes[n]["source_id"] = source_id
+                else:
+                    graph.add_node(n, **attrs)
+            graph.add_edges_from(next_graph.edges(data=True))
+            source_id = graph.graph.get("source_id", []) + next_graph.graph["source_id"]
+            graph.graph.update(next_graph.graph)
+            graph.graph["source_id"] = source_id
 
     if len(graph.nodes) == 0:
         return None
@@ -15,8 +15,10 @@
 #
 
 import copy
+import json
 import re
 from io import BytesIO
+import xxhash
 from xpinyin import Pinyin
 import numpy as np
 import pandas as pd
@@ -26,53 +28,65 @@ from dateutil.parser import parse as datetime_parse
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from deepdoc.parser.utils import get_text
 from rag.nlp import rag_tokenizer, tokenize
+from rag.utils.redis_conn import REDIS_CONN
 from deepdoc.parser import ExcelParser
 
+SHEET_INDEX_EXPIRE = 24 * 3600
+
 
 class Excel(ExcelParser):
+    @staticmethod
+    def cached_sheet_index(wb, binary):
+        # The tasks of a workbook each take a range of its rows, they share the index of its sheets.
+        key = "excel_sheets:" + xxhash.xxh64(binary).hexdigest()
+        index = REDIS_CONN.get(key)
+        if index:
+            return json.loads(index)
+        index = Excel.sheet_index(wb)
+        REDIS_CONN.set(key, json.dumps(index), SHEET_INDEX_EXPIRE)
+        return index
+
     def __call__(self, fnm, binary=None, from_page=0,
                  to_page=10000000000, callback=None):
         if not binary:
-            wb = Excel._load_excel_to_workbook(fnm)
+            wb = Excel._load_excel_to_workbook(fnm, read_only=True)
+            index = Excel.sheet_index(wb)
         else:
-            wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
+            wb = Excel._load_excel_to_workbook(BytesIO(binary), read_only=True)
+            index = Excel.cached_sheet_index(wb, binary)
 
-        res, fails, done = [], [], 0
+        res, fails = [], []
         rn = 0
-        for sheetname in wb.sheetnames:
-            ws = wb[sheetname]
-            rows = list(ws.rows)
-            if not rows:
+        for sheetname, nrows, has_header in index:
+            if not has_header or nrows < 2:
                 continue
-            headers = [cell.value for cell in rows[0]]
-            missed = set([i for i, h in enumerate(headers) if h is None])
-            headers = [
-                cell.value for i,
-                cell in enumerate(
-                    rows[0]) if i not in missed]
-            if not headers:
+            # The data rows of the sheet, numbered across sheets, are rn, rn + 1, ...
+            nrows -= 1
+            start, end = max(from_page - rn, 0), min(to_page - rn, nrows)
+            rn += nrows
+            if start >= end:
                 continue
+            ws = wb[sheetname]
+            if hasattr(ws, "reset_dimensions"):
+                # Don't pad the rows to the width of the <dimension> tag, it can't be trusted.
+                ws.reset_dimensions()
+            header_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True))
+            missed = set([i for i, h in enumerate(header_row) if h is None])
+            headers = [h for i, h in enumerate(header_row) if i not in missed]
             data = []
-            for i, r in enumerate(rows[1:]):
-                rn += 1
-                if rn - 1 < from_page:
-                    continue
-                if rn - 1 >= to_page:
-                    break
-                row = [
-                    cell.value for ii,
-                    cell in enumerate(r) if ii not in missed]
+            # Only the rows of the range are read, the sheet is parsed up to its end at most.
+            for i, r in enumerate(ws.iter_rows(min_row=2 + start, max_row=1 + end, max_col=len(header_row),
+                                               values_only=True), start=start):
+                row = [v for ii, v in enumerate(r) if ii not in missed]
                 if len(row) != len(headers):
                     fails.append(str(i))
                     continue
                 data.append(row)
-                done += 1
-            if np.array(data).size == 0:
+            data = np.array(data)
+            if data.size == 0:
                 continue
-            res.append(pd.DataFrame(np.array(data), columns=headers))
+            res.append(pd.DataFrame(data, columns=headers))
+        wb.close()
 
         callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
@@ -215,23 +229,25 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000,
                      for i in range(len(clmns))]
 
         eng = lang.lower() == "english"  # is_english(txts)
-        for ii, row in df.iterrows():
+        title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+        # The rows of df.values hold what df.iterrows() gives, without building a Series per row.
+        for row in df.values:
             d = {
                 "docnm_kwd": filename,
-                "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+                "title_tks": title_tks
             }
             row_txt = []
             for j in range(len(clmns)):
-                if row[clmns[j]] is None:
+                if row[j] is None:
                     continue
-                if not str(row[clmns[j]]):
+                if not str(row[j]):
                     continue
-                if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
+                if pd.isna(row[j]):
                     continue
                 fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(
-                    row[clmns[j]])
-                row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
+                d[fld] = row[j] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(
+                    row[j])
+                row_txt.append("{}:{}".format(clmns[j], row[j]))
             if not row_txt:
                 continue
             tokenize(d, "; ".join(row_txt), eng)
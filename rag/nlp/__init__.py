@@ -255,8 +255,19 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def batch_tokenize(ds, ts, eng):
+    """Same as tokenize() for many chunks, going through the tokenizer batch API."""
+    ltks = rag_tokenizer.tokenize_batch([re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in ts])
+    sm_ltks = rag_tokenizer.fine_grained_tokenize_batch(ltks)
+    for d, t, lt, smt in zip(ds, ts, ltks, sm_ltks):
+        d["content_with_weight"] = t
+        d["content_ltks"] = lt
+        d["content_sm_ltks"] = smt
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
     res = []
+    texts = []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -272,12 +283,14 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 pass
         else:
             add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    batch_tokenize(res, texts, eng)
     return res
 
 def tokenize_chunks_with_images(chunks, doc, eng, images):
     res = []
+    texts = []
     # wrap up as es documents
     for ck, image in zip(chunks, images):
         if len(ck.strip()) == 0:
@@ -285,8 +298,9 @@ def tokenize_chunks_with_images(chunks, doc, eng, images):
         logging.debug("-- {}".format(ck))
         d = copy.deepcopy(doc)
         d["image"] = image
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    batch_tokenize(res, texts, eng)
     return res
 
 def tokenize_table(tbls, doc, eng, batch_size=10):
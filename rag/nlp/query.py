@@ -19,6 +19,8 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+
 from rag.utils.doc_store_conn import MatchTextExpr
 from rag.nlp import rag_tokenizer, term_weight, synonym
 
@@ -218,7 +220,6 @@ class FulltextQueryer:
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
         from sklearn.metrics.pairwise import cosine_similarity as CosineSimilarity
-        import numpy as np
 
         sims = CosineSimilarity([avec], bvecs)
         tksim = self.token_similarity(atks, btkss)
@@ -227,18 +228,28 @@ class FulltextQueryer:
         return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
 
     def token_similarity(self, atks, btkss):
-        def toDict(tks):
+        """
+        Same scores as `similarity(toDict(atks), toDict(btks))` for every candidate, but since
+        only the query side is weighted, candidates are reduced to token sets and scored in one
+        matrix product: (1e-9 + hits @ query_weights) / (1e-9 + sum(query_weights)).
+        """
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(int)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        terms = list(qtwt.keys())
+        qw = np.array([qtwt[t] for t in terms], dtype=float)
+
+        hits = np.zeros((len(btkss), len(terms)), dtype=float)
+        for i, tks in enumerate(btkss):
             if isinstance(tks, str):
                 tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = toDict(atks)
-        btkss = [toDict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            tks = tks if isinstance(tks, (set, frozenset)) else set(tks)
+            for j, t in enumerate(terms):
+                if t in tks:
+                    hits[i, j] = 1
+        return ((1e-9 + hits @ qw) / (1e-9 + qw.sum())).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
@@ -22,11 +22,27 @@ import os
 import re
 import string
 import sys
-from hanziconv import HanziConv
+from functools import lru_cache
+from hanziconv.charmap import simplified_charmap, traditional_charmap
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from api.utils.file_utils import get_project_base_directory
 
+# Viterbi segmentation instead of DFS enumeration, output may differ slightly from the default mode
+TOKENIZER_FAST = int(os.environ.get("TOKENIZER_FAST", "0"))
+# Max memoized language spans / fine-grained tokens, 0 disables the cache
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", "100000"))
+# Longer spans fall back to forward maximum matching in the fast mode
+VITERBI_MAX_CHARS = 32
+
+# Full-width to half-width, the ideographic space included
+_Q2B_TABLE = {0x3000: 0x20, **{c: c - 0xfee0 for c in range(0xff00, 0xff5f)}}
+# Same mapping as HanziConv.toSimplified, which converts char by char with the first match in the charmap
+_T2S_TABLE = {}
+for _t, _s in zip(traditional_charmap, simplified_charmap):
+    _T2S_TABLE.setdefault(ord(_t), _s)
+_T2S_TABLE = {k: v for k, v in _T2S_TABLE.items() if chr(k) != v}
+
 
 class RagTokenizer:
     def key_(self, line):
@@ -58,10 +74,14 @@ class RagTokenizer:
         except Exception:
             logging.exception(f"[HUQIE]:Build trie {fnm} failed")
 
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, fast=None, cache_size=TOKENIZER_CACHE_SIZE):
         self.DEBUG = debug
+        self.FAST = TOKENIZER_FAST if fast is None else fast
         self.DENOMINATOR = 1000000
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
+        # results only depend on the trie, so they are memoized until the dictionary changes
+        self._segment = lru_cache(maxsize=cache_size)(self._segment_)
+        self._fine_grained = lru_cache(maxsize=cache_size)(self._fine_grained_)
 
         self.stemmer = PorterStemmer()
         self.lemmatizer = WordNetLemmatizer()
@@ -88,6 +108,7 @@ class RagTokenizer:
         self.loadDict_(self.DIR_ + ".txt")
 
     def loadUserDict(self, fnm):
+        self.clear_cache()
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
             return
@@ -96,25 +117,23 @@ class RagTokenizer:
         self.loadDict_(fnm)
 
     def addUserDict(self, fnm):
+        self.clear_cache()
         self.loadDict_(fnm)
 
+    def clear_cache(self):
+        self._segment.cache_clear()
+        self._fine_grained.cache_clear()
+
+    def cache_info(self):
+        return {"segment": self._segment.cache_info()._asdict(),
+                "fine_grained": self._fine_grained.cache_info()._asdict()}
+
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xfee0
-            if inside_code < 0x0020 or inside_code > 0x7e:  # After the conversion, if it's not a half-width character, return the original character.
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(_Q2B_TABLE)
 
     def _tradi2simp(self, line):
-        return HanziConv.toSimplified(line)
+        return line.translate(_T2S_TABLE)
 
     def dfs_(self, chars, s, preTks, tkslist, _depth=0, _memo=None):
         if _memo is None:
@@ -197,6 +216,67 @@ class RagTokenizer:
         _memo[state_key] = result
         return result
 
+    def viterbi_(self, chars, min_tokens=1):
+        """
+        Best segmentation of chars under score_, without enumerating every path like dfs_.
+        score_ depends on the token count and the count of multi-char tokens, so both are part of
+        the DP state and only the summed frequency is maximized per state.
+        Returns None if there is no segmentation with at least min_tokens tokens.
+        """
+        B = 30  # same as score_
+        n = len(chars)
+        lattice = []
+        for s in range(n):
+            edges = []
+            for e in range(s + 1, n + 1):
+                k = self.key_(chars[s:e])
+                if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
+                    break
+                if k in self.trie_:
+                    edges.append((e, self.trie_[k][0]))
+                elif e == s + 1:
+                    edges.append((e, -12))
+            lattice.append(edges)
+
+        # best[e][(token count, multi-char token count)] = (summed frequency, previous position)
+        best = [{} for _ in range(n + 1)]
+        best[0][(0, 0)] = (0, -1)
+        for s in range(n):
+            for (cnt, lng), (F, _) in best[s].items():
+                for e, f in lattice[s]:
+                    state = (cnt + 1, lng + (e - s > 1))
+                    if state not in best[e] or best[e][state][0] < F + f:
+                        best[e][state] = (F + f, s)
+
+        final = None
+        for (cnt, lng), (F, _) in best[n].items():
+            if cnt < min_tokens:
+                continue
+            sc = (B + lng) / cnt + F
+            if final is None or sc > final[0]:
+                final = (sc, cnt, lng)
+        if final is None:
+            return None
+
+        tks = []
+        _, cnt, lng = final
+        e = n
+        while e > 0:
+            s = best[e][(cnt, lng)][1]
+            tks.append(chars[s:e])
+            cnt, lng = cnt - 1, lng - (e - s > 1)
+            e = s
+        return tks[::-1]
+
+    def best_split_(self, chars):
+        if self.FAST:
+            if len(chars) > VITERBI_MAX_CHARS:
+                return self.maxForward_(chars)[0]
+            return self.viterbi_(chars)
+        tkslist = []
+        self.dfs_(chars, 0, [], tkslist)
+        return self.sortTks_(tkslist)[0][0]
+
     def freq(self, tk):
         k = self.key_(tk)
         if k not in self.trie_:
@@ -326,70 +406,75 @@ class RagTokenizer:
 
         arr = self._split_by_lang(line)
         res = []
-        for L,lang in arr:
-            if not lang:
-                res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
-                continue
-            if len(L) < 2 or re.match(
-                    r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
-                res.append(L)
+        for L, lang in arr:
+            res.extend(self._segment(L, lang))
+
+        res = " ".join(res)
+        logging.debug("[TKS] {}".format(self.merge_(res)))
+        return self.merge_(res)
+
+    def tokenize_batch(self, lines):
+        """Tokenize a batch of texts, identical texts are only tokenized once."""
+        done = {}
+        return [done[line] if line in done else done.setdefault(line, self.tokenize(line)) for line in lines]
+
+    def _segment_(self, L, lang):
+        if not lang:
+            return tuple([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
+        if len(L) < 2 or re.match(
+                r"[a-z\.-]+$", L) or re.match(r"[0-9\.-]+$", L):
+            return (L,)
+
+        res = []
+        # use maxforward for the first time
+        tks, s = self.maxForward_(L)
+        tks1, s1 = self.maxBackward_(L)
+        if self.DEBUG:
+            logging.debug("[FW] {} {}".format(tks, s))
+            logging.debug("[BW] {} {}".format(tks1, s1))
+
+        i, j, _i, _j = 0, 0, 0, 0
+        same = 0
+        while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
+            same += 1
+        if same > 0:
+            res.append(" ".join(tks[j: j + same]))
+        _i = i + same
+        _j = j + same
+        j = _j + 1
+        i = _i + 1
+
+        while i < len(tks1) and j < len(tks):
+            tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
+            if tk1 != tk:
+                if len(tk1) > len(tk):
+                    j += 1
+                else:
+                    i += 1
                 continue
 
-            # use maxforward for the first time
-            tks, s = self.maxForward_(L)
-            tks1, s1 = self.maxBackward_(L)
-            if self.DEBUG:
-                logging.debug("[FW] {} {}".format(tks, s))
-                logging.debug("[BW] {} {}".format(tks1, s1))
+            if tks1[i] != tks[j]:
+                i += 1
+                j += 1
+                continue
+            # backward tokens from_i to i are different from forward tokens from _j to j.
+            res.append(" ".join(self.best_split_("".join(tks[_j:j]))))
 
-            i, j, _i, _j = 0, 0, 0, 0
-            same = 0
+            same = 1
             while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
                 same += 1
-            if same > 0:
-                res.append(" ".join(tks[j: j + same]))
+            res.append(" ".join(tks[j: j + same]))
             _i = i + same
             _j = j + same
             j = _j + 1
             i = _i + 1
 
-            while i < len(tks1) and j < len(tks):
-                tk1, tk = "".join(tks1[_i:i]), "".join(tks[_j:j])
-                if tk1 != tk:
-                    if len(tk1) > len(tk):
-                        j += 1
-                    else:
-                        i += 1
-                    continue
+        if _i < len(tks1):
+            assert _j < len(tks)
+            assert "".join(tks1[_i:]) == "".join(tks[_j:])
+            res.append(" ".join(self.best_split_("".join(tks[_j:]))))
 
-                if tks1[i] != tks[j]:
-                    i += 1
-                    j += 1
-                    continue
-                # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-                same = 1
-                while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
-                    same += 1
-                res.append(" ".join(tks[j: j + same]))
-                _i = i + same
-                _j = j + same
-                j = _j + 1
-                i = _i + 1
-
-            if _i < len(tks1):
-                assert _j < len(tks)
-                assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
-
-        res = " ".join(res)
-        logging.debug("[TKS] {}".format(self.merge_(res)))
-        return self.merge_(res)
+        return tuple(res)
 
     def fine_grained_tokenize(self, tks):
         tks = tks.split()
@@ -400,36 +485,35 @@ class RagTokenizer:
                 res.extend(tk.split("/"))
             return " ".join(res)
 
-        res = []
-        for tk in tks:
-            if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
-                res.append(tk)
-                continue
+        res = [self._fine_grained(tk) for tk in tks]
+        return " ".join(self.english_normalize_(res))
+
+    def fine_grained_tokenize_batch(self, tks_list):
+        done = {}
+        return [done[tks] if tks in done else done.setdefault(tks, self.fine_grained_tokenize(tks)) for tks in tks_list]
+
+    def _fine_grained_(self, tk):
+        if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
+            return tk
+        if len(tk) > 10:
+            return tk
+        if self.FAST:
+            stk = self.viterbi_(tk, min_tokens=2)
+            if stk is None:
+                return tk
+        else:
             tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
+            self.dfs_(tk, 0, [], tkslist)
             if len(tkslist) < 2:
-                res.append(tk)
-                continue
+                return tk
             stk = self.sortTks_(tkslist)[1][0]
-            if len(stk) == len(tk):
-                stk = tk
-            else:
-                if re.match(r"[a-z\.-]+$", tk):
-                    for t in stk:
-                        if len(t) < 3:
-                            stk = tk
-                            break
-                    else:
-                        stk = " ".join(stk)
-                else:
-                    stk = " ".join(stk)
-
-            res.append(stk)
-
-        return " ".join(self.english_normalize_(res))
+        if len(stk) == len(tk):
+            return tk
+        if re.match(r"[a-z\.-]+$", tk):
+            for t in stk:
+                if len(t) < 3:
+                    return tk
+        return " ".join(stk)
 
 
 def is_chinese(s):
@@ -467,6 +551,8 @@ def naiveQie(txt):
 tokenizer = RagTokenizer()
 tokenize = tokenizer.tokenize
 fine_grained_tokenize = tokenizer.fine_grained_tokenize
+tokenize_batch = tokenizer.tokenize_batch
+fine_grained_tokenize_batch = tokenizer.fine_grained_tokenize_batch
 tag = tokenizer.tag
 freq = tokenizer.freq
 loadUserDict = tokenizer.loadUserDict
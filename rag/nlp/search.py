@@ -13,11 +13,13 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import ast
+import json
 import logging
 import re
 import math
-from collections import OrderedDict
 from dataclasses import dataclass
+from functools import lru_cache
 
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import rmSpace, get_float
@@ -29,6 +31,22 @@ from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionE
 def index_name(uid): return f"ragflow_{uid}"
 
 
+@lru_cache(maxsize=65536)
+def parse_rank_features(txt: str) -> tuple:
+    """Parses a stored tag feature field (JSON, or a Python dict literal for older chunks) into (tags, scores)."""
+    try:
+        feas = json.loads(txt)
+    except Exception:
+        try:
+            feas = ast.literal_eval(txt)
+        except Exception:
+            logging.warning(f"Can't parse rank features: {txt[:64]}")
+            feas = {}
+    if not isinstance(feas, dict):
+        return (), np.zeros(0)
+    return tuple(feas.keys()), np.array([get_float(v) for v in feas.values()], dtype=float)
+
+
 class Dealer:
     def __init__(self, dataStore: DocStoreConnection):
         self.qryr = query.FulltextQueryer()
@@ -263,18 +281,20 @@ class Dealer:
 
         q_denor = np.sqrt(np.sum([s*s for t,s in query_rfea.items() if t != PAGERANK_FLD]))
         for i in search_res.ids:
-            nor, denor = 0, 0
-            if not search_res.field[i].get(TAG_FLD):
+            feas = search_res.field[i].get(TAG_FLD)
+            if not feas:
                 rank_fea.append(0)
                 continue
-            for t, sc in eval(search_res.field[i].get(TAG_FLD, "{}")).items():
-                if t in query_rfea:
-                    nor += query_rfea[t] * sc
-                denor += sc * sc
+            if isinstance(feas, dict):
+                tags, scores = tuple(feas.keys()), np.array(list(feas.values()), dtype=float)
+            else:
+                tags, scores = parse_rank_features(feas)
+            denor = np.dot(scores, scores)
             if denor == 0:
                 rank_fea.append(0)
-            else:
-                rank_fea.append(nor/np.sqrt(denor)/q_denor)
+                continue
+            qsc = np.array([query_rfea.get(t, 0) for t in tags], dtype=float)
+            rank_fea.append(np.dot(qsc, scores)/np.sqrt(denor)/q_denor)
         return np.array(rank_fea)*10. + pageranks
 
     def rerank(self, sres, query, tkweight=0.3,
@@ -284,26 +304,30 @@ class Dealer:
         _, keywords = self.qryr.question(query)
         vector_size = len(sres.query_vector)
         vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        ins_embd = np.zeros((len(sres.ids), vector_size), dtype=float)
+        for j, chunk_id in enumerate(sres.ids):
+            vector = sres.field[chunk_id].get(vector_column)
+            if vector is None:
+                continue
+            if isinstance(vector, str):
+                try:
+                    vector = np.array(vector.split("\t"), dtype=float)
+                except ValueError:
+                    vector = [get_float(v) for v in vector.split("\t")]
+            ins_embd[j] = vector
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # token_similarity only tests which query terms a chunk contains, so sets are enough
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
+            tks = set(sres.field[i][cfield].split())
+            tks.update(sres.field[i].get("title_tks", "").split())
+            tks.update(sres.field[i].get("question_tks", "").split())
+            tks.update(sres.field[i].get("important_kwd", []))
             ins_tw.append(tks)
 
         ## For rank feature(tag_fea) scores.
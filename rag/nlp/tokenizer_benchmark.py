@@ -0,0 +1,123 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Throughput of RagTokenizer modes, in chars/sec over tokenize + fine_grained_tokenize,
+against the previous implementation (char-by-char normalization, HanziConv, DFS, no caches).
+
+    python -m rag.nlp.tokenizer_benchmark [text files...] [--rounds N]
+
+Every distinct non-empty line of the files is a chunk. Without files, the clauses of a small
+built-in corpus are paired into distinct chunks. Caches are cleared before each round, so
+they only pay off on spans repeated across chunks.
+"""
+import argparse
+import itertools
+import re
+import time
+
+from hanziconv import HanziConv
+
+from rag.nlp.rag_tokenizer import RagTokenizer
+
+SAMPLES = [
+    "公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。使用外汇投资的，可通过债券持有人在香港人民币业务清算行及香港地区经批准可进入境内银行间外汇市场进行交易的境外人民币业务参加行（以下统称香港结算行）办理外汇资金兑换。",
+    "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。目的是通过这种方式为学区房降温，把就近入学落到实处。南京市长江大桥",
+    "实际上当时他们已经将业务中心偏移到安全部门和针对政府企业的部门 Scripts are compiled and cached aaaaaaaaa",
+    "涡轮增压发动机num最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义,黄黄爱美食,不过，今天阿奇要讲到的这家农贸市场，说实话，还真蛮有特色的！",
+    "數據分析項目經理|數據分析挖掘|數據分析方向|商品數據分析|搜索數據分析 sql python hive tableau Cocos2d-",
+    "Unity3D开发经验 测试开发工程师 c++双11双11 985 211 ＡＢＣ全角字符",
+]
+
+
+class LegacyRagTokenizer(RagTokenizer):
+    """RagTokenizer before the translate tables, caches, fast mode and batch API."""
+
+    def __init__(self):
+        super().__init__(fast=False, cache_size=0)
+
+    def _strQ2B(self, ustring):
+        rstring = ""
+        for uchar in ustring:
+            inside_code = ord(uchar)
+            if inside_code == 0x3000:
+                inside_code = 0x0020
+            else:
+                inside_code -= 0xfee0
+            if inside_code < 0x0020 or inside_code > 0x7e:
+                rstring += uchar
+            else:
+                rstring += chr(inside_code)
+        return rstring
+
+    def _tradi2simp(self, line):
+        return HanziConv.toSimplified(line)
+
+    def tokenize_batch(self, lines):
+        return [self.tokenize(line) for line in lines]
+
+    def fine_grained_tokenize_batch(self, tks_list):
+        return [self.fine_grained_tokenize(tks) for tks in tks_list]
+
+
+def builtin_corpus():
+    clauses = [c.strip() for sample in SAMPLES for c in re.split(r"[，。,|！（）]", sample) if c.strip()]
+    return [a + "，" + b for a, b in itertools.permutations(dict.fromkeys(clauses), 2)]
+
+
+def run(tknzr, lines, rounds):
+    chars = sum(len(line) for line in lines) * rounds
+    elapsed = 0.
+    for _ in range(rounds):
+        tknzr.clear_cache()
+        start = time.perf_counter()
+        ltks = tknzr.tokenize_batch(lines)
+        tknzr.fine_grained_tokenize_batch(ltks)
+        elapsed += time.perf_counter() - start
+    return chars / elapsed, ltks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RagTokenizer throughput benchmark")
+    parser.add_argument("files", nargs="*", help="text files, one chunk per line")
+    parser.add_argument("--rounds", type=int, default=3, help="passes over the corpus")
+    args = parser.parse_args()
+
+    lines = []
+    for fnm in args.files:
+        with open(fnm, "r", encoding="utf-8") as f:
+            lines.extend([line.strip() for line in f if line.strip()])
+    # tokenize_batch only tokenizes identical chunks once
+    lines = list(dict.fromkeys(lines)) or builtin_corpus()
+
+    modes = [
+        ("previous", LegacyRagTokenizer()),
+        ("exact, no cache", RagTokenizer(fast=False, cache_size=0)),
+        ("exact, cached", RagTokenizer(fast=False)),
+        ("fast, no cache", RagTokenizer(fast=True, cache_size=0)),
+        ("fast, cached", RagTokenizer(fast=True)),
+    ]
+    baseline, reference = None, None
+    print(f"{len(lines)} chunks, {sum(len(line) for line in lines)} chars, {args.rounds} rounds")
+    for name, tknzr in modes:
+        cps, ltks = run(tknzr, lines, args.rounds)
+        if baseline is None:
+            baseline, reference = cps, ltks
+        same = sum(1 for a, b in zip(ltks, reference) if a == b) / len(lines)
+        print(f"{name:<16} {cps:>12,.0f} chars/sec  x{cps / baseline:<6.2f} identical to previous: {same:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,13 @@
 #  limitations under the License.
 #
 import logging
+import os
 import re
+import time
+
 import umap
 import numpy as np
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.mixture import GaussianMixture
 import trio
 
@@ -29,6 +33,19 @@ from graphrag.utils import (
 )
 from rag.utils import truncate
 
+# "full" evaluates all the cluster counts. "coarse" evaluates a grid of them then refines around the best one,
+# it's faster but may settle on another local minimum of the BIC, so the clusters can differ.
+RAPTOR_BIC_SEARCH = os.environ.get("RAPTOR_BIC_SEARCH", "full")
+# Layers with more chunks are clustered by MiniBatchKMeans, with the cluster count chosen on a sample.
+# 0, the default, keeps GaussianMixture for every layer.
+RAPTOR_KMEANS_THRESHOLD = int(os.environ.get("RAPTOR_KMEANS_THRESHOLD", 0))
+RAPTOR_BIC_SAMPLE = int(os.environ.get("RAPTOR_BIC_SAMPLE", 1000))
+
+def gmm_bic(embeddings: np.ndarray, n: int, random_state: int) -> float:
+    gm = GaussianMixture(n_components=n, random_state=random_state)
+    gm.fit(embeddings)
+    return gm.bic(embeddings)
+
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
     def __init__(
@@ -65,16 +82,63 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         set_embed_cache(self._embd_model.llm_name, txt, embds)
         return embds
 
+    def _eval_bics(self, embeddings: np.ndarray, n_clusters: list[int], random_state: int, bics: dict):
+        for n in n_clusters:
+            if n not in bics:
+                bics[n] = gmm_bic(embeddings, n, random_state)
+
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int):
         max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
-        bics = []
-        for n in n_clusters:
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
-        optimal_clusters = n_clusters[np.argmin(bics)]
-        return optimal_clusters
+        n_clusters = list(range(1, max_clusters))
+        bics = {}
+        step = int(len(n_clusters) ** 0.5)
+        if RAPTOR_BIC_SEARCH == "coarse" and step > 2:
+            self._eval_bics(embeddings, n_clusters[::step] + n_clusters[-1:], random_state, bics)
+            best = min(bics, key=lambda n: (bics[n], n))
+            self._eval_bics(embeddings, [n for n in n_clusters if abs(n - best) < step], random_state, bics)
+        else:
+            self._eval_bics(embeddings, n_clusters, random_state, bics)
+        # the smallest count among the best BIC, like np.argmin
+        return min(bics, key=lambda n: (bics[n], n))
+
+    def _cluster(self, embeddings, random_state: int):
+        """Cluster one layer, returns the cluster count, the label of each embedding and the timing."""
+        start = time.perf_counter()
+        n_neighbors = int((len(embeddings) - 1) ** 0.8)
+        reduced_embeddings = umap.UMAP(
+            n_neighbors=max(2, n_neighbors),
+            n_components=min(12, len(embeddings) - 2),
+            metric="cosine",
+        ).fit_transform(embeddings)
+        umap_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if RAPTOR_KMEANS_THRESHOLD > 0 and len(reduced_embeddings) > RAPTOR_KMEANS_THRESHOLD:
+            sample = reduced_embeddings
+            if len(sample) > RAPTOR_BIC_SAMPLE:
+                rng = np.random.default_rng(random_state)
+                sample = sample[rng.choice(len(sample), RAPTOR_BIC_SAMPLE, replace=False)]
+            n_clusters = self._get_optimal_clusters(sample, random_state)
+            if n_clusters == 1:
+                lbls = [0 for _ in range(len(reduced_embeddings))]
+            else:
+                km = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=3)
+                km.fit(reduced_embeddings)
+                # renumber to skip empty clusters
+                _, lbls = np.unique(km.labels_, return_inverse=True)
+                n_clusters = int(lbls.max()) + 1
+                lbls = lbls.tolist()
+        else:
+            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state)
+            if n_clusters == 1:
+                lbls = [0 for _ in range(len(reduced_embeddings))]
+            else:
+                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
+                gm.fit(reduced_embeddings)
+                probs = gm.predict_proba(reduced_embeddings)
+                lbls = [np.where(prob > self._threshold)[0] for prob in probs]
+                lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+        return n_clusters, lbls, (umap_elapsed, time.perf_counter() - start)
 
     async def __call__(self, chunks, random_state, callback=None):
         if len(chunks) <= 1:
@@ -131,21 +195,9 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                 end = len(chunks)
                 continue
 
-            n_neighbors = int((len(embeddings) - 1) ** 0.8)
-            reduced_embeddings = umap.UMAP(
-                n_neighbors=max(2, n_neighbors),
-                n_components=min(12, len(embeddings) - 2),
-                metric="cosine",
-            ).fit_transform(embeddings)
-            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state)
-            if n_clusters == 1:
-                lbls = [0 for _ in range(len(reduced_embeddings))]
-            else:
-                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-                gm.fit(reduced_embeddings)
-                probs = gm.predict_proba(reduced_embeddings)
-                lbls = [np.where(prob > self._threshold)[0] for prob in probs]
-                lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+            n_clusters, lbls, (umap_elapsed, cluster_elapsed) = await trio.to_thread.run_sync(
+                lambda: self._cluster(embeddings, random_state))
+            summarize_start = time.perf_counter()
 
             async with trio.open_nursery() as nursery:
                 for c in range(n_clusters):
@@ -159,10 +211,13 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
             )
             labels.extend(lbls)
             layers.append((end, len(chunks)))
+            layer_timing = "umap {:.2f}s, clustering {:.2f}s, summarizing {:.2f}s".format(
+                umap_elapsed, cluster_elapsed, time.perf_counter() - summarize_start)
+            logging.info("RAPTOR layer {}: {} -> {}, {}".format(len(layers) - 1, end - start, len(chunks) - end, layer_timing))
             if callback:
                 callback(
-                    msg="Cluster one layer: {} -> {}".format(
-                        end - start, len(chunks) - end
+                    msg="Cluster one layer: {} -> {} ({})".format(
+                        end - start, len(chunks) - end, layer_timing
                     )
                 )
             start = end
@@ -57,6 +57,20 @@ except Exception:
     pass
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
 
+# Rasterize PDF pages lazily into a bounded queue feeding OCR instead of rendering every page up front
+PDF_STREAMING_PAGES = int(os.environ.get("PDF_STREAMING_PAGES", "0"))
+PDF_PAGE_QUEUE_SIZE = int(os.environ.get("PDF_PAGE_QUEUE_SIZE", "2"))
+
+# Process-wide OCR inference: cross-page recognition batching, number of CPU ONNX sessions, and threads per session,
+# which are the cores shared among the sessions only when batching is on
+OCR_BATCHING = int(os.environ.get("OCR_BATCHING", "0"))
+OCR_SESSIONS = int(os.environ.get("OCR_SESSIONS", "1"))
+OCR_INTRA_OP_THREADS = int(os.environ.get("OCR_INTRA_OP_THREADS",
+                                          str(max(2, (os.cpu_count() or 2) // max(1, OCR_SESSIONS)) if OCR_BATCHING else 2)))
+OCR_REC_BATCH_NUM = int(os.environ.get("OCR_REC_BATCH_NUM", "16"))
+OCR_REC_MAX_BATCH = int(os.environ.get("OCR_REC_MAX_BATCH", "256"))
+OCR_REC_MAX_WAIT = float(os.environ.get("OCR_REC_MAX_WAIT", "0.05"))
+
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
 PAGERANK_FLD = "pagerank_fea"
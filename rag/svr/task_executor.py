@@ -23,7 +23,7 @@ import time
 
 from api.utils.log_utils import initRootLogger, get_project_base_directory
 from graphrag.general.index import run_graphrag
-from graphrag.utils import get_llm_cache, set_llm_cache, get_tags_from_cache, set_tags_to_cache
+from graphrag.utils import get_llm_cache_batch, set_llm_cache, get_tags_from_cache, set_tags_to_cache
 from rag.prompts import keyword_extraction, question_proposal, content_tagging
 
 import logging
@@ -48,7 +48,7 @@ from peewee import DoesNotExist
 
 from api.db import LLMType, ParserType, TaskStatus
 from api.db.services.document_service import DocumentService
-from api.db.services.llm_service import LLMBundle
+from api.db.services.llm_service import MODEL_POOL, LLMBundle
 from api.db.services.task_service import TaskService
 from api.db.services.file2document_service import File2DocumentService
 from api import settings
@@ -59,8 +59,9 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
 from rag.settings import DOC_MAXIMUM_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
-from rag.utils import num_tokens_from_string, truncate
+from rag.utils import num_tokens_from_string, encoder
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.tiered_cache import cache_stats
 from rag.utils.storage_factory import STORAGE_IMPL
 from graphrag.utils import chat_limiter
 
@@ -100,10 +101,18 @@ CURRENT_TASKS = {}
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+MAX_CONCURRENT_EMBEDDING = int(os.environ.get('MAX_CONCURRENT_EMBEDDING', "4"))
 task_limiter = trio.CapacityLimiter(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
+embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_EMBEDDING)
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
+DOC_BULK_SIZE = int(os.environ.get('DOC_BULK_SIZE', "64"))
+DOC_BULK_BYTES = int(os.environ.get('DOC_BULK_BYTES', str(8 * 1024 * 1024)))
+DOC_BULK_LATENCY = float(os.environ.get('DOC_BULK_LATENCY', "5"))
+MAX_CONCURRENT_BULK = int(os.environ.get('MAX_CONCURRENT_BULK', "4"))
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', "64"))
+EMBEDDING_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', "16384"))
 stop_event = threading.Event()
 
 
@@ -315,8 +324,7 @@ async def build_chunks(task, progress_callback):
         progress_callback(msg="Start to generate keywords for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
 
-        async def doc_keyword_extraction(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "keywords", {"topn": topn})
+        async def doc_keyword_extraction(chat_mdl, d, topn, cached):
             if not cached:
                 async with chat_limiter:
                     cached = await trio.to_thread.run_sync(lambda: keyword_extraction(chat_mdl, d["content_with_weight"], topn))
@@ -325,9 +333,11 @@ async def build_chunks(task, progress_callback):
                 d["important_kwd"] = cached.split(",")
                 d["important_tks"] = rag_tokenizer.tokenize(" ".join(d["important_kwd"]))
             return
+        topn = task["parser_config"]["auto_keywords"]
+        cached = get_llm_cache_batch(chat_mdl.llm_name, [d["content_with_weight"] for d in docs], "keywords", {"topn": topn})
         async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_keyword_extraction, chat_mdl, d, task["parser_config"]["auto_keywords"])
+            for d, c in zip(docs, cached):
+                nursery.start_soon(doc_keyword_extraction, chat_mdl, d, topn, c)
         progress_callback(msg="Keywords generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     if task["parser_config"].get("auto_questions", 0):
@@ -335,8 +345,7 @@ async def build_chunks(task, progress_callback):
         progress_callback(msg="Start to generate questions for every chunk ...")
         chat_mdl = LLMBundle(task["tenant_id"], LLMType.CHAT, llm_name=task["llm_id"], lang=task["language"])
 
-        async def doc_question_proposal(chat_mdl, d, topn):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], "question", {"topn": topn})
+        async def doc_question_proposal(chat_mdl, d, topn, cached):
             if not cached:
                 async with chat_limiter:
                     cached = await trio.to_thread.run_sync(lambda: question_proposal(chat_mdl, d["content_with_weight"], topn))
@@ -344,9 +353,11 @@ async def build_chunks(task, progress_callback):
             if cached:
                 d["question_kwd"] = cached.split("\n")
                 d["question_tks"] = rag_tokenizer.tokenize("\n".join(d["question_kwd"]))
+        topn = task["parser_config"]["auto_questions"]
+        cached = get_llm_cache_batch(chat_mdl.llm_name, [d["content_with_weight"] for d in docs], "question", {"topn": topn})
         async with trio.open_nursery() as nursery:
-            for d in docs:
-                nursery.start_soon(doc_question_proposal, chat_mdl, d, task["parser_config"]["auto_questions"])
+            for d, c in zip(docs, cached):
+                nursery.start_soon(doc_question_proposal, chat_mdl, d, topn, c)
         progress_callback(msg="Question generation {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     if task["kb_parser_config"].get("tag_kb_ids", []):
@@ -377,8 +388,7 @@ async def build_chunks(task, progress_callback):
             else:
                 docs_to_tag.append(d)
 
-        async def doc_content_tagging(chat_mdl, d, topn_tags):
-            cached = get_llm_cache(chat_mdl.llm_name, d["content_with_weight"], all_tags, {"topn": topn_tags})
+        async def doc_content_tagging(chat_mdl, d, topn_tags, cached):
             if not cached:
                 picked_examples = random.choices(examples, k=2) if len(examples)>2 else examples
                 if not picked_examples:
@@ -390,9 +400,10 @@ async def build_chunks(task, progress_callback):
             if cached:
                 set_llm_cache(chat_mdl.llm_name, d["content_with_weight"], cached, all_tags, {"topn": topn_tags})
                 d[TAG_FLD] = json.loads(cached)
+        cached = get_llm_cache_batch(chat_mdl.llm_name, [d["content_with_weight"] for d in docs_to_tag], all_tags, {"topn": topn_tags})
         async with trio.open_nursery() as nursery:
-            for d in docs_to_tag:
-                nursery.start_soon(doc_content_tagging, chat_mdl, d, topn_tags)
+            for d, c in zip(docs_to_tag, cached):
+                nursery.start_soon(doc_content_tagging, chat_mdl, d, topn_tags, c)
         progress_callback(msg="Tagging {} chunks completed in {:.2f}s".format(len(docs), timer() - st))
 
     return docs
@@ -403,10 +414,29 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
+def embedding_batches(lengths: list[int], token_budget: int, max_size: int = EMBEDDING_BATCH_SIZE) -> list[list[int]]:
+    """
+    Buckets texts by token length so that texts of similar length share a batch.
+    Texts are visited from the longest to the shortest, and a batch is closed once its
+    padded cost (size * longest text) would exceed the token budget.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches, batch, width = [], [], 1
+    for i in order:
+        if batch and (len(batch) >= max_size or width * (len(batch) + 1) > token_budget):
+            batches.append(batch)
+            batch = []
+        if not batch:
+            width = max(1, lengths[i])
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 async def embedding(docs, mdl, parser_config=None, callback=None):
     if parser_config is None:
         parser_config = {}
-    batch_size = 16
     tts, cnts = [], []
     for d in docs:
         tts.append(d.get("docnm_kwd", "Title"))
@@ -419,35 +449,167 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         cnts.append(c)
 
     tk_count = 0
+    title_vec = None
     if len(tts) == len(cnts):
         vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
-        tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
+        title_vec = np.asarray(vts[0], dtype=np.float32)
         tk_count += c
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), batch_size):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode([truncate(c, mdl.max_length-10) for c in cnts[i: i + batch_size]]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
+    max_len = mdl.max_length - 10
+    lengths = []
+    for i, c in enumerate(cnts):
+        tks = encoder.encode(c)
+        if len(tks) > max_len:
+            cnts[i] = encoder.decode(tks[:max_len])
+        lengths.append(min(len(tks), max_len))
+
+    vects = None
+    done = 0
+
+    async def encode_batch(idx):
+        nonlocal vects, tk_count, done
+        async with embed_limiter:
+            vts, c = await trio.to_thread.run_sync(lambda: mdl.encode([cnts[i] for i in idx]))
+        vts = np.asarray(vts, dtype=np.float32)
+        if vects is None:
+            vects = np.empty((len(cnts), vts.shape[1]), dtype=np.float32)
+        vects[idx] = vts
         tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+        done += len(idx)
+        callback(prog=0.7 + 0.2 * done / len(cnts), msg="")
 
-    title_w = float(parser_config.get("filename_embd_weight", 0.1))
-    vects = (title_w * tts + (1 - title_w) *
-             cnts) if len(tts) == len(cnts) else cnts
+    async with trio.open_nursery() as nursery:
+        for idx in embedding_batches(lengths, max(EMBEDDING_BATCH_TOKENS, max_len)):
+            nursery.start_soon(encode_batch, idx)
+
+    if title_vec is not None:
+        title_w = float(parser_config.get("filename_embd_weight", 0.1))
+        vects *= 1 - title_w
+        vects += title_w * title_vec
 
     assert len(vects) == len(docs)
-    vector_size = 0
+    vector_size = vects.shape[1]
     for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+        d["q_%d_vec" % vector_size] = vects[i]
     return tk_count, vector_size
 
 
+def estimate_chunk_bytes(d: dict) -> int:
+    """Cheap upper bound of the serialized size of a chunk, used to bound bulk requests."""
+    size = 0
+    for k, v in d.items():
+        size += len(k) + 4
+        if isinstance(v, str):
+            size += len(v.encode("utf-8")) + 2
+        elif isinstance(v, (list, tuple, np.ndarray)):
+            size += 20 * len(v) if len(v) and not isinstance(v[0], str) else sum(len(str(x)) + 3 for x in v)
+        else:
+            size += len(str(v))
+    return size
+
+
+def next_bulk(chunks, sizes, start, max_docs, max_bytes):
+    """Returns the end of the bulk starting at `start`, bounded by both chunk count and bytes."""
+    end, total = start, 0
+    while end < len(chunks) and end - start < max_docs:
+        if end > start and total + sizes[end] > max_bytes:
+            break
+        total += sizes[end]
+        end += 1
+    return end
+
+
+def is_bulk_overloaded(errors: list[str]) -> bool:
+    return any(re.search(r"(429|rejected|too many requests|circuit_break|timeout|time out)", str(e), re.IGNORECASE) for e in errors)
+
+
+async def index_chunks(task, chunks, progress_callback):
+    """
+    Writes chunks into the doc store with adaptive bulk requests.
+
+    Bulks are bounded by DOC_BULK_SIZE chunks and DOC_BULK_BYTES bytes, and up to
+    MAX_CONCURRENT_BULK of them are in flight at once. Overload errors or bulks slower
+    than DOC_BULK_LATENCY halve the bulk size and concurrency (retrying the rejected
+    bulk); fast bulks grow them back. The chunk ids of every wave of bulks are
+    appended to the task with one DB write.
+
+    Returns False if the task was canceled or deleted meanwhile.
+    """
+    idxnm = search.index_name(task["tenant_id"])
+    kb_id = task["kb_id"]
+    sizes = [estimate_chunk_bytes(ck) for ck in chunks]
+    limits = {"docs": max(1, DOC_BULK_SIZE), "inflight": max(1, MAX_CONCURRENT_BULK)}
+    stats = {"bulks": 0, "retries": 0, "slowest": 0.}
+    TaskService.update_chunk_ids(task["id"], "")
+
+    async def delete_image(kb_id, chunk_id):
+        try:
+            async with minio_limiter:
+                STORAGE_IMPL.delete(kb_id, chunk_id)
+        except Exception:
+            logging.exception(
+                "Deleting image of chunk {}/{}/{} got exception".format(task["location"], task["name"], chunk_id))
+            raise
+
+    async def insert_bulk(bulk):
+        attempt = 0
+        while True:
+            st = timer()
+            errors = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(bulk, idxnm, kb_id))
+            elapsed = timer() - st
+            stats["bulks"] += 1
+            stats["slowest"] = max(stats["slowest"], elapsed)
+            if elapsed > DOC_BULK_LATENCY:
+                limits["docs"] = max(1, limits["docs"] // 2)
+            if not errors:
+                return
+            if not is_bulk_overloaded(errors) or attempt >= 3:
+                error_message = f"Insert chunk error: {errors}, please check log file and Elasticsearch/Infinity status!"
+                progress_callback(-1, msg=error_message)
+                raise Exception(error_message)
+            attempt += 1
+            stats["retries"] += 1
+            limits["docs"] = max(1, limits["docs"] // 2)
+            limits["inflight"] = max(1, limits["inflight"] // 2)
+            logging.warning(f"Doc store is overloaded, retry bulk of {len(bulk)} chunks in {2 ** attempt}s: {errors[:1]}")
+            await trio.sleep(2 ** attempt)
+
+    b = 0
+    while b < len(chunks):
+        wave = []
+        for _ in range(limits["inflight"]):
+            if b >= len(chunks):
+                break
+            e = next_bulk(chunks, sizes, b, limits["docs"], DOC_BULK_BYTES)
+            wave.append(chunks[b:e])
+            b = e
+        wave_start = timer()
+        async with trio.open_nursery() as nursery:
+            for bulk in wave:
+                nursery.start_soon(insert_bulk, bulk)
+        if timer() - wave_start < DOC_BULK_LATENCY / 2:
+            limits["docs"] = min(DOC_BULK_SIZE, limits["docs"] * 2)
+            limits["inflight"] = min(MAX_CONCURRENT_BULK, limits["inflight"] + 1)
+
+        chunk_ids = [chunk["id"] for bulk in wave for chunk in bulk]
+        if TaskService.do_cancel(task["id"]):
+            progress_callback(-1, msg="Task has been canceled.")
+            return False
+        progress_callback(prog=0.8 + 0.1 * b / len(chunks), msg="")
+        if not TaskService.append_chunk_ids(task["id"], chunk_ids):
+            logging.warning(f"index_chunks append_chunk_ids failed since task {task['id']} is unknown.")
+            chunk_ids = [chunk["id"] for chunk in chunks[:b]]
+            await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, idxnm, kb_id))
+            async with trio.open_nursery() as nursery:
+                for chunk_id in chunk_ids:
+                    nursery.start_soon(delete_image, kb_id, chunk_id)
+            return False
+
+    logging.info("index_chunks({}) {} chunks in {} bulks, {} retries, slowest bulk {:.2f}s".format(
+        task["name"], len(chunks), stats["bulks"], stats["retries"], stats["slowest"]))
+    return True
+
+
 async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
     chunks = []
     vctr_nm = "q_%d_vec"%vector_size
@@ -580,42 +742,9 @@ async def do_handle_task(task):
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
     start_ts = timer()
-    doc_store_result = ""
-    es_bulk_size = 4
-
-    async def delete_image(kb_id, chunk_id):
-        try:
-            async with minio_limiter:
-                STORAGE_IMPL.delete(kb_id, chunk_id)
-        except Exception:
-            logging.exception(
-                "Deleting image of chunk {}/{}/{} got exception".format(task["location"], task["name"], chunk_id))
-            raise
+    if not await index_chunks(task, chunks, progress_callback):
+        return
 
-    for b in range(0, len(chunks), es_bulk_size):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + es_bulk_size], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = TaskService.do_cancel(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + es_bulk_size]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task["id"], chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
-                    nursery.start_soon(delete_image, task_dataset_id, chunk_id)
-            return
-        
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
                                                                                      task_to_page, len(chunks),
                                                                                      timer() - start_ts))
@@ -681,6 +810,8 @@ async def report_status():
                 "done": DONE_TASKS,
                 "failed": FAILED_TASKS,
                 "current": current,
+                "cache": cache_stats(),
+                "model_pool": MODEL_POOL.metrics(),
             })
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
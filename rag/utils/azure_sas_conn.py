@@ -77,6 +77,35 @@ class RAGFlowAzureSasBlob:
                 time.sleep(1)
         return
 
+    def get_size(self, bucket, fnm):
+        try:
+            return self.conn.get_blob_client(fnm).get_blob_properties().size
+        except Exception:
+            logging.exception(f"fail stat {bucket}/{fnm}")
+        return
+
+    def get_range(self, bucket, fnm, offset, length):
+        for _ in range(3):
+            try:
+                return self.conn.download_blob(fnm, offset=offset, length=length).readall()
+            except Exception:
+                logging.exception(f"fail get {bucket}/{fnm} [{offset}, {offset + length})")
+                self.__open__()
+                time.sleep(1)
+        return
+
+    def get_stream(self, bucket, fnm, offset=0, length=None):
+        """
+        The blob, or `length` bytes of it from `offset`, as an iterator of chunks.
+        None if it can't be opened.
+        """
+        try:
+            return self.conn.download_blob(fnm, offset=offset, length=length).chunks()
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} from {offset}")
+            self.__open__()
+        return
+
     def obj_exist(self, bucket, fnm):
         try:
             return self.conn.get_blob_client(fnm).exists()
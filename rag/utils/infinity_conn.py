@@ -28,6 +28,7 @@ from infinity.errors import ErrorCode
 from rag import settings
 from rag.settings import PAGERANK_FLD
 from rag.utils import singleton
+import numpy as np
 import pandas as pd
 from api.utils.file_utils import get_project_base_directory
 
@@ -516,6 +517,9 @@ class InfinityConnection(DocStoreConnection):
                 elif k in ["page_num_int", "top_int"]:
                     assert isinstance(v, list)
                     d[k] = "_".join(f"{num:08x}" for num in v)
+                elif isinstance(v, np.ndarray):
+                    # embeddings come as float32 arrays from the task executor, the SDK takes lists
+                    d[k] = v.tolist()
                 else:
                     d[k] = v
 
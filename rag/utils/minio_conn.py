@@ -93,6 +93,49 @@ class RAGFlowMinio:
                 time.sleep(1)
         return
 
+    def get_size(self, bucket, filename):
+        try:
+            return self.conn.stat_object(bucket, filename).size
+        except Exception:
+            logging.exception(f"Fail to stat {bucket}/{filename}")
+        return
+
+    def get_range(self, bucket, filename, offset, length):
+        for _ in range(3):
+            r = None
+            try:
+                r = self.conn.get_object(bucket, filename, offset=offset, length=length)
+                return r.read()
+            except Exception:
+                logging.exception(f"Fail to get {bucket}/{filename} [{offset}, {offset + length})")
+                self.__open__()
+                time.sleep(1)
+            finally:
+                if r is not None:
+                    r.close()
+                    r.release_conn()
+        return
+
+    def get_stream(self, bucket, filename, offset=0, length=None, chunk_size=1024 * 1024):
+        """
+        The object, or `length` bytes of it from `offset`, as an iterator of chunks.
+        None if it can't be opened.
+        """
+        try:
+            r = self.conn.get_object(bucket, filename, offset=offset, length=length or 0)
+        except Exception:
+            logging.exception(f"Fail to get {bucket}/{filename} from {offset}")
+            self.__open__()
+            return
+
+        def chunks():
+            try:
+                yield from r.stream(chunk_size)
+            finally:
+                r.close()
+                r.release_conn()
+        return chunks()
+
     def obj_exist(self, bucket, filename):
         try:
             if not self.conn.bucket_exists(bucket):
@@ -61,6 +61,7 @@ class RedisDB:
 
     def __init__(self):
         self.REDIS = None
+        self.REDIS_BIN = None
         self.config = settings.REDIS
         self.__open__()
 
@@ -78,6 +79,14 @@ class RedisDB:
                 password=self.config.get("password"),
                 decode_responses=True,
             )
+            # shares the connection settings, but returns bytes for binary payloads
+            self.REDIS_BIN = redis.StrictRedis(
+                host=self.config["host"].split(":")[0],
+                port=int(self.config.get("host", ":6379").split(":")[1]),
+                db=int(self.config.get("db", 1)),
+                password=self.config.get("password"),
+                decode_responses=False,
+            )
             self.register_scripts()
         except Exception:
             logging.warning("Redis can't be connected.")
@@ -112,6 +121,30 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget(self, keys: list[str], binary=False) -> list:
+        if not self.REDIS or not keys:
+            return [None] * len(keys)
+        try:
+            return (self.REDIS_BIN if binary else self.REDIS).mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(keys[:3]) + " got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset(self, kvs: dict, exp=3600, binary=False) -> bool:
+        if not kvs:
+            return True
+        try:
+            pipe = (self.REDIS_BIN if binary else self.REDIS).pipeline(transaction=False)
+            for k, v in kvs.items():
+                pipe.set(k, v, exp)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(list(kvs.keys())[:3]) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -159,6 +192,41 @@ class RedisDB:
             self.__open__()
         return None
 
+    def spop(self, key: str, count: int) -> list:
+        try:
+            return self.REDIS.spop(key, count) or []
+        except Exception as e:
+            logging.warning("RedisDB.spop " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
+    def hset(self, key: str, mapping: dict, exp=3600, reset=False) -> bool:
+        try:
+            pipe = self.REDIS.pipeline(transaction=True)
+            if reset:
+                pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, exp)
+            pipe.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.hset " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def hgetall(self, keys: list[str]) -> list[dict]:
+        if not keys:
+            return []
+        try:
+            pipe = self.REDIS.pipeline(transaction=False)
+            for k in keys:
+                pipe.hgetall(k)
+            return pipe.execute()
+        except Exception as e:
+            logging.warning("RedisDB.hgetall " + str(keys[:3]) + " got exception: " + str(e))
+            self.__open__()
+        return [{} for _ in keys]
+
     def zadd(self, key: str, member: str, score: float):
         try:
             self.REDIS.zadd(key, {member: score})
@@ -152,6 +152,52 @@ class RAGFlowS3:
                 time.sleep(1)
         return
 
+    @use_prefix_path
+    @use_default_bucket
+    def get_size(self, bucket, fnm):
+        try:
+            return self.conn.head_object(Bucket=bucket, Key=fnm)['ContentLength']
+        except Exception:
+            logging.exception(f"fail head {bucket}/{fnm}")
+        return
+
+    @use_prefix_path
+    @use_default_bucket
+    def get_range(self, bucket, fnm, offset, length):
+        for _ in range(3):
+            try:
+                r = self.conn.get_object(Bucket=bucket, Key=fnm, Range=f"bytes={offset}-{offset + length - 1}")
+                return r['Body'].read()
+            except Exception:
+                logging.exception(f"fail get {bucket}/{fnm} [{offset}, {offset + length})")
+                self.__open__()
+                time.sleep(1)
+        return
+
+    @use_prefix_path
+    @use_default_bucket
+    def get_stream(self, bucket, fnm, offset=0, length=None, chunk_size=1024 * 1024):
+        """
+        The object, or `length` bytes of it from `offset`, as an iterator of chunks.
+        None if it can't be opened.
+        """
+        kwargs = {}
+        if offset or length:
+            kwargs["Range"] = f"bytes={offset}-{offset + length - 1}" if length else f"bytes={offset}-"
+        try:
+            body = self.conn.get_object(Bucket=bucket, Key=fnm, **kwargs)['Body']
+        except Exception:
+            logging.exception(f"fail get {bucket}/{fnm} from {offset}")
+            self.__open__()
+            return
+
+        def chunks():
+            try:
+                yield from body.iter_chunks(chunk_size)
+            finally:
+                body.close()
+        return chunks()
+
     @use_prefix_path
     @use_default_bucket
     def obj_exist(self, bucket, fnm):
@@ -0,0 +1,98 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import io
+import logging
+from collections import OrderedDict
+
+
+class StorageObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over a stored object. Bytes are fetched in fixed-size
+    blocks with ranged reads on demand and kept in a small LRU, so parsers that only need
+    a few structures of a file (a PDF's xref and page tree, an xlsx's zip directory and
+    sheet dimensions) never download it whole.
+    """
+
+    def __init__(self, storage, bucket, name, size=None, block_size=256 * 1024, max_blocks=32):
+        super().__init__()
+        self.storage = storage
+        self.bucket = bucket
+        self.name = name
+        self.size = size if size else storage.get_size(bucket, name)
+        if self.size is None:
+            raise FileNotFoundError(f"{bucket}/{name}")
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.bytes_fetched = 0
+        self._blocks = OrderedDict()
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if pos < 0:
+            raise ValueError(f"negative seek position {pos}")
+        self._pos = pos
+        return pos
+
+    def _block(self, no):
+        if no in self._blocks:
+            self._blocks.move_to_end(no)
+            return self._blocks[no]
+        offset = no * self.block_size
+        data = self.storage.get_range(self.bucket, self.name, offset, min(self.block_size, self.size - offset))
+        if data is None:
+            raise IOError(f"Fail to read {self.bucket}/{self.name} at {offset}")
+        self.bytes_fetched += len(data)
+        self._blocks[no] = data
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return data
+
+    def readinto(self, b):
+        n = 0
+        view = memoryview(b).cast("B")
+        while n < len(view) and self._pos < self.size:
+            no, off = divmod(self._pos, self.block_size)
+            data = self._block(no)[off: off + len(view) - n]
+            if not data:
+                break
+            view[n: n + len(data)] = data
+            n += len(data)
+            self._pos += len(data)
+        return n
+
+    def close(self):
+        if not self.closed:
+            logging.debug(f"StorageObjectReader {self.bucket}/{self.name}: fetched {self.bytes_fetched} of {self.size} bytes")
+            self._blocks.clear()
+        super().close()
@@ -0,0 +1,136 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from rag.utils.redis_conn import REDIS_CONN
+
+
+class CacheNamespace:
+    """
+    A family of cached values sharing a TTL in Redis and a byte budget in the process-wide L1.
+    Values are either `str` (LLM outputs) or vectors (`binary=True`), which are stored as raw
+    float16/float32 bytes prefixed with a one-byte dtype tag instead of JSON text.
+    """
+
+    DTYPES = {b"h": np.float16, b"f": np.float32}
+
+    def __init__(self, name, ttl, l1_bytes, binary=False, dtype="float16"):
+        self.name = name
+        self.ttl = ttl
+        self.l1_bytes = l1_bytes
+        self.binary = binary
+        self.dtype = np.dtype(dtype)
+        self._l1 = OrderedDict()
+        self._l1_size = 0
+        self._lock = threading.Lock()
+        self.stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "sets": 0, "bytes_read": 0, "bytes_written": 0}
+
+    def encode(self, v):
+        if not self.binary:
+            return v.encode("utf-8")
+        tag = b"h" if self.dtype == np.float16 else b"f"
+        return tag + np.asarray(v, dtype=self.dtype).tobytes()
+
+    def decode(self, b):
+        if not self.binary:
+            return b
+        return np.frombuffer(b[1:], dtype=self.DTYPES[b[:1]]).astype(np.float32)
+
+    def _l1_get(self, k):
+        with self._lock:
+            if k not in self._l1:
+                return None
+            self._l1.move_to_end(k)
+            self.stats["l1_hits"] += 1
+            return self._l1[k]
+
+    def _l1_put(self, k, v, size):
+        if size > self.l1_bytes:
+            return
+        with self._lock:
+            if k in self._l1:
+                return
+            self._l1[k] = (v, size)
+            self._l1_size += size
+            while self._l1_size > self.l1_bytes:
+                _, (_, sz) = self._l1.popitem(last=False)
+                self._l1_size -= sz
+
+    def mget(self, keys: list[str]) -> list:
+        res = [None] * len(keys)
+        missed = []
+        for i, k in enumerate(keys):
+            hit = self._l1_get(k)
+            if hit is not None:
+                res[i] = hit[0]
+            else:
+                missed.append(i)
+        if not missed:
+            return res
+
+        vals = REDIS_CONN.mget([keys[i] for i in missed], binary=self.binary)
+        with self._lock:
+            for i, b in zip(missed, vals):
+                if b is None:
+                    self.stats["misses"] += 1
+                    continue
+                self.stats["l2_hits"] += 1
+                self.stats["bytes_read"] += len(b)
+        for i, b in zip(missed, vals):
+            if b is None:
+                continue
+            res[i] = self.decode(b)
+            self._l1_put(keys[i], res[i], len(b))
+        return res
+
+    def mset(self, kvs: dict):
+        enc = {k: self.encode(v) for k, v in kvs.items() if v is not None}
+        if not enc:
+            return
+        REDIS_CONN.mset(enc, self.ttl, binary=self.binary)
+        with self._lock:
+            self.stats["sets"] += len(enc)
+            self.stats["bytes_written"] += sum(len(b) for b in enc.values())
+        for k, b in enc.items():
+            self._l1_put(k, self.decode(b) if self.binary else kvs[k], len(b))
+
+
+NAMESPACES = {
+    "llm": CacheNamespace("llm",
+                          int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+                          int(os.environ.get("LLM_CACHE_L1_BYTES", str(64 * 1024 * 1024)))),
+    "embed": CacheNamespace("embed",
+                            int(os.environ.get("EMBED_CACHE_TTL", str(7 * 24 * 3600))),
+                            int(os.environ.get("EMBED_CACHE_L1_BYTES", str(128 * 1024 * 1024))),
+                            binary=True,
+                            dtype=os.environ.get("EMBED_CACHE_DTYPE", "float16")),
+}
+
+
+def cache_stats() -> dict:
+    stats = {}
+    for name, ns in NAMESPACES.items():
+        s = dict(ns.stats)
+        lookups = s["l1_hits"] + s["l2_hits"] + s["misses"]
+        s["hit_rate"] = round((s["l1_hits"] + s["l2_hits"]) / lookups, 4) if lookups else 0.
+        s["l1_bytes"] = ns._l1_size
+        stats[name] = s
+    return stats
@@ -33,13 +33,20 @@ class Session(Base):
                 self.__session_type = "agent"
         super().__init__(rag, res_dict)
 
-    def ask(self, question="", stream=True, **kwargs):
+    def ask(self, question="", stream=True, delta=False, **kwargs):
+        """
+        With stream and delta, chat answers are sent as increments and the reference only once,
+        the yielded messages still hold the whole answer so far.
+        """
         if self.__session_type == "agent":
             res = self._ask_agent(question, stream)
         elif self.__session_type == "chat":
+            if stream and delta:
+                kwargs["delta"] = True
             res = self._ask_chat(question, stream, **kwargs)
 
         if stream:
+            answer = ""
             for line in res.iter_lines():
                 line = line.decode("utf-8")
                 if line.startswith("{"):
@@ -50,7 +57,10 @@ class Session(Base):
                 json_data = json.loads(line[5:])
                 if json_data["data"] is True or json_data["data"].get("running_status"):
                     continue
-                answer = json_data["data"]["answer"]
+                if "answer" in json_data["data"]:
+                    answer = json_data["data"]["answer"]
+                else:
+                    answer += json_data["data"].get("delta", "")
                 reference = json_data["data"].get("reference", {})
                 temp_dict = {
                     "content": answer,